@@ -0,0 +1,92 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""
+Compare a benchmark report against a baseline
+
+    python -m benchmarks.compare benchmarks/baselines/small.json current.json --threshold 1.25
+
+Exits with status 1 when any stage is slower (or uses more memory) than the threshold ratio allows
+"""
+
+import argparse
+import json
+import sys
+import typing
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float=1.25, memory_threshold: float=1.25) \
+        -> typing.List[dict]:
+    """
+    Compare the stages of two benchmark reports
+    :param baseline: The baseline report
+    :param current: The current report
+    :param threshold: The largest acceptable ratio of the current to the baseline time
+    :param memory_threshold: The largest acceptable ratio of the current to the baseline peak memory
+    :return: One comparison per stage in both reports
+    """
+    comparisons = []
+    for stage, base in baseline['results'].items():
+        if stage not in current['results']:
+            continue
+        now = current['results'][stage]
+        time_ratio = now['seconds_min'] / base['seconds_min'] if base['seconds_min'] > 0 else float('inf')
+        memory_ratio = None
+        if base.get('peak_bytes') and now.get('peak_bytes') is not None:
+            memory_ratio = now['peak_bytes'] / base['peak_bytes']
+        comparisons.append({'stage': stage,
+                            'baseline_seconds': base['seconds_min'],
+                            'current_seconds': now['seconds_min'],
+                            'time_ratio': time_ratio,
+                            'memory_ratio': memory_ratio,
+                            'regression': time_ratio > threshold or (memory_ratio is not None and
+                                                                     memory_ratio > memory_threshold)})
+    return comparisons
+
+
+def main(argv: typing.Sequence[str]=None) -> int:
+    parser = argparse.ArgumentParser(description='Compare a pMPO benchmark report against a baseline')
+    parser.add_argument('baseline', help='The baseline JSON report')
+    parser.add_argument('current', help='The current JSON report')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Acceptable time ratio [default: 1.25]')
+    parser.add_argument('--memory-threshold', type=float, default=1.25,
+                        help='Acceptable peak memory ratio [default: 1.25]')
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get('config') != current.get('config'):
+        print("Warning: the reports were run on different tables", file=sys.stderr)
+    comparisons = compare_reports(baseline, current, threshold=args.threshold,
+                                  memory_threshold=args.memory_threshold)
+    print("{:<35} {:>12} {:>12} {:>8} {:>8}".format('stage', 'baseline s', 'current s', 'time', 'memory'))
+    for c in comparisons:
+        print("{:<35} {:>12.4f} {:>12.4f} {:>7.2f}x {:>8} {}".format(
+            c['stage'], c['baseline_seconds'], c['current_seconds'], c['time_ratio'],
+            '-' if c['memory_ratio'] is None else '{:.2f}x'.format(c['memory_ratio']),
+            'REGRESSION' if c['regression'] else ''))
+    return 1 if any(c['regression'] for c in comparisons) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
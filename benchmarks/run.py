@@ -0,0 +1,189 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""
+Time and memory-profile the pMPO stages on a synthetic descriptor table
+
+    python -m benchmarks.run --preset small --output benchmarks/baselines/small.json
+    python -m benchmarks.compare benchmarks/baselines/small.json current.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import typing
+import numpy as np
+import pandas as pd
+import scipy
+from collections import OrderedDict
+from pMPO import __version__, pMPOBuilder
+from pMPO.pMPO import calculate_descriptor_statistics, pick_uncorrelated_columns
+from pMPO.synthetic import make_descriptor_table
+
+# Table sizes of the standard benchmarks
+PRESETS = OrderedDict([('tiny', {'nrows': 1000, 'ncolumns': 20}),
+                       ('small', {'nrows': 10000, 'ncolumns': 100}),
+                       ('medium', {'nrows': 100000, 'ncolumns': 300}),
+                       ('wide', {'nrows': 5000, 'ncolumns': 3000})])
+
+
+def measure(fn: typing.Callable, repeat: int=3, memory: bool=True, rows: int=None) -> OrderedDict:
+    """
+    Time a function over repeated calls and measure its peak traced memory in one more call
+    :param fn: The function to measure
+    :param repeat: The number of timed calls
+    :param memory: Also measure the peak memory allocated through Python and NumPy (tracemalloc)
+    :param rows: The number of rows processed by each call, to report a throughput
+    :return: The measurements
+    """
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    result = OrderedDict([('seconds_min', min(seconds)),
+                          ('seconds_median', statistics.median(seconds)),
+                          ('repeat', repeat)])
+    if rows is not None:
+        result['rows'] = rows
+        result['rows_per_second'] = rows / min(seconds) if min(seconds) > 0 else None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def git_commit() -> typing.Optional[str]:
+    """
+    The commit of the source tree, when it is a git checkout without uncommitted changes (a report run on a modified
+    tree does not describe any commit, and a baseline committed to the repository can never record its own commit)
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        changes = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                          stderr=subprocess.DEVNULL).decode().strip()
+        if changes:
+            return None
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(config: dict, repeat: int=3, scalar_rows: int=2000, memory: bool=True,
+                   log: typing.Callable=None) -> OrderedDict:
+    """
+    Run every stage benchmark on one synthetic table
+    :param config: The arguments of make_descriptor_table
+    :param repeat: The number of timed calls per stage
+    :param scalar_rows: The number of molecules scored one at a time by the scalar scoring benchmark
+    :param memory: Also measure the peak memory of each stage
+    :param log: Optional function receiving a progress message per stage
+    :return: The benchmark report
+    """
+    df = make_descriptor_table(**config)
+    nrows = len(df)
+    results = OrderedDict()
+
+    def stage(name: str, fn: typing.Callable, rows: int=None):
+        results[name] = measure(fn, repeat=repeat, memory=memory, rows=rows)
+        if log is not None:
+            log("{:<35} {:>10.4f} s".format(name, results[name]['seconds_min']))
+
+    stage('calculate_descriptor_statistics', lambda: calculate_descriptor_statistics(df, 'good'), rows=nrows)
+    column_stats = calculate_descriptor_statistics(df, 'good')
+    stage('pick_uncorrelated_columns', lambda: pick_uncorrelated_columns(df, column_stats.copy()), rows=nrows)
+    stage('pMPOBuilder', lambda: pMPOBuilder(df, 'good', 'benchmark', inplace=False), rows=nrows)
+    builder = pMPOBuilder(df, 'good', 'benchmark', inplace=False)
+
+    def build_model():
+        builder.pMPO = None
+        return builder.model
+
+    stage('pMPOBuilder.model', build_model)
+    model = builder.model
+    records = df.drop(columns=['good']).head(scalar_rows).to_dict('records')
+    stage('score_scalar', lambda: [model(**record) for record in records], rows=len(records))
+    stage('score_frame', lambda: model.score_frame(df), rows=nrows)
+    compiled = model.compile()
+    stage('score_frame_compiled', lambda: compiled.score_frame(df), rows=nrows)
+    return OrderedDict([('meta', OrderedDict([('commit', git_commit()),
+                                              ('timestamp', datetime.datetime.utcnow().isoformat() + 'Z'),
+                                              ('pMPO', __version__),
+                                              ('python', platform.python_version()),
+                                              ('numpy', np.__version__),
+                                              ('pandas', pd.__version__),
+                                              ('scipy', scipy.__version__),
+                                              ('platform', platform.platform()),
+                                              ('cpu_count', os.cpu_count())])),
+                        ('config', OrderedDict(sorted(config.items()))),
+                        ('selected_descriptors', len(model.descriptors)),
+                        ('results', results)])
+
+
+def main(argv: typing.Sequence[str]=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the pMPO stages on a synthetic descriptor table')
+    parser.add_argument('--preset', choices=list(PRESETS), default='small', help='Table size [default: small]')
+    parser.add_argument('--rows', type=int, default=None, help='Override the number of rows of the preset')
+    parser.add_argument('--columns', type=int, default=None, help='Override the number of columns of the preset')
+    parser.add_argument('--missing-rate', type=float, default=0.05, help='Fraction of missing values')
+    parser.add_argument('--correlation', type=float, default=0.5, help='Correlation within descriptor blocks')
+    parser.add_argument('--block-size', type=int, default=10, help='Descriptors per correlated block')
+    parser.add_argument('--good-fraction', type=float, default=0.4, help='Fraction of good molecules')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the table')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed calls per stage')
+    parser.add_argument('--scalar-rows', type=int, default=2000, help='Molecules scored one at a time')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory measurements')
+    parser.add_argument('--output', default=None, help='Write the JSON report here [default: standard output]')
+    args = parser.parse_args(argv)
+    config = dict(PRESETS[args.preset])
+    if args.rows is not None:
+        config['nrows'] = args.rows
+    if args.columns is not None:
+        config['ncolumns'] = args.columns
+    config.update({'missing_rate': args.missing_rate, 'correlation': args.correlation, 'block_size': args.block_size,
+                   'good_fraction': args.good_fraction, 'random_state': args.seed})
+    report = run_benchmarks(config, repeat=args.repeat, scalar_rows=args.scalar_rows, memory=not args.no_memory,
+                            log=lambda message: print(message, file=sys.stderr))
+    report['preset'] = args.preset
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,14 @@
-from pMPO.pMPO import pMPOBuilder
 __version__ = '0.0.11'
+
+
+# The builder pulls in Pandas and SciPy, so it is only imported on first use and scoring-only processes can use
+# pMPO.runtime with nothing but NumPy
+def __getattr__(name: str):
+    if name == 'pMPOBuilder':
+        from pMPO.pMPO import pMPOBuilder
+        return pMPOBuilder
+    raise AttributeError("module 'pMPO' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + ['pMPOBuilder'])
@@ -0,0 +1,225 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import os
+import tempfile
+import typing
+import numpy as np
+import pandas as pd
+
+########################################################################################################################
+# A content-addressed on-disk cache for the builder stages
+# Every stage output is stored under a fingerprint of everything it depends on (the descriptor values, the labels and
+# the parameters), so identical builds in other processes or sessions load the stored result instead of recomputing it
+# Each entry is a DataFrame saved column by column in an uncompressed .npz file
+########################################################################################################################
+
+# Bump when the stage outputs change so older entries are never reused
+CACHE_FORMAT_VERSION = 1
+# Default size limit of a cache directory
+DEFAULT_CACHE_BYTES = 2 ** 30
+
+
+def fingerprint(*parts) -> str:
+    """
+    Hash arrays, DataFrame columns and plain parameters into a hex digest
+    :param parts: NumPy arrays, Pandas Series/DataFrames, or values with a stable repr (numbers, strings, tuples)
+    :return: The hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(str(CACHE_FORMAT_VERSION).encode())
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            for col in part.columns:
+                digest.update(repr(col).encode())
+                _update_array(digest, part[col].values)
+        elif isinstance(part, pd.Series):
+            _update_array(digest, part.values)
+        elif isinstance(part, np.ndarray):
+            _update_array(digest, part)
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def _update_array(digest, values: np.ndarray):
+    """
+    Add the dtype, shape and bytes of an array to a digest
+    """
+    values = np.ascontiguousarray(values)
+    if values.dtype == object:
+        digest.update(repr(values.tolist()).encode())
+    else:
+        digest.update(str(values.dtype).encode())
+        digest.update(str(values.shape).encode())
+        digest.update(values.view(np.uint8).reshape(-1) if values.size else b'')
+
+
+def _plain_array(values) -> typing.Optional[np.ndarray]:
+    """
+    A NumPy array that can be stored without pickling (object arrays of strings become unicode arrays)
+    :return: The array, or None when it can only be pickled
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.asarray(values.tolist())
+        if values.dtype == object or values.dtype.kind not in 'USbifu':
+            return None
+    return values
+
+
+def _frame_arrays(df: pd.DataFrame) -> typing.Optional[typing.Dict[str, np.ndarray]]:
+    """
+    Split a DataFrame into named arrays: the index, the column names and one array per column
+    :return: The named arrays, or None when the DataFrame has values that can only be pickled
+    """
+    arrays = {'__index__': _plain_array(df.index.values), '__columns__': _plain_array(df.columns.values)}
+    for idx, col in enumerate(df.columns):
+        arrays['column{}'.format(idx)] = _plain_array(df.iloc[:, idx].values)
+    if any(values is None for values in arrays.values()):
+        return None
+    return arrays
+
+
+def _object_strings(values: np.ndarray) -> np.ndarray:
+    """
+    Turn unicode arrays back into the object arrays Pandas uses for strings
+    """
+    return values.astype(object) if values.dtype.kind == 'U' else values
+
+
+class StageCache:
+    """
+    A size-bounded, least-recently-used directory of stage outputs addressed by their fingerprints
+    """
+    def __init__(self, directory: str, max_bytes: int=DEFAULT_CACHE_BYTES):
+        """
+        Open (and create if needed) a cache directory
+        :param directory: The cache directory
+        :param max_bytes: The size above which the least recently used entries are evicted
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, stage: str, key: str) -> str:
+        """
+        The file of a cache entry
+        :param stage: The name of the stage
+        :param key: The fingerprint of the stage inputs
+        :return: The path of the entry
+        """
+        return os.path.join(self.directory, '{}-{}.npz'.format(stage, key))
+
+    def get(self, stage: str, key: str) -> typing.Optional[pd.DataFrame]:
+        """
+        Load a stage output
+        :param stage: The name of the stage
+        :param key: The fingerprint of the stage inputs
+        :return: The stored DataFrame, or None on a miss
+        """
+        path = self.path(stage, key)
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                columns = _object_strings(arrays['__columns__'])
+                df = pd.DataFrame({idx: _object_strings(arrays['column{}'.format(idx)])
+                                   for idx in range(len(columns))},
+                                  index=_object_strings(arrays['__index__']))
+            df.columns = columns
+            # Mark the entry as recently used
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def put(self, stage: str, key: str, df: pd.DataFrame) -> bool:
+        """
+        Store a stage output and evict the least recently used entries above the size limit
+        :param stage: The name of the stage
+        :param key: The fingerprint of the stage inputs
+        :param df: The DataFrame to store
+        :return: Whether the DataFrame was stored (DataFrames with values that can only be pickled are not)
+        """
+        arrays = _frame_arrays(df)
+        if arrays is None:
+            return False
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temporary, self.path(stage, key))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        self.evict()
+        return True
+
+    def entries(self) -> typing.List[typing.Tuple[float, int, str]]:
+        """
+        The cache entries from the least to the most recently used
+        :return: List of (last use time, size in bytes, path) tuples
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+        return sorted(entries)
+
+    def size(self) -> int:
+        """
+        The total size of the cache entries in bytes
+        """
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove all the cache entries
+        """
+        for _, _, path in self.entries():
+            os.unlink(path)
@@ -0,0 +1,174 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import sys
+import typing
+
+########################################################################################################################
+# The pmpo command-line entry point
+########################################################################################################################
+
+
+def _score(args) -> int:
+    """
+    The pmpo score command
+    """
+    from pMPO.scoring import load_model, score_file
+    model = load_model(args.model)
+    report = score_file(model, args.input, args.output, chunksize=args.chunksize, id_columns=args.id_column,
+                        score_column=args.score_column, input_format=args.input_format,
+                        output_format=args.output_format)
+    if not args.quiet:
+        if report['descriptors_missing']:
+            print("Warning: {} of the model descriptors are missing from {} and score 0.0".format(
+                report['descriptors_missing'], args.input), file=sys.stderr)
+        print("Scored {} rows in {:.2f} s ({:,.0f} rows/s), peak memory {:.1f} MiB".format(
+            report['rows'], report['seconds'], report['rows_per_second'], report['peak_memory'] / 2 ** 20),
+            file=sys.stderr)
+    return 0
+
+
+def _screen(args) -> int:
+    """
+    The pmpo screen command
+    """
+    from pMPO.scoring import load_model, TableWriter
+    from pMPO.screening import screen_file
+    result = screen_file(load_model(args.model), args.input, k=args.top_k, threshold=args.threshold,
+                         id_column=args.id_column, chunksize=args.chunksize, fmt=args.input_format)
+    with TableWriter(args.output, args.output_format) as writer:
+        writer.write(result.to_frame(id_name=args.id_column or 'id', score_name=args.score_column or 'score'))
+    if not args.quiet:
+        stats = result.stats
+        print("Screened {} rows in {:.2f} s ({:,.0f} rows/s), kept {}, skipped {:.1%} of the descriptor terms".format(
+            stats['rows'], stats['seconds'], stats['rows_per_second'], stats['kept'], stats['terms_skipped']),
+            file=sys.stderr)
+    return 0
+
+
+def _serve(args) -> int:
+    """
+    The pmpo serve command
+    """
+    import os
+    from pMPO.serialization import ModelDirectory, load_model
+    from pMPO.server import serve
+    if len(args.models) == 1 and os.path.isdir(args.models[0]):
+        models = ModelDirectory(args.models[0])
+    else:
+        models = [load_model(path) for path in args.models]
+    if not args.quiet:
+        print("Serving pMPO models on {}".format(args.unix_socket or 'http://{}:{}'.format(args.host, args.port)),
+              file=sys.stderr)
+    serve(models, host=args.host, port=args.port, path=args.unix_socket, max_batch_size=args.max_batch_size,
+          max_wait=args.max_wait_ms / 1000.0)
+    return 0
+
+
+def _loadtest(args) -> int:
+    """
+    The pmpo loadtest command
+    """
+    import asyncio
+    import json
+    from pMPO.server import load_test, read_molecules
+    report = asyncio.run(load_test(args.model, read_molecules(args.input), host=args.host, port=args.port,
+                                   path=args.unix_socket, concurrency=args.concurrency, requests=args.requests,
+                                   batch=args.batch))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the pmpo argument parser
+    :return: The argument parser
+    """
+    parser = argparse.ArgumentParser(prog='pmpo', description='Probabilistic MPO models')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    score = commands.add_parser('score', help='Score a descriptor file (CSV, TSV or Parquet) in chunks')
+    score.add_argument('model', help='The pMPO model file (.pmpo, .json or pickled)')
+    score.add_argument('input', help='The descriptor file')
+    score.add_argument('output', help="The output file ('-' for standard output)")
+    score.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk [default: 100000]')
+    score.add_argument('--id-column', action='append', default=[],
+                       help='Input column copied to the output (can be repeated)')
+    score.add_argument('--score-column', default=None, help='Name of the score column [default: the model name]')
+    score.add_argument('--input-format', choices=('csv', 'tsv', 'parquet'), default=None,
+                       help='Input format [default: from the extension]')
+    score.add_argument('--output-format', choices=('csv', 'tsv', 'parquet'), default=None,
+                       help='Output format [default: from the extension]')
+    score.add_argument('--quiet', action='store_true', help='Do not report the throughput')
+    score.set_defaults(func=_score)
+    screen = commands.add_parser('screen', help='Keep the best molecules of a descriptor file, skipping hopeless ones')
+    screen.add_argument('model', help='The pMPO model file (.pmpo, .json or pickled)')
+    screen.add_argument('input', help='The descriptor file')
+    screen.add_argument('output', help="The output file ('-' for standard output)")
+    screen.add_argument('--top-k', type=int, default=None, help='Keep the k best molecules')
+    screen.add_argument('--threshold', type=float, default=None, help='Keep the molecules scoring at least this much')
+    screen.add_argument('--id-column', default=None, help='Input column with the molecule ids [default: row position]')
+    screen.add_argument('--score-column', default=None, help='Name of the score column [default: score]')
+    screen.add_argument('--chunksize', type=int, default=100000, help='Rows per chunk [default: 100000]')
+    screen.add_argument('--input-format', choices=('csv', 'tsv', 'parquet'), default=None,
+                        help='Input format [default: from the extension]')
+    screen.add_argument('--output-format', choices=('csv', 'tsv', 'parquet'), default=None,
+                        help='Output format [default: from the extension]')
+    screen.add_argument('--quiet', action='store_true', help='Do not report the pruning statistics')
+    screen.set_defaults(func=_screen)
+    serve = commands.add_parser('serve', help='Serve models over HTTP with micro-batched scoring')
+    serve.add_argument('models', nargs='+', help='Model files (.pmpo, .json or pickled) or one model directory')
+    serve.add_argument('--host', default='127.0.0.1', help='Host to listen on [default: 127.0.0.1]')
+    serve.add_argument('--port', type=int, default=8080, help='Port to listen on [default: 8080]')
+    serve.add_argument('--unix-socket', default=None, help='Listen on this unix socket instead of TCP')
+    serve.add_argument('--max-batch-size', type=int, default=256,
+                       help='Maximum molecules per micro-batch [default: 256]')
+    serve.add_argument('--max-wait-ms', type=float, default=1.0,
+                       help='Maximum milliseconds a request waits for its batch to fill [default: 1.0]')
+    serve.add_argument('--quiet', action='store_true', help='Do not report the address')
+    serve.set_defaults(func=_serve)
+    loadtest = commands.add_parser('loadtest', help='Load test a running pmpo serve')
+    loadtest.add_argument('model', help='The name of the model to score')
+    loadtest.add_argument('input', help='CSV, TSV or JSON file with the molecules to send')
+    loadtest.add_argument('--host', default='127.0.0.1', help='Server host [default: 127.0.0.1]')
+    loadtest.add_argument('--port', type=int, default=8080, help='Server port [default: 8080]')
+    loadtest.add_argument('--unix-socket', default=None, help='Connect to this unix socket instead of TCP')
+    loadtest.add_argument('--concurrency', type=int, default=64, help='Concurrent connections [default: 64]')
+    loadtest.add_argument('--requests', type=int, default=10000, help='Total requests [default: 10000]')
+    loadtest.add_argument('--batch', type=int, default=1, help='Molecules per request [default: 1]')
+    loadtest.set_defaults(func=_loadtest)
+    return parser
+
+
+def main(argv: typing.Sequence[str]=None) -> int:
+    """
+    Run the pmpo command line
+    :param argv: The command-line arguments [default: sys.argv[1:]]
+    :return: The exit code
+    """
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import time
+import typing
+import numpy as np
+from collections import OrderedDict
+from pMPO.runtime import CompiledpMPOModel
+from pMPO.screening import BOUND_SLACK, ScreeningResult
+
+########################################################################################################################
+# A memory-mapped descriptor range index for threshold queries over a static compound collection
+# Each descriptor column is stored as-is and sorted (with the row of each sorted value), so the rows with values in an
+# interval are one binary search and one contiguous slice away
+#
+# Every term of a pMPO score is at most its weight w_i, so a molecule can only reach a threshold T when each term
+# reaches L_i = T - (W - w_i), where W is the sum of the weights. A Gaussian times a sigmoid is log-concave, so each
+# L_i > 0 is met on a single interval of the descriptor. The planner intersects the rows in these intervals (starting
+# from the most selective descriptor) and only the remaining candidates are scored exactly
+########################################################################################################################
+
+INDEX_FORMAT = 'pMPO index'
+INDEX_FORMAT_VERSION = 1
+# Rows scored at once when a query has to scan every row
+INDEX_SCAN_ROWS = 1048576
+
+
+def term_log(x, weight: float, mean: float, inv_two_var: float, b: float, ln_c: float, cutoff: float):
+    """
+    The log of a single weighted Gaussian x sigmoidal term
+    :param x: The descriptor value(s)
+    :return: log(w * exp(-a(x - mean)^2) / (1 + b exp(-ln(c)(x - cutoff))))
+    """
+    with np.errstate(divide='ignore', over='ignore'):
+        correction = np.logaddexp(0.0, np.log(b) - ln_c * (x - cutoff)) if b > 0.0 else 0.0
+        return np.log(weight) - np.square(x - mean) * inv_two_var - correction
+
+
+def term_interval(level: float, weight: float, mean: float, inv_two_var: float, b: float, ln_c: float, cutoff: float,
+                  iterations: int=200) -> typing.Optional[typing.Tuple[float, float]]:
+    """
+    Find the interval of descriptor values where a term reaches a level
+    The term is log-concave, so its maximum is found by golden-section search and the two crossings by bisection. The
+    interval is widened slightly so it never excludes a value that reaches the level
+    :param level: The level the term has to reach (> 0)
+    :param iterations: Number of search steps
+    :return: The (low, high) interval, or None when the term never reaches the level
+    """
+    params = (weight, mean, inv_two_var, b, ln_c, cutoff)
+    if weight <= 0.0 or level > weight:
+        return None
+    target = np.log(level)
+    # The Gaussian alone must reach level / weight, which bounds the interval
+    radius = np.sqrt(np.log(weight / level) / inv_two_var) if inv_two_var > 0 else np.inf
+    if not np.isfinite(radius):
+        return -np.inf, np.inf
+    lo, hi = mean - radius, mean + radius
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    left, right = lo, hi
+    for _ in range(iterations):
+        a = right - ratio * (right - left)
+        c = left + ratio * (right - left)
+        if term_log(a, *params) < term_log(c, *params):
+            left = a
+        else:
+            right = c
+    peak = (left + right) / 2.0
+    if term_log(peak, *params) < target:
+        return None
+
+    def crossing(outside: float, inside: float) -> float:
+        for _ in range(iterations):
+            middle = (outside + inside) / 2.0
+            if term_log(middle, *params) >= target:
+                inside = middle
+            else:
+                outside = middle
+        return outside
+
+    low, high = crossing(lo, peak), crossing(hi, peak)
+    widen = 1e-9 * (1.0 + abs(low) + abs(high))
+    return low - widen, high + widen
+
+
+class DescriptorIndex:
+    """
+    A directory of memory-mapped descriptor columns, each also sorted with its row numbers
+    Opening an index reads only its metadata, the arrays are memory-mapped when first used
+    """
+    def __init__(self, directory: str):
+        """
+        Open an index built with DescriptorIndex.build
+        :param directory: The index directory
+        """
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json')) as f:
+            metadata = json.load(f)
+        if metadata.get('format') != INDEX_FORMAT:
+            raise AssertionError("Not a pMPO descriptor index: {}".format(directory))
+        if metadata.get('version') != INDEX_FORMAT_VERSION:
+            raise AssertionError("Unsupported pMPO descriptor index version: {}".format(metadata.get('version')))
+        self.nrows = metadata['nrows']
+        self.columns = metadata['columns']
+        self._arrays = {}
+
+    @classmethod
+    def build(cls, directory: str, data, columns: typing.Sequence[str]=None) -> 'DescriptorIndex':
+        """
+        Build an index from the numeric columns of a DataFrame or the columns of a 2D array (which may be a memmap)
+        Columns are sorted one at a time
+        :param directory: The index directory (created if needed)
+        :param data: A Pandas DataFrame or 2D array with one row per molecule
+        :param columns: The column names of a 2D array [default: the numeric DataFrame columns]
+        :return: The opened index
+        """
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(data, 'iloc'):
+            if columns is None:
+                columns = [col for col in data.columns if data[col].dtype.kind in 'iuf']
+            column_values = lambda col: data[col].values  # noqa: E731
+            nrows = len(data)
+        else:
+            if data.ndim != 2 or columns is None or len(columns) != data.shape[1]:
+                raise AssertionError("Indexing a 2D array needs one column name per column")
+            positions = {col: position for position, col in enumerate(columns)}
+            column_values = lambda col: data[:, positions[col]]  # noqa: E731
+            nrows = data.shape[0]
+        row_dtype = np.int32 if nrows < 2 ** 31 else np.int64
+        for position, col in enumerate(columns):
+            values = np.ascontiguousarray(column_values(col), dtype=np.float64)
+            # NaN values sort last
+            order = np.argsort(values, kind='stable').astype(row_dtype)
+            np.save(os.path.join(directory, 'column{}.values.npy'.format(position)), values)
+            np.save(os.path.join(directory, 'column{}.order.npy'.format(position)), order)
+            np.save(os.path.join(directory, 'column{}.sorted.npy'.format(position)), values[order])
+        with open(os.path.join(directory, 'index.json'), 'w') as f:
+            json.dump(OrderedDict([('format', INDEX_FORMAT), ('version', INDEX_FORMAT_VERSION), ('nrows', nrows),
+                                   ('columns', [str(col) for col in columns])]), f)
+        return cls(directory)
+
+    def array(self, column: str, kind: str) -> np.ndarray:
+        """
+        Memory-map an array of a column
+        :param column: The column name
+        :param kind: 'values' (in row order), 'sorted' (ascending, NaN last) or 'order' (the row of each sorted value)
+        :return: The read-only memory-mapped array
+        """
+        key = (column, kind)
+        if key not in self._arrays:
+            position = self.columns.index(column)
+            self._arrays[key] = np.load(os.path.join(self.directory, 'column{}.{}.npy'.format(position, kind)),
+                                        mmap_mode='r')
+        return self._arrays[key]
+
+    def rows_between(self, column: str, low: float, high: float) -> np.ndarray:
+        """
+        Find the rows with values in an interval
+        :param column: The column name
+        :param low: The lowest value
+        :param high: The highest value
+        :return: The rows in ascending value order
+        """
+        start, stop = self._bounds(column, low, high)
+        return np.asarray(self.array(column, 'order')[start:stop], dtype=np.int64)
+
+    def _bounds(self, column: str, low: float, high: float) -> typing.Tuple[int, int]:
+        """
+        The slice of the sorted column holding the values in an interval
+        """
+        ordered = self.array(column, 'sorted')
+        return int(np.searchsorted(ordered, low, side='left')), int(np.searchsorted(ordered, high, side='right'))
+
+    def plan(self, model, threshold: float) -> OrderedDict:
+        """
+        Plan a threshold query: the value interval every molecule reaching the threshold must lie in, per descriptor
+        :param model: A pMPOModel or CompiledpMPOModel
+        :param threshold: The score to reach
+        :return: An OrderedDict with the index column of each model descriptor ('columns'), the [low, high, rows]
+                 of each constrained column ('intervals'), whether the threshold is unreachable ('empty') and the most
+                 selective column ('driver', None when every row has to be scanned)
+        """
+        compiled = model if isinstance(model, CompiledpMPOModel) else model.compile()
+        positions = compiled.column_positions(self.columns)
+        params = compiled.parameters.copy()
+        if not compiled.sigmoidal_correction:
+            params[3] = 0.0
+        # Descriptors missing from the index contribute 0.0 to every score
+        columns = OrderedDict((compiled.descriptors[idx], self.columns[position])
+                              for idx, position in enumerate(positions) if position >= 0)
+        present = positions >= 0
+        bounds = np.where(params[3] >= 0.0, np.maximum(params[0], 0.0), np.inf)
+        total = bounds[present].sum()
+        plan = OrderedDict([('columns', columns), ('intervals', OrderedDict()), ('empty', threshold > total),
+                            ('driver', None)])
+        if plan['empty'] or not np.isfinite(total):
+            return plan
+        for idx in np.flatnonzero(present):
+            level = threshold - (total - bounds[idx]) - BOUND_SLACK
+            if level <= 0.0:
+                continue
+            interval = term_interval(level, *params[:, idx])
+            if interval is None:
+                plan['empty'] = True
+                return plan
+            column = columns[compiled.descriptors[idx]]
+            start, stop = self._bounds(column, *interval)
+            plan['intervals'][column] = [float(interval[0]), float(interval[1]), stop - start]
+        if plan['intervals']:
+            plan['driver'] = min(plan['intervals'], key=lambda col: plan['intervals'][col][2])
+        return plan
+
+    def query(self, model, threshold: float) -> ScreeningResult:
+        """
+        Find every row scoring at least a threshold, scoring only the candidates left by the plan
+        :param model: A pMPOModel or CompiledpMPOModel
+        :param threshold: The score to reach
+        :return: A ScreeningResult with the rows (also used as ids) and scores, best first. Its stats hold the plan,
+                 the number of candidates from the driver, the candidates scored, and the rows kept
+        """
+        started = time.perf_counter()
+        compiled = model if isinstance(model, CompiledpMPOModel) else model.compile()
+        plan = self.plan(compiled, threshold)
+        columns = plan['columns']
+        candidates = 0
+        if plan['empty']:
+            rows, scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+            scored = 0
+        elif plan['driver'] is None:
+            rows, scores = [], []
+            for start in range(0, self.nrows, INDEX_SCAN_ROWS):
+                block_scores = self._score_rows(compiled, columns, slice(start, start + INDEX_SCAN_ROWS))
+                keep = np.flatnonzero(block_scores >= threshold)
+                rows.append(keep + start)
+                scores.append(block_scores[keep])
+            rows, scores = np.concatenate(rows), np.concatenate(scores)
+            candidates = scored = self.nrows
+        else:
+            low, high, _ = plan['intervals'][plan['driver']]
+            # Sorting the candidate rows keeps the gathers from the other columns in file order
+            rows = np.sort(self.rows_between(plan['driver'], low, high))
+            candidates = len(rows)
+            # The most selective of the other intervals are checked first
+            for column, (low, high, _) in sorted(plan['intervals'].items(), key=lambda item: item[1][2]):
+                if column != plan['driver'] and len(rows):
+                    values = self.array(column, 'values')[rows]
+                    rows = rows[(values >= low) & (values <= high)]
+            scored = len(rows)
+            scores = self._score_rows(compiled, columns, rows)
+            keep = scores >= threshold
+            rows, scores = rows[keep], scores[keep]
+        stats = OrderedDict([('rows', self.nrows),
+                             ('threshold', threshold),
+                             ('intervals', plan['intervals']),
+                             ('driver', plan['driver']),
+                             ('candidates', candidates),
+                             ('scored', scored),
+                             ('kept', len(rows)),
+                             ('seconds', time.perf_counter() - started)])
+        return ScreeningResult(rows.astype(np.int64), rows.astype(np.int64), scores, stats)
+
+    def _score_rows(self, compiled: CompiledpMPOModel, columns: typing.Dict[str, str], rows) -> np.ndarray:
+        """
+        Score rows of the index exactly
+        :param compiled: The compiled model
+        :param columns: The index column of each model descriptor
+        :param rows: The rows (an index array or a slice)
+        :return: The scores of the rows
+        """
+        nrows = len(range(self.nrows)[rows]) if isinstance(rows, slice) else len(rows)
+        Z = np.full((nrows, len(compiled.descriptors)), np.nan, dtype=np.float64)
+        for idx, desc in enumerate(compiled.descriptors):
+            if desc in columns:
+                Z[:, idx] = self.array(columns[desc], 'values')[rows]
+        return compiled.score_block(Z)
+
+    def __len__(self) -> int:
+        return self.nrows
+
+    def __str__(self) -> str:
+        return "DescriptorIndex ({} rows, {} columns)".format(self.nrows, len(self.columns))
+
+    def __repr__(self):
+        return str(self)
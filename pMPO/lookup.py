@@ -0,0 +1,312 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import time
+import typing
+import numpy as np
+from collections import OrderedDict
+from pMPO.runtime import CompiledpMPOModel, is_matrix_input
+
+########################################################################################################################
+# Lookup-table scoring
+# The contribution of each descriptor (weighted Gaussian x sigmoid) is precomputed on a grid, so scoring is a gather
+# and an add per descriptor instead of two exponentials and a division
+# Descriptors reported on a fixed grid (integers, or values with a fixed number of decimals) get exact tables, values
+# off the grid are evaluated exactly. All the other descriptors get linearly interpolated tables fine enough that the
+# score is within max_error of the exact score
+########################################################################################################################
+
+# Largest number of entries in one table
+MAX_TABLE_ENTRIES = 2 ** 22
+# Exact tables cover the values where the Gaussian is above this fraction of the weight, values outside are evaluated
+EXACT_TABLE_TAIL = 1e-15
+# Interpolation errors are measured at this many points per grid interval
+ERROR_SAMPLES = 8
+
+
+def exact_terms(z: np.ndarray, weight: float, mean: float, inv_two_var: float, b: float, ln_c: float,
+                cutoff: float) -> np.ndarray:
+    """
+    Evaluate the contribution of one descriptor exactly
+    :param z: The descriptor values
+    :return: The weighted Gaussian x sigmoid terms (NaN where z is NaN)
+    """
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        return weight * np.exp(-np.square(z - mean) * inv_two_var) / (1.0 + b * np.exp(-ln_c * (z - cutoff)))
+
+
+def _table_range(weight: float, mean: float, inv_two_var: float, tail: float) -> typing.Tuple[float, float]:
+    """
+    The range outside of which a term is at most tail
+    """
+    if weight == 0.0 or tail >= abs(weight):
+        return mean, mean
+    radius = np.sqrt(np.log(abs(weight) / tail) / inv_two_var)
+    return mean - radius, mean + radius
+
+
+class ExactTable:
+    """
+    The contribution of a descriptor at every point of a fixed grid (lo + k * step)
+    """
+    kind = 'exact'
+
+    def __init__(self, params: np.ndarray, step: float):
+        """
+        Tabulate a descriptor exactly on a grid
+        :param params: The six compiled parameters of the descriptor
+        :param step: The grid step (1 for integer descriptors, 0.01 for values with two decimals...)
+        """
+        low, high = _table_range(params[0], params[1], params[2], EXACT_TABLE_TAIL * max(abs(params[0]), 1e-300))
+        self.params = params
+        self.step = float(step)
+        self.lo = np.floor(low / step) * step
+        entries = int(np.ceil((high - self.lo) / step)) + 1
+        if entries > MAX_TABLE_ENTRIES:
+            raise AssertionError("A step of {} needs {} table entries (at most {})".format(step, entries,
+                                                                                           MAX_TABLE_ENTRIES))
+        self.values = exact_terms(self.lo + np.arange(entries) * self.step, *params)
+        self.error = 0.0
+
+    def __call__(self, z: np.ndarray) -> np.ndarray:
+        """
+        Look up the contributions, evaluating values that are off the grid or outside the table exactly
+        :param z: The descriptor values
+        :return: The contributions (0.0 for NaN)
+        """
+        t = (z - self.lo) / self.step
+        k = np.rint(t)
+        # NaN compares False, so it also takes the exact path (and is zeroed there)
+        on_grid = (np.abs(t - k) <= 1e-6) & (k >= 0) & (k < len(self.values))
+        terms = self.values.take(np.where(on_grid, k, 0).astype(np.intp))
+        if not on_grid.all():
+            off_grid = ~on_grid
+            exact = exact_terms(z[off_grid], *self.params)
+            exact[np.isnan(exact)] = 0.0
+            terms[off_grid] = exact
+        return terms
+
+
+class InterpolatedTable:
+    """
+    The contribution of a descriptor linearly interpolated on a uniform grid, within a maximum absolute error
+    """
+    kind = 'interpolated'
+
+    def __init__(self, params: np.ndarray, max_error: float):
+        """
+        Tabulate a descriptor on a grid fine enough for the interpolation error to stay below max_error
+        Outside the table the contribution is taken as 0.0, which is also within max_error
+        :param params: The six compiled parameters of the descriptor
+        :param max_error: The maximum absolute error of the contribution
+        """
+        if max_error <= 0.0:
+            raise AssertionError("Interpolated tables need a positive max_error, got {}".format(max_error))
+        self.params = params
+        self.lo, high = _table_range(params[0], params[1], params[2], max_error)
+        span = high - self.lo
+        # Start from the curvature of the Gaussian at its peak (2 w a) and halve the grid step until the measured
+        # error is within max_error
+        curvature = 2.0 * abs(params[0]) * params[2]
+        entries = int(np.ceil(span / np.sqrt(8.0 * max_error / curvature))) + 1 if curvature > 0 else 2
+        entries = max(entries, 2)
+        while True:
+            if entries > MAX_TABLE_ENTRIES:
+                raise AssertionError("A max_error of {} needs more than {} table entries".format(max_error,
+                                                                                                MAX_TABLE_ENTRIES))
+            self.inv_step = (entries - 1) / span if span > 0 else 0.0
+            grid = exact_terms(np.linspace(self.lo, high, entries), *params)
+            self.values = grid[:-1]
+            self.slopes = np.diff(grid)
+            samples = np.linspace(self.lo, high, (entries - 1) * ERROR_SAMPLES + 1)[:-1]
+            self.error = float(np.max(np.abs(self(samples) - exact_terms(samples, *params)))) if span > 0 else 0.0
+            # The tail outside the table is at most max_error as well
+            if self.error <= max_error:
+                self.error = max(self.error, float(np.max(exact_terms(np.array([self.lo, high]), *params))))
+                break
+            entries = (entries - 1) * 2 + 1
+
+    def __call__(self, z: np.ndarray) -> np.ndarray:
+        """
+        Interpolate the contributions
+        :param z: The descriptor values
+        :return: The contributions (0.0 for NaN and values outside the table)
+        """
+        t = (z - self.lo) * self.inv_step
+        # NaN compares False
+        inside = (t >= 0.0) & (t < len(self.values))
+        idx = np.where(inside, t, 0.0).astype(np.intp)
+        terms = self.values.take(idx) + (t - idx) * self.slopes.take(idx)
+        terms[~inside] = 0.0
+        return terms
+
+
+class TabulatedpMPOModel:
+    """
+    A pMPO model scored through per-descriptor lookup tables (see tabulate)
+    """
+
+    def __init__(self, model: CompiledpMPOModel, tables: typing.Sequence):
+        """
+        Create the tabulated model
+        :param model: The exact compiled model
+        :param tables: The ExactTable or InterpolatedTable of each model descriptor
+        """
+        self.model = model
+        self.name = model.name
+        self.descriptors = model.descriptors
+        self.case_insensitive = model.case_insensitive
+        self.tables = tuple(tables)
+
+    @property
+    def errors(self) -> OrderedDict:
+        """
+        The measured maximum absolute error of each descriptor contribution (0.0 for exact tables)
+        """
+        return OrderedDict((desc, table.error) for desc, table in zip(self.descriptors, self.tables))
+
+    @property
+    def max_error(self) -> float:
+        """
+        The bound on the absolute error of a score: the sum of the errors of the descriptor contributions
+        """
+        return float(sum(table.error for table in self.tables))
+
+    def _score_columns(self, columns: typing.Sequence[typing.Optional[np.ndarray]], nrows: int) -> np.ndarray:
+        """
+        Score the values of each model descriptor (None when missing)
+        """
+        scores = np.zeros(nrows, dtype=np.float64)
+        for table, values in zip(self.tables, columns):
+            if values is not None:
+                scores += table(np.asarray(values, dtype=np.float64))
+        return scores
+
+    def score_block(self, Z) -> np.ndarray:
+        """
+        Score an (n x k) block of descriptor values already in the order of self.descriptors
+        :param Z: The (n x k) block of descriptor values
+        :return: A float array of the pMPO scores
+        """
+        Z = np.asarray(Z, dtype=np.float64)
+        return self._score_columns([Z[:, idx] for idx in range(Z.shape[1])], Z.shape[0])
+
+    def score_array(self, X, columns: typing.Sequence[str]=None) -> np.ndarray:
+        """
+        Apply the tabulated model to a 2D array of descriptor values
+        :param X: A 2D array-like with one row per molecule and one column per descriptor, or a descriptor matrix
+                  (memory map, raw buffer, Arrow table or record batch, see pMPO.matrix) scored in row blocks
+        :param columns: The descriptor names of the columns of X (Arrow data and DescriptorMatrix have their own)
+        :return: A float array with the pMPO score of each row
+        """
+        if is_matrix_input(X):
+            from pMPO.matrix import score_matrix
+            return score_matrix(self, X, columns)
+        if columns is None:
+            raise AssertionError("Input to pMPO score_array needs the names of its columns")
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise AssertionError("Input to pMPO score_array must be 2D, got shape {}".format(X.shape))
+        if X.shape[1] != len(columns):
+            raise AssertionError("Input to pMPO score_array has {} columns but {} column names".format(
+                X.shape[1], len(columns)))
+        positions = self.model.column_positions(columns)
+        return self._score_columns([X[:, position] if position >= 0 else None for position in positions],
+                                   X.shape[0])
+
+    def score_frame(self, df: 'pandas.DataFrame') -> 'pandas.Series':
+        """
+        Apply the tabulated model to every row of a DataFrame
+        :param df: A Pandas DataFrame with one row per molecule and descriptors as columns
+        :return: A Pandas Series of pMPO scores aligned to the DataFrame index
+        """
+        import pandas as pd
+        positions = self.model.column_positions(df.columns)
+        scores = self._score_columns([df.iloc[:, position].values if position >= 0 else None
+                                      for position in positions], len(df))
+        return pd.Series(scores, index=df.index, name=self.name)
+
+    def __call__(self, **kwargs) -> float:
+        """
+        Apply the tabulated model to a single molecule
+        :param kwargs: The descriptor values to score against the model
+        :return: The pMPO score
+        """
+        columns = list(kwargs.keys())
+        return float(self.score_array(np.array([[kwargs[col] for col in columns]], dtype=np.float64), columns)[0])
+
+    def benchmark(self, X, columns: typing.Sequence[str], repeat: int=3) -> OrderedDict:
+        """
+        Compare the tabulated scores with the exact compiled model on some data
+        :param X: A 2D array-like with one row per molecule and one column per descriptor
+        :param columns: The descriptor names of the columns of X
+        :param repeat: Number of timed repeats (the best is kept)
+        :return: An OrderedDict with the rows, the best exact and table seconds, the speedup, the largest absolute
+                 difference observed on the data and the error bound (max_error)
+        """
+        X = np.asarray(X, dtype=np.float64)
+        timings = OrderedDict()
+        for label, model in (('exact', self.model), ('table', self)):
+            best = np.inf
+            for _ in range(max(1, repeat)):
+                started = time.perf_counter()
+                scores = model.score_array(X, columns)
+                best = min(best, time.perf_counter() - started)
+            timings[label] = (best, scores)
+        return OrderedDict([('rows', len(X)),
+                            ('exact_seconds', timings['exact'][0]),
+                            ('table_seconds', timings['table'][0]),
+                            ('speedup', timings['exact'][0] / timings['table'][0] if timings['table'][0] > 0
+                             else float('inf')),
+                            ('observed_error', float(np.max(np.abs(timings['exact'][1] - timings['table'][1])))
+                             if len(X) else 0.0),
+                            ('max_error', self.max_error)])
+
+    def __str__(self) -> str:
+        return "{} (tabulated, max error {:.3g})".format(self.name, self.max_error)
+
+    def __repr__(self):
+        return str(self)
+
+
+def tabulate(model, steps: typing.Dict[str, float]=None, max_error: float=1e-4) -> TabulatedpMPOModel:
+    """
+    Precompute lookup tables for the descriptor contributions of a model
+    :param model: A pMPOModel or CompiledpMPOModel
+    :param steps: The grid step of the descriptors that get exact tables, e.g. {'HBD': 1, 'TPSA': 0.01}
+    :param max_error: The maximum absolute error of a score, shared evenly by the interpolated descriptors
+    :return: The TabulatedpMPOModel
+    """
+    compiled = model if isinstance(model, CompiledpMPOModel) else model.compile()
+    params = compiled.parameters.copy()
+    if not compiled.sigmoidal_correction:
+        params[3] = 0.0
+    exact = OrderedDict()
+    for key, step in (steps or {}).items():
+        positions = np.flatnonzero(compiled.column_positions([key]) >= 0)
+        if not len(positions):
+            raise KeyError("{} is not a descriptor of {}".format(key, compiled.name))
+        exact[int(positions[0])] = step
+    interpolated = len(compiled.descriptors) - len(exact)
+    tables = [ExactTable(params[:, idx], exact[idx]) if idx in exact else
+              InterpolatedTable(params[:, idx], max_error / interpolated) for idx in range(len(compiled.descriptors))]
+    return TabulatedpMPOModel(compiled, tables)
@@ -0,0 +1,310 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import mmap
+import os
+import typing
+import numpy as np
+
+########################################################################################################################
+# Descriptor matrices that are never loaded as a whole
+# A memory-mapped (or raw buffer) float matrix with a list of column names, or an Arrow table or record batch, is
+# read in row blocks of a few megabytes. Only the block being processed is converted to float64, so statistics and
+# scores can be computed over matrices larger than memory, and nothing is copied to build a DataFrame first
+# The usual entry points accept them: score_array of the models, calculate_descriptor_statistics,
+# descriptor_statistics_from_mask, pairwise_r2 and pMPOBuilder
+########################################################################################################################
+
+# Target size of a float64 row block
+MATRIX_BLOCK_BYTES = 2 ** 24
+
+
+def _is_arrow(data) -> bool:
+    """
+    Whether the data is an Arrow Table or RecordBatch (without importing pyarrow)
+    """
+    return type(data).__module__.split('.')[0] == 'pyarrow' and hasattr(data, 'schema')
+
+
+class DescriptorMatrix:
+    """
+    A zero-copy view of a descriptor matrix read in row blocks
+    Supported data: 2D NumPy arrays (including np.memmap), raw buffers (bytes, memoryview, mmap) of a C-ordered matrix,
+    Arrow Tables and RecordBatches, and Pandas DataFrames
+    """
+
+    def __init__(self, data, columns: typing.Sequence[str]=None, dtype=np.float32):
+        """
+        Wrap a descriptor matrix
+        :param data: The matrix data (see the class description)
+        :param columns: The column names [required for arrays and buffers, default: the Arrow/DataFrame columns]
+        :param dtype: The element type of a raw buffer
+        """
+        if _is_arrow(data):
+            self.kind = 'arrow'
+            columns = list(data.schema.names) if columns is None else list(columns)
+            if columns != list(data.schema.names):
+                raise AssertionError("Arrow columns cannot be renamed, got {}".format(columns))
+            self.nrows = data.num_rows
+        elif hasattr(data, 'iloc'):
+            self.kind = 'frame'
+            columns = list(data.columns) if columns is None else list(columns)
+            if len(columns) != data.shape[1]:
+                raise AssertionError("A DataFrame with {} columns was given {} column names".format(data.shape[1],
+                                                                                                    len(columns)))
+            self.nrows = len(data)
+        else:
+            if columns is None:
+                raise AssertionError("A descriptor array or buffer needs its column names")
+            columns = list(columns)
+            if not isinstance(data, np.ndarray):
+                data = np.frombuffer(data, dtype=dtype)
+                if data.size % max(len(columns), 1):
+                    raise AssertionError("A buffer of {} values is not a matrix of {} columns".format(data.size,
+                                                                                                   len(columns)))
+                data = data.reshape(-1, len(columns))
+            if data.ndim != 2 or data.shape[1] != len(columns):
+                raise AssertionError("A descriptor array of shape {} does not have {} columns".format(
+                    data.shape, len(columns)))
+            self.kind = 'array'
+            self.nrows = data.shape[0]
+        self.data = data
+        self.columns = columns
+        # Column lookups by name stay O(1) for wide headers, the first of duplicated names wins as with list.index
+        self._positions = {}
+        for position, name in enumerate(columns):
+            self._positions.setdefault(name, position)
+
+    @classmethod
+    def open(cls, path: str, columns, dtype='float32', offset: int=0) -> 'DescriptorMatrix':
+        """
+        Memory-map a raw C-ordered matrix file (no data is read until it is used)
+        :param path: The matrix file
+        :param columns: The column names, or the path of a header file with one column name per line
+        :param dtype: The element type
+        :param offset: Bytes to skip at the start of the file
+        :return: The DescriptorMatrix
+        """
+        if isinstance(columns, str):
+            with open(columns) as f:
+                columns = [line.rstrip('\r\n') for line in f if line.strip()]
+        dtype = np.dtype(dtype)
+        row_bytes = dtype.itemsize * len(columns)
+        size = os.path.getsize(path) - offset
+        if size % row_bytes:
+            raise AssertionError("{} is not a matrix of {} {} columns".format(path, len(columns), dtype))
+        return cls(np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(size // row_bytes, len(columns))),
+                   columns)
+
+    def __len__(self) -> int:
+        return self.nrows
+
+    @property
+    def size(self) -> int:
+        """
+        The number of values (like DataFrame.size)
+        """
+        return self.nrows * len(self.columns)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        The values of a column, without copying when the data allows it (see column)
+        :param name: The column name
+        :return: A 1D array
+        """
+        return self.column(self.positions([name])[0])
+
+    def numeric_columns(self) -> typing.List[str]:
+        """
+        The names of the numeric columns (every column of an array or buffer)
+        :return: The column names
+        """
+        if self.kind == 'array':
+            return list(self.columns)
+        if self.kind == 'frame':
+            return [col for col, dt in zip(self.columns, self.data.dtypes) if np.issubdtype(dt, np.number)]
+        import pyarrow
+        return [field.name for field in self.data.schema
+                if pyarrow.types.is_integer(field.type) or pyarrow.types.is_floating(field.type)]
+
+    def default_block_rows(self, ncolumns: int) -> int:
+        """
+        The number of rows in a block of about MATRIX_BLOCK_BYTES
+        :param ncolumns: The number of columns read per block
+        :return: The block size in rows
+        """
+        return max(1024, MATRIX_BLOCK_BYTES // (8 * max(ncolumns, 1)))
+
+    def positions(self, names: typing.Sequence[str]) -> typing.List[int]:
+        """
+        Find columns by name
+        :param names: The column names
+        :return: The position of each column
+        """
+        missing = [name for name in names if name not in self._positions]
+        if missing:
+            raise KeyError("Columns {} are not in the descriptor matrix".format(missing))
+        return [self._positions[name] for name in names]
+
+    def column(self, position: int, start: int=0, stop: int=None) -> np.ndarray:
+        """
+        The values of one column over a range of rows, without copying when the data allows it
+        :param position: The column position
+        :param start: The first row
+        :param stop: The row after the last [default: the last row]
+        :return: A 1D array (a view of arrays and of Arrow columns without nulls)
+        """
+        stop = self.nrows if stop is None else min(stop, self.nrows)
+        if self.kind == 'array':
+            return self.data[start:stop, position]
+        if self.kind == 'frame':
+            return self.data.iloc[start:stop, position].values
+        values = self.data.column(int(position)).slice(start, stop - start)
+        if hasattr(values, 'combine_chunks'):
+            values = values.combine_chunks()
+        if values.null_count:
+            # Nulls become NaN, which needs a float copy
+            return values.to_numpy(zero_copy_only=False).astype(np.float64)
+        return values.to_numpy(zero_copy_only=False)
+
+    def block(self, positions: typing.Sequence[int], start: int, stop: int) -> np.ndarray:
+        """
+        Gather the columns of a block of rows into a float64 matrix
+        :param positions: The column positions (-1 gives a column of NaN)
+        :param start: The first row
+        :param stop: The row after the last
+        :return: The (rows x columns) float64 block
+        """
+        stop = min(stop, self.nrows)
+        block = np.empty((stop - start, len(positions)), dtype=np.float64)
+        if self.kind == 'array':
+            # Read the rows once (contiguous in a C-ordered file), then pick the columns
+            rows = self.data[start:stop]
+            for idx, position in enumerate(positions):
+                block[:, idx] = rows[:, position] if position >= 0 else np.nan
+        else:
+            for idx, position in enumerate(positions):
+                block[:, idx] = self.column(position, start, stop) if position >= 0 else np.nan
+        return block
+
+    def blocks(self, positions: typing.Sequence[int], block_rows: int=None) -> \
+            typing.Iterator[typing.Tuple[int, int, np.ndarray]]:
+        """
+        Iterate over float64 row blocks of some columns
+        :param positions: The column positions (-1 gives a column of NaN)
+        :param block_rows: Rows per block [default: about MATRIX_BLOCK_BYTES per block]
+        :return: Iterator of (start, stop, block)
+        """
+        block_rows = block_rows or self.default_block_rows(len(positions))
+        for start in range(0, self.nrows, block_rows):
+            stop = min(start + block_rows, self.nrows)
+            yield start, stop, self.block(positions, start, stop)
+
+    def column_means(self, positions: typing.Sequence[int], block_rows: int=None) -> np.ndarray:
+        """
+        The means of columns over their present (not NaN) values, in one pass over the row blocks
+        :param positions: The column positions
+        :param block_rows: Rows per block [default: about MATRIX_BLOCK_BYTES per block]
+        :return: A float array of the means (NaN for columns without values)
+        """
+        sums = np.zeros(len(positions))
+        counts = np.zeros(len(positions))
+        for _, _, block in self.blocks(positions, block_rows=block_rows):
+            present = ~np.isnan(block)
+            sums += np.where(present, block, 0.0).sum(axis=0)
+            counts += present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+    def __str__(self) -> str:
+        return "DescriptorMatrix ({} rows, {} columns, {})".format(self.nrows, len(self.columns), self.kind)
+
+    def __repr__(self):
+        return str(self)
+
+
+def as_matrix(data, columns: typing.Sequence[str]=None) -> DescriptorMatrix:
+    """
+    Wrap data in a DescriptorMatrix unless it already is one
+    :param data: A DescriptorMatrix or data for one (see DescriptorMatrix)
+    :param columns: The column names of arrays and buffers
+    :return: The DescriptorMatrix
+    """
+    return data if isinstance(data, DescriptorMatrix) else DescriptorMatrix(data, columns)
+
+
+def is_matrix_data(data) -> bool:
+    """
+    Whether data is read in row blocks as a DescriptorMatrix: a DescriptorMatrix, memory map, raw buffer or Arrow data
+    :param data: The input data
+    :return: True for descriptor matrix data
+    """
+    return isinstance(data, (DescriptorMatrix, np.memmap, bytes, bytearray, memoryview, mmap.mmap)) or _is_arrow(data)
+
+
+def score_matrix(model, data, columns: typing.Sequence[str]=None, block_rows: int=None,
+                 out: np.ndarray=None) -> np.ndarray:
+    """
+    Score a descriptor matrix block by block, reading only the descriptor columns of the model
+    This is what score_array does with descriptor matrix data (see is_matrix_data)
+    :param model: A pMPOModel, CompiledpMPOModel, ModelBank or TabulatedpMPOModel
+    :param data: A DescriptorMatrix or data for one (memmap, buffer, Arrow table or record batch)
+    :param columns: The column names of arrays and buffers
+    :param block_rows: Rows per block [default: about MATRIX_BLOCK_BYTES per block]
+    :param out: Optional array (e.g. a writable np.memmap) that receives the scores
+    :return: The scores (one column per model for a ModelBank)
+    """
+    matrix = as_matrix(data, columns)
+    if not hasattr(model, 'score_block'):
+        model = model.compile()
+    # Tabulated models share the descriptor order of their exact model
+    kernel = model if hasattr(model, 'column_positions') else model.model
+    positions = kernel.column_positions(matrix.columns)
+    for start, stop, block in matrix.blocks(positions, block_rows=block_rows):
+        scores = model.score_block(block)
+        if out is None:
+            out = np.empty((matrix.nrows,) + scores.shape[1:], dtype=np.float64)
+        out[start:stop] = scores
+    if out is None:
+        out = np.empty((0,) + ((len(model),) if hasattr(model, 'names') else ()), dtype=np.float64)
+    return out
+
+
+def matrix_moments(matrix: DescriptorMatrix, columns: typing.Sequence[str], good_mask: np.ndarray,
+                   bad_mask: np.ndarray, block_rows: int=None, progress: typing.Callable=None) -> tuple:
+    """
+    The good and bad sample moments of descriptor columns, merged over the row blocks of a matrix
+    :param matrix: The DescriptorMatrix
+    :param columns: The descriptor columns
+    :param good_mask: Boolean row mask of the good molecules
+    :param bad_mask: Boolean row mask of the bad molecules
+    :param block_rows: Rows per block [default: about MATRIX_BLOCK_BYTES per block]
+    :param progress: Optional function called with the number of rows processed so far and the total
+    :return: Tuple of the good moments and the bad moments (see group_moments)
+    """
+    from pMPO.streaming import DescriptorMoments
+    moments = DescriptorMoments(columns)
+    for start, stop, block in matrix.blocks(matrix.positions(columns), block_rows=block_rows):
+        moments.update(block, good_mask[start:stop], bad_mask[start:stop])
+        if progress is not None:
+            progress(stop, matrix.nrows)
+    return moments.good, moments.bad
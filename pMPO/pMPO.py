@@ -20,12 +20,19 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import json
+import os
+import time
+import tracemalloc
 import typing
 import numpy as np
 import pandas as pd
 from scipy import stats
 from abc import ABCMeta
 from collections import OrderedDict
+from contextlib import contextmanager
+# The compiled scoring classes live in the NumPy-only runtime and are re-exported here
+from pMPO.runtime import CompiledpMPOModel, ModelBank, ScoreCache, is_matrix_input  # noqa: F401
 
 ########################################################################################################################
 # The following functions wrap the functionality described in:
@@ -34,29 +41,70 @@ from collections import OrderedDict
 ########################################################################################################################
 
 
+# An assortment of common words and values that evaluate to TRUE
+DEFAULT_TRUTHS = {'true', 'True', 'TRUE', 't', 'T',
+                  'good', 'Good', 'GOOD', 'g', 'G',
+                  'active', 'Active', 'ACTIVE', 'a', 'A',
+                  'yes', 'Yes', 'YES', 'y', 'Y',
+                  '1', 1, True}
+
+
 def create_boolean_evaluator(good_value=None):
     """
     Build an evaluator to determine TRUE values in a DataFrame column
     :param good_value: Value of TRUE rows ['default': is an assortment of common words and values that evaluate to TRUE]
     :return: A function that when given a series object evaluates whether the good_column is TRUE
     """
-    DEFAULT_TRUTHS = {'true', 'True', 'TRUE', 't', 'T',
-                      'good', 'Good', 'GOOD', 'g', 'G',
-                      'active', 'Active', 'ACTIVE', 'a', 'A',
-                      'yes', 'Yes', 'YES', 'y', 'Y',
-                      '1', 1, True}
     if good_value in (None or 'default'):
         return lambda x: x in DEFAULT_TRUTHS
     else:
         return lambda x: x == good_value
 
 
+def evaluate_good_values(values, good_value='default', vectorized=False) -> np.ndarray:
+    """
+    Evaluate which values of a good/bad column are TRUE, all at once
+    :param values: The values of the good/bad column (Pandas Series or array-like)
+    :param good_value: Value of TRUE rows ['default': DEFAULT_TRUTHS, str: equality, callable: applied to the values]
+    :param vectorized: Whether a callable good_value takes the whole Series instead of one value at a time
+    :return: A boolean array with the TRUE values
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(np.asarray(values))
+    if good_value is None or (isinstance(good_value, str) and good_value == 'default'):
+        return series.isin(DEFAULT_TRUTHS).values
+    if callable(good_value):
+        if vectorized:
+            result = np.asarray(good_value(series), dtype=bool)
+            if result.shape != (len(series),):
+                raise AssertionError("Vectorized good_value returned shape {} for {} values".format(result.shape,
+                                                                                                 len(series)))
+            return result
+        return np.fromiter((bool(good_value(x)) for x in series.values), dtype=bool, count=len(series))
+    return (series == good_value).values
+
+
+def descriptor_data(df):
+    """
+    Pass a DataFrame through and wrap descriptor matrix data (e.g. an Arrow table) in a pMPO.matrix.DescriptorMatrix
+    Memory maps and raw buffers have no column names, wrap them in a DescriptorMatrix first
+    :param df: A Pandas DataFrame, a DescriptorMatrix, or an Arrow table or record batch
+    :return: The DataFrame or DescriptorMatrix
+    """
+    if isinstance(df, pd.DataFrame):
+        return df
+    from pMPO.matrix import as_matrix
+    return as_matrix(df)
+
+
 def numeric_column_iterator(df: pd.DataFrame):
     """
     Generator over all the numeric columns names in a Pandas DataFrame
-    :param df: A Pandas DataFrame
+    :param df: A Pandas DataFrame (or a pMPO.matrix.DescriptorMatrix)
     :return: The string names of the numeric columns in the DataFrame
     """
+    if not isinstance(df, pd.DataFrame):
+        yield from df.numeric_columns()
+        return
     for col, dt in df.dtypes.to_dict().items():
         # noinspection PyUnresolvedReferences
         if np.issubdtype(dt, np.number):
@@ -75,25 +123,199 @@ def cutoff_fn(good_mean: float, good_std: float, bad_mean: float, bad_std: float
     return (abs(bad_mean - good_mean) / (good_std + bad_std)) * good_std + good_mean
 
 
+# Number of descriptor columns processed at once by the vectorized statistics engine (bounds the temporary memory)
+STATISTICS_BLOCK_COLUMNS = 256
+# Smaller column blocks used by memory-lean builders
+LEAN_BLOCK_COLUMNS = 32
+
+
+def group_moments(X: np.ndarray, mask: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    NaN-aware sample counts, means and sums of squared deviations (M2) for every column of a matrix
+    :param X: A 2D float array with one row per molecule and one column per descriptor
+    :param mask: A boolean row mask selecting the group (e.g. the good molecules)
+    :return: Tuple of the per-column counts, means and M2 arrays
+    """
+    values = X[mask]
+    missing = np.isnan(values)
+    counts = values.shape[0] - missing.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(missing, 0.0, values).sum(axis=0) / counts
+    deviations = np.where(missing, 0.0, values - means)
+    m2 = np.square(deviations).sum(axis=0)
+    return counts, means, m2
+
+
+def welch_ttest(mean1, var1, n1, mean2, var2, n2) -> np.ndarray:
+    """
+    Two-sided Welch's t-test (unequal variances) from summary statistics, as in stats.ttest_ind(equal_var=False)
+    :param mean1: Mean(s) of the first sample
+    :param var1: Unbiased variance(s) of the first sample
+    :param n1: Size(s) of the first sample
+    :param mean2: Mean(s) of the second sample
+    :param var2: Unbiased variance(s) of the second sample
+    :param n2: Size(s) of the second sample
+    :return: The p-value(s)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vn1 = np.asarray(var1, dtype=np.float64) / n1
+        vn2 = np.asarray(var2, dtype=np.float64) / n2
+        dof = np.square(vn1 + vn2) / (np.square(vn1) / (n1 - 1.0) + np.square(vn2) / (n2 - 1.0))
+        # Same convention as scipy when both variances are zero
+        dof = np.where(np.isnan(dof), 1.0, dof)
+        t = (np.asarray(mean1, dtype=np.float64) - mean2) / np.sqrt(vn1 + vn2)
+    return 2.0 * stats.t.sf(np.abs(t), dof)
+
+
+def statistics_from_moments(names: typing.Sequence[str], good_moments, bad_moments, min_samples=10) -> pd.DataFrame:
+    """
+    Build the raw separation statistics from per-descriptor good/bad sample moments
+    Descriptors with fewer than min_samples good or bad samples are dropped
+    :param names: The descriptor names
+    :param good_moments: Tuple of the counts, means and M2 arrays of the good samples (see group_moments)
+    :param bad_moments: Tuple of the counts, means and M2 arrays of the bad samples (see group_moments)
+    :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+    :return: A Pandas DataFrame with the name, p_value, good/bad means, stds and sample counts
+    """
+    good_n, good_mean, good_m2 = (np.asarray(x) for x in good_moments)
+    bad_n, bad_mean, bad_m2 = (np.asarray(x) for x in bad_moments)
+    keep = (good_n >= min_samples) & (bad_n >= min_samples)
+    good_n, good_mean, good_m2 = good_n[keep], good_mean[keep], good_m2[keep]
+    bad_n, bad_mean, bad_m2 = bad_n[keep], bad_mean[keep], bad_m2[keep]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_values = welch_ttest(good_mean, good_m2 / (good_n - 1.0), good_n, bad_mean, bad_m2 / (bad_n - 1.0), bad_n)
+        good_std = np.sqrt(good_m2 / good_n)
+        bad_std = np.sqrt(bad_m2 / bad_n)
+    return pd.DataFrame(OrderedDict([('name', np.asarray(names, dtype=object)[keep]),
+                                     ('p_value', p_values),
+                                     ('good_mean', good_mean),
+                                     ('good_std', good_std),
+                                     ('good_nsamples', good_n),
+                                     ('bad_mean', bad_mean),
+                                     ('bad_std', bad_std),
+                                     ('bad_nsamples', bad_n)]))
+
+
+def concatenate_block_moments(block_moments: typing.Sequence) -> typing.Tuple[tuple, tuple]:
+    """
+    Join the good/bad moments of consecutive column blocks into moments over all the columns
+    :param block_moments: Sequence of (good moments, bad moments) tuples, one per column block (see group_moments)
+    :return: Tuple of the joined good moments and bad moments
+    """
+    good_moments = tuple(np.concatenate([m[0][i] for m in block_moments]) if block_moments else np.empty(0)
+                         for i in range(3))
+    bad_moments = tuple(np.concatenate([m[1][i] for m in block_moments]) if block_moments else np.empty(0)
+                        for i in range(3))
+    return good_moments, bad_moments
+
+
 def calculate_descriptor_statistics(df: pd.DataFrame, good_column: str, min_samples=10, p_cutoff=0.01,
-                                    q_cutoff=0.05, ignore_columns=None) -> pd.DataFrame:
+                                    q_cutoff=0.05, ignore_columns=None, engine: str='vectorized', n_jobs: int=1,
+                                    shard_timings: list=None) -> pd.DataFrame:
     """
     Calculate the separation statistics between good and bad molecules on each descriptor column
     The output DataFrame has the following columns:
     name, p_value, good_mean, good_std, good_nsamples, bad_mean, bad_std, bad_nsamples
-    :param df: Input DataFrame with good molecules, bad molecules, and data
+    :param df: Input DataFrame with good molecules, bad molecules, and data, or a descriptor matrix (a
+               pMPO.matrix.DescriptorMatrix, Arrow table or record batch) read in row blocks
     :param good_column: Input DataFrame column that distinguishes good from bad values
     :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
     :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
     :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
     :param ignore_columns: List of columns to ignore in the DataFrame
+    :param engine: 'vectorized' computes all columns at once from the descriptor matrix, 'columnwise' runs one t-test
+                   per column
+    :param n_jobs: Number of worker processes for the vectorized engine (-1 uses all CPUs)
+    :param shard_timings: Optional list that receives a timing record for each shard of columns processed
     :return: A Pandas DataFrame with summary statistics sorted by p-value
     """
+    df = descriptor_data(df)
+    columns = [col for col in numeric_column_iterator(df) if ignore_columns is None or col not in ignore_columns]
+    if not isinstance(df, pd.DataFrame):
+        # Every column of a matrix is numeric, including the labels
+        columns = [col for col in columns if col != good_column]
+        if engine == 'columnwise':
+            raise AssertionError("The columnwise statistics engine needs a Pandas DataFrame")
+    if engine == 'columnwise':
+        column_stats = _columnwise_descriptor_statistics(df, good_column, columns, min_samples)
+        return finalize_descriptor_statistics(column_stats, p_cutoff=p_cutoff, q_cutoff=q_cutoff)
+    elif engine == 'vectorized':
+        return descriptor_statistics_from_mask(df, columns, np.asarray(df[good_column] == True),
+                                               np.asarray(df[good_column] == False), min_samples=min_samples,
+                                               p_cutoff=p_cutoff, q_cutoff=q_cutoff, n_jobs=n_jobs,
+                                               shard_timings=shard_timings)
+    else:
+        raise KeyError("Unknown descriptor statistics engine: {}".format(engine))
+
+
+def descriptor_statistics_from_mask(df: pd.DataFrame, columns: typing.Sequence[str], good_mask: np.ndarray,
+                                    bad_mask: np.ndarray, min_samples=10, p_cutoff=0.01, q_cutoff=0.05,
+                                    n_jobs: int=1, shard_timings: list=None,
+                                    block_columns: int=STATISTICS_BLOCK_COLUMNS,
+                                    progress: typing.Callable=None) -> pd.DataFrame:
+    """
+    Calculate the separation statistics of descriptor columns given the good and bad rows as boolean masks
+    Only the listed columns of the DataFrame are read and the DataFrame is not modified
+    A descriptor matrix is read in row blocks by a single process
+    :param df: Input DataFrame with the descriptor columns, or a descriptor matrix (see calculate_descriptor_statistics)
+    :param columns: The descriptor columns to calculate statistics for
+    :param good_mask: Boolean row mask of the good molecules
+    :param bad_mask: Boolean row mask of the bad molecules
+    :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+    :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
+    :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
+    :param n_jobs: Number of worker processes (-1 uses all CPUs)
+    :param shard_timings: Optional list that receives a timing record for each shard of columns processed
+    :param block_columns: The number of columns processed at once by the serial path (bounds the temporary memory)
+    :param progress: Optional function called with the number of columns processed so far and the total (rows for a
+                     descriptor matrix)
+    :return: A Pandas DataFrame with summary statistics sorted by p-value
+    """
+    columns = list(columns)
+    df = descriptor_data(df)
+    if not isinstance(df, pd.DataFrame):
+        from pMPO.matrix import matrix_moments
+        started = time.perf_counter()
+        good_moments, bad_moments = matrix_moments(df, columns, good_mask, bad_mask, progress=progress)
+        if shard_timings is not None:
+            shard_timings.append({'shard': 0, 'start': 0, 'stop': len(columns), 'pid': os.getpid(),
+                                  'seconds': time.perf_counter() - started})
+    elif n_jobs is not None and n_jobs != 1:
+        from pMPO.parallel import parallel_descriptor_moments
+        good_moments, bad_moments = parallel_descriptor_moments(df, columns, good_mask, bad_mask, n_jobs=n_jobs,
+                                                                shard_timings=shard_timings, progress=progress)
+    else:
+        started = time.perf_counter()
+        moments = []
+        for start in range(0, len(columns), block_columns):
+            block = columns[start:start + block_columns]
+            X = np.empty((len(df), len(block)), dtype=np.float64, order='F')
+            for idx, col in enumerate(block):
+                X[:, idx] = df[col].values
+            moments.append((group_moments(X, good_mask), group_moments(X, bad_mask)))
+            del X
+            if progress is not None:
+                progress(start + len(block), len(columns))
+        good_moments, bad_moments = concatenate_block_moments(moments)
+        if shard_timings is not None:
+            shard_timings.append({'shard': 0, 'start': 0, 'stop': len(columns), 'pid': os.getpid(),
+                                  'seconds': time.perf_counter() - started})
+    column_stats = statistics_from_moments(columns, good_moments, bad_moments, min_samples=min_samples)
+    return finalize_descriptor_statistics(column_stats, p_cutoff=p_cutoff, q_cutoff=q_cutoff)
+
+
+def _columnwise_descriptor_statistics(df: pd.DataFrame, good_column: str, columns: typing.Sequence[str],
+                                      min_samples=10) -> pd.DataFrame:
+    """
+    Calculate the raw separation statistics one descriptor column at a time
+    :param df: Input DataFrame with good molecules, bad molecules, and data
+    :param good_column: Input DataFrame column that distinguishes good from bad values
+    :param columns: The descriptor columns to calculate statistics for
+    :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+    :return: A Pandas DataFrame with the name, p_value, good/bad means, stds and sample counts
+    """
     data = []
-    for col in numeric_column_iterator(df):
-        # Skip columns we're explicitly asked to ignore
-        if ignore_columns is not None and col in ignore_columns:
-            continue
+    for col in columns:
         # Create a sub-DataFrame with just the good/bad indicator and this numeric column
         subdf = df[[good_column, col]].dropna(thresh=2)
         # Get arrays of values for the good/bad samples
@@ -113,7 +335,17 @@ def calculate_descriptor_statistics(df: pd.DataFrame, good_column: str, min_samp
                     'bad_nsamples': len(bad)
                 }
             )
-    column_stats = pd.DataFrame(data)
+    return pd.DataFrame(data)
+
+
+def finalize_descriptor_statistics(column_stats: pd.DataFrame, p_cutoff=0.01, q_cutoff=0.05) -> pd.DataFrame:
+    """
+    Add the significance, cutoff, sigmoidal parameters and z-score to the raw separation statistics
+    :param column_stats: The Pandas DataFrame with the raw statistics [NOTE: IS MODIFIED]
+    :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
+    :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
+    :return: The Pandas DataFrame with summary statistics sorted by p-value
+    """
     # Determine statistically significant columns
     column_stats['significant'] = column_stats['p_value'] < p_cutoff
     # Calculate the cutoff
@@ -153,10 +385,229 @@ def calculate_descriptor_statistics(df: pd.DataFrame, good_column: str, min_samp
                                         (-1.0 * (column_stats['bad_mean'] - column_stats['cutoff']))))
     # Calculate the cutoff Z-score
     column_stats['z'] = np.absolute(column_stats['cutoff'] - column_stats['good_mean']) / column_stats['good_std']
-    return column_stats.sort_values(by='p_value')
+    # A stable sort keeps tied p-values in column order so every path selects the same descriptors
+    return column_stats.sort_values(by='p_value', kind='mergesort')
 
 
-def pick_uncorrelated_columns(df: pd.DataFrame, column_stats: pd.DataFrame, r2_cutoff=0.53, resort=False) -> pd.DataFrame:  # noqa
+def annotate_selected_columns(column_stats: pd.DataFrame, selected_descriptors: typing.Iterable[str]):
+    """
+    Mark the selected descriptors and calculate their weights from the z-scores
+    :param column_stats: The Pandas DataFrame with the column summary statistics [NOTE: IS MODIFIED]
+    :param selected_descriptors: The names of the selected descriptors
+    """
+    # Annotate selected descriptors
+    column_stats['selected'] = column_stats['significant'] & column_stats['name'].isin(set(selected_descriptors))
+    # Compute the weights
+    z_sum = column_stats[(column_stats['selected'] == True)].z.sum()
+    column_stats['w'] = np.where(column_stats['selected'] == True, column_stats['z'] / z_sum, np.nan)
+
+
+def select_uncorrelated_columns(column_stats: pd.DataFrame, desc_correlation: pd.DataFrame, r2_cutoff=0.53):
+    """
+    Select uncorrelated descriptors by p-value from a precomputed r^2 correlation matrix then calculate the weights
+    for the remaining uncorrelated descriptors
+    :param column_stats: The Pandas DataFrame with the column summary statistics [NOTE: IS MODIFIED]
+    :param desc_correlation: The r^2 correlation matrix covering at least all the significant descriptors
+    :param r2_cutoff: Threshold R^2 that defines correlated descriptors
+    """
+    significant_names = column_stats[(column_stats.significant == True)].name.values.tolist()
+    r2 = desc_correlation.loc[significant_names, significant_names].values
+    annotate_selected_columns(column_stats, greedy_uncorrelated_selection(significant_names, r2, r2_cutoff))
+
+
+def greedy_uncorrelated_selection(names: typing.Sequence[str], r2: np.ndarray, r2_cutoff=0.53) -> typing.List[str]:
+    """
+    Pick the descriptors with the highest separation and do not select correlated descriptors
+    :param names: The candidate descriptor names in priority (p-value) order
+    :param r2: The square r^2 matrix of the candidates, in the same order
+    :param r2_cutoff: Threshold R^2 that defines correlated descriptors
+    :return: The names of the selected descriptors
+    """
+    # A descriptor is blocked as soon as it is correlated to a selected (higher priority) descriptor
+    blocked = np.zeros(len(names), dtype=bool)
+    selected_descriptors = []
+    for idx, this_desc in enumerate(names):
+        if not blocked[idx]:
+            selected_descriptors.append(this_desc)
+            blocked |= r2[:, idx] > r2_cutoff
+    return selected_descriptors
+
+
+def pairwise_r2(df: pd.DataFrame, names: typing.Sequence[str], dtype=np.float64, block_rows: int=16384,
+                progress: typing.Callable=None) -> np.ndarray:
+    """
+    The pairwise-complete r^2 matrix of DataFrame columns (the square of DataFrame.corr()) from matrix products
+    The rows are processed in blocks so only a block of the descriptor matrix is materialized at a time
+    :param df: The main Pandas DataFrame, or a descriptor matrix (see calculate_descriptor_statistics)
+    :param names: The descriptor columns
+    :param dtype: The floating point type of the row blocks (np.float32 halves the memory and time)
+    :param block_rows: The number of rows per block
+    :param progress: Optional function called with the number of rows processed so far and the total
+    :return: The square r^2 matrix (of type dtype)
+    """
+    d = len(names)
+    df = descriptor_data(df)
+    # Center on the column means so the sums of squares keep their precision
+    if isinstance(df, pd.DataFrame):
+        columns = [df[col].values for col in names]
+        with np.errstate(invalid='ignore'):
+            shift = np.array([np.nanmean(values) if len(values) else 0.0 for values in columns], dtype=np.float64)
+        blocks = ([values[start:start + block_rows] for values in columns] for start in range(0, len(df), block_rows))
+    else:
+        # A descriptor matrix is read in row blocks, once for the means and once for the sums
+        positions = df.positions(names)
+        shift = df.column_means(positions, block_rows=block_rows)
+        blocks = (block.T for _, _, block in df.blocks(positions, block_rows=block_rows))
+    shift[np.isnan(shift)] = 0.0
+    counts, sums, squares, products = (np.zeros((d, d), dtype=np.float64) for _ in range(4))
+    for start, block_columns in zip(range(0, len(df), block_rows), blocks):
+        W = np.empty((min(block_rows, len(df) - start), d), dtype=dtype, order='F')
+        Y = np.empty(W.shape, dtype=dtype, order='F')
+        for idx, values in enumerate(block_columns):
+            block = values.astype(np.float64)
+            present = ~np.isnan(block)
+            W[:, idx] = present
+            Y[:, idx] = np.where(present, block - shift[idx], 0.0)
+        counts += W.T.dot(W)
+        sums += Y.T.dot(W)
+        products += Y.T.dot(Y)
+        np.square(Y, out=Y)
+        squares += Y.T.dot(W)
+        del W, Y
+        if progress is not None:
+            progress(min(start + block_rows, len(df)), len(df))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variances = squares - np.square(sums) / counts
+        r2 = np.square(products - sums * sums.T / counts) / (variances * variances.T)
+    r2[counts < 2] = np.nan
+    return r2.astype(dtype, copy=False)
+
+
+def condense_matrix(square: np.ndarray) -> np.ndarray:
+    """
+    Keep only the upper triangle (without the diagonal) of a symmetric matrix
+    :param square: The (d x d) symmetric matrix
+    :return: The condensed 1D array of length d * (d - 1) / 2, row by row
+    """
+    d = square.shape[0]
+    condensed = np.empty(d * (d - 1) // 2, dtype=square.dtype)
+    offset = 0
+    for row in range(d - 1):
+        condensed[offset:offset + d - row - 1] = square[row, row + 1:]
+        offset += d - row - 1
+    return condensed
+
+
+def expand_condensed_matrix(condensed: np.ndarray, d: int, diagonal=1.0) -> np.ndarray:
+    """
+    Rebuild a symmetric matrix from its condensed upper triangle (see condense_matrix)
+    :param condensed: The condensed 1D array
+    :param d: The size of the matrix
+    :param diagonal: The value of the diagonal
+    :return: The (d x d) symmetric matrix
+    """
+    square = np.full((d, d), diagonal, dtype=condensed.dtype)
+    offset = 0
+    for row in range(d - 1):
+        square[row, row + 1:] = condensed[offset:offset + d - row - 1]
+        square[row + 1:, row] = condensed[offset:offset + d - row - 1]
+        offset += d - row - 1
+    return square
+
+
+class LazyCorrelation:
+    """
+    Compute r^2 correlation columns of a DataFrame on demand
+    A requested descriptor is correlated (pairwise-complete, like DataFrame.corr()) against itself and every candidate
+    after it in priority order, and the result is cached. Entries that were never needed stay NaN
+    Only the column means are kept between requests: the candidates are centered block by block as they are needed, so
+    the temporary memory is bounded by block_columns columns instead of copies of every candidate
+    """
+    def __init__(self, df: pd.DataFrame, names: typing.Sequence[str], block_columns: int=STATISTICS_BLOCK_COLUMNS):
+        """
+        Set up the lazy correlation
+        :param df: The main Pandas DataFrame
+        :param names: The candidate descriptor columns in priority order
+        :param block_columns: The number of candidate columns centered at once
+        """
+        self.df = df
+        self.names = list(names)
+        self.block_columns = block_columns
+        self._index = {name: idx for idx, name in enumerate(self.names)}
+        with np.errstate(invalid='ignore'):
+            self.means = np.array([np.nanmean(df[col].values.astype(np.float64)) if len(df) else 0.0
+                                   for col in self.names], dtype=np.float64)
+        self.means[np.isnan(self.means)] = 0.0
+        self.cache = OrderedDict()
+
+    def _centered(self, idx: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        The presence weights and the values centered on the column mean (0.0 where missing) of one candidate
+        :param idx: The candidate position
+        :return: The weights and the centered values
+        """
+        values = self.df[self.names[idx]].values.astype(np.float64)
+        present = ~np.isnan(values)
+        return present.astype(np.float64), np.where(present, values - self.means[idx], 0.0)
+
+    def r2(self, name: str) -> np.ndarray:
+        """
+        The r^2 of one descriptor against itself and all the lower priority candidates
+        :param name: The descriptor name
+        :return: A float array of r^2 values in the order of self.names (NaN for higher priority candidates)
+        """
+        if name not in self.cache:
+            idx = self._index[name]
+            m, x = self._centered(idx)
+            # Every pairwise sum is a matrix-vector product over a block of centered candidates
+            left = np.vstack([m, x, np.square(x)])
+            sums = np.empty((6, len(self.names) - idx), dtype=np.float64)
+            for start in range(idx, len(self.names), self.block_columns):
+                stop = min(start + self.block_columns, len(self.names))
+                W = np.empty((len(self.df), stop - start), dtype=np.float64, order='F')
+                Y = np.empty(W.shape, dtype=np.float64, order='F')
+                for position in range(start, stop):
+                    W[:, position - start], Y[:, position - start] = self._centered(position)
+                sums[:3, start - idx:stop - idx] = left.dot(W)
+                sums[3:5, start - idx:stop - idx] = left[:2].dot(Y)
+                np.square(Y, out=Y)
+                sums[5, start - idx:stop - idx] = m.dot(Y)
+                del W, Y
+            counts, sx, sxx, sy, sxy, syy = sums
+            with np.errstate(invalid='ignore', divide='ignore'):
+                r = (sxy - sx * sy / counts) / np.sqrt((sxx - np.square(sx) / counts) *
+                                                      (syy - np.square(sy) / counts))
+            r[counts < 2] = np.nan
+            r2 = np.full(len(self.names), np.nan)
+            r2[idx:] = np.square(r)
+            self.cache[name] = r2
+        return self.cache[name]
+
+    def frame(self) -> pd.DataFrame:
+        """
+        All the r^2 columns computed so far
+        :return: A Pandas DataFrame with the candidate descriptors as rows and the computed descriptors as columns
+        """
+        return pd.DataFrame(OrderedDict((name, r2) for name, r2 in self.cache.items()), index=self.names,
+                            columns=list(self.cache.keys()))
+
+
+def significant_correlation(df: pd.DataFrame, column_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calculate the r^2 correlation matrix for all the statistically significant columns
+    :param df: The main Pandas DataFrame, or a descriptor matrix (see calculate_descriptor_statistics)
+    :param column_stats: The Pandas DataFrame with the column summary statistics
+    :return: The descriptor r^2 correlation matrix
+    """
+    significant_columns = column_stats[(column_stats.significant == True)]
+    names = significant_columns.name.values.tolist()
+    if not isinstance(df, pd.DataFrame):
+        return pd.DataFrame(pairwise_r2(df, names), index=names, columns=names)
+    return np.square(df[names].corr())
+
+
+def pick_uncorrelated_columns(df: pd.DataFrame, column_stats: pd.DataFrame, r2_cutoff=0.53, resort=False,
+                              lazy=False) -> pd.DataFrame:
     """
     Calculate the descriptor r^2 correlation matrix and select uncorrelated descriptors by p-value then calculate
     the weights for the remaining uncorrelated descriptors
@@ -164,25 +615,27 @@ def pick_uncorrelated_columns(df: pd.DataFrame, column_stats: pd.DataFrame, r2_c
     :param column_stats: The Pandas DataFrame with the column summary statistics [NOTE: IS MODIFIED]
     :param r2_cutoff: Threshold R^2 that defines correlated descriptors
     :param resort: Whether to resort the column statistics
-    :return: Tuple of the descriptor corelation matrix and selected descriptors
+    :param lazy: Only compute the correlations of the selected descriptors instead of the full matrix
+    :return: The descriptor r^2 correlation matrix (significant x selected descriptors when lazy)
     """
     if resort:
         df = df.sort_values(by='p_value')
     # Calculate the r^2 correlation matrix for all the statistically significant columns
     significant_columns = column_stats[(column_stats.significant == True)]
-    desc_correlation = np.square(df[significant_columns.name.values.tolist()].corr())
-    # Pick the descriptors with the highest separation and do not select correlated descriptors
-    selected_descriptors = set()
-    for row in significant_columns.iterrows():
-        this_desc = row[1]['name']
-        # Do not select this descriptor if it is correlated to a higher priority descriptor
-        if not any(desc_correlation[this_desc][that_desc] > r2_cutoff for that_desc in selected_descriptors):
-            selected_descriptors.add(this_desc)
-    # Annotate selected descriptors
-    column_stats['selected'] = column_stats['significant'] & column_stats['name'].isin(selected_descriptors)
-    # Compute the weights
-    z_sum = column_stats[(column_stats['selected'] == True)].z.sum()
-    column_stats['w'] = np.where(column_stats['selected'] == True, column_stats['z'] / z_sum, np.nan)
+    if lazy:
+        correlation = LazyCorrelation(df, significant_columns.name.values.tolist())
+        blocked = np.zeros(len(correlation.names), dtype=bool)
+        selected_descriptors = []
+        for idx, this_desc in enumerate(correlation.names):
+            # Only descriptors that are not correlated to a higher priority descriptor get selected, and only the
+            # selected descriptors need their correlations against the remaining candidates
+            if not blocked[idx]:
+                selected_descriptors.append(this_desc)
+                blocked |= correlation.r2(this_desc) > r2_cutoff
+        annotate_selected_columns(column_stats, selected_descriptors)
+        return correlation.frame()
+    desc_correlation = significant_correlation(df, column_stats)
+    select_uncorrelated_columns(column_stats, desc_correlation, r2_cutoff=r2_cutoff)
     # Return the corelation matirx
     return desc_correlation
 
@@ -287,6 +740,11 @@ class SigmoidalFunction(pMPOFunction):
         return str(self)
 
 
+# The JSON model format
+JSON_FORMAT = 'pMPO'
+JSON_FORMAT_VERSION = 1
+
+
 class pMPOModel:
     """
     A pMPO model that returns a sum over all the component functions
@@ -346,6 +804,71 @@ class pMPOModel:
                 score += _score
         return score
 
+    def _lookup_key(self, key: str) -> str:
+        """
+        Resolve a descriptor name to the key used in the model's function dictionaries
+        :param key: The descriptor name
+        :return: The key for the gaussians/sigmoidals dictionaries
+        """
+        return key.upper() if self.case_insensitive else key
+
+    def _score_columns(self, columns: typing.Iterable[typing.Tuple[str, typing.Any]], nrows: int) -> np.ndarray:
+        """
+        Apply the pMPO model over whole descriptor columns at once
+        Follows the same rules as the scalar path: missing (NaN) values and irrelevant columns contribute 0.0
+        :param columns: Iterable of (descriptor name, function returning the 1D column values) pairs
+        :param nrows: The number of rows being scored
+        :return: A float array of the pMPO scores
+        """
+        scores = np.zeros(nrows, dtype=np.float64)
+        for key, values in columns:
+            if not isinstance(key, str):
+                continue
+            _key = self._lookup_key(key)
+            if _key in self.gaussians:
+                val = np.asarray(values(), dtype=np.float64)
+                _score = self.gaussians[_key](val)
+                if self.sigmoidal_correction and _key in self.sigmoidals:
+                    _score *= self.sigmoidals[_key](val)
+                scores += np.where(np.isnan(val), 0.0, _score)
+        return scores
+
+    def score_array(self, X, columns: typing.Sequence[str]=None) -> np.ndarray:
+        """
+        Apply a pMPO model to a 2D array of descriptor values in one call
+        Missing model components get a score of 0.0
+        Irrelevant descriptor columns are just ignored (and never converted)
+        :param X: A 2D array-like with one row per molecule and one column per descriptor, or a descriptor matrix
+                  (memory map, raw buffer, Arrow table or record batch, see pMPO.matrix) scored in row blocks
+        :param columns: The descriptor names of the columns of X (Arrow data and DescriptorMatrix have their own)
+        :return: A float array with the pMPO score of each row
+        """
+        if is_matrix_input(X):
+            from pMPO.matrix import score_matrix
+            return score_matrix(self, X, columns)
+        if columns is None:
+            raise AssertionError("Input to pMPO score_array needs the names of its columns")
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise AssertionError("Input to pMPO score_array must be 2D, got shape {}".format(X.shape))
+        if X.shape[1] != len(columns):
+            raise AssertionError("Input to pMPO score_array has {} columns but {} column names".format(
+                X.shape[1], len(columns)))
+        return self._score_columns(((col, lambda idx=idx: X[:, idx]) for idx, col in enumerate(columns)),
+                                   X.shape[0])
+
+    def score_frame(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Apply a pMPO model to every row of a DataFrame in one call
+        Missing model components get a score of 0.0
+        Irrelevant (including non-numeric) columns are just ignored
+        :param df: A Pandas DataFrame with one row per molecule and descriptors as columns
+        :return: A Pandas Series of pMPO scores aligned to the DataFrame index
+        """
+        scores = self._score_columns(((col, lambda idx=idx: df.iloc[:, idx].values)
+                                      for idx, col in enumerate(df.columns)), len(df))
+        return pd.Series(scores, index=df.index, name=self.name)
+
     def register(self, name: str, gaussian: WeightedGaussianFunction, sigmoidal: SigmoidalFunction):
         """
         Register a function with this model
@@ -353,10 +876,86 @@ class pMPOModel:
         :param gaussian: The weighted Gaussian pMPO function
         :param sigmoidal: The sigmoidal correction to the weighted Gaussian function
         """
-        _name = name.upper() if self.case_insensitive else name
+        _name = self._lookup_key(name)
         self.gaussians[_name] = gaussian
         self.sigmoidals[_name] = sigmoidal
 
+    def compile(self) -> 'CompiledpMPOModel':
+        """
+        Freeze this model into an immutable, array-backed scoring kernel
+        Later changes to this model are not reflected in the compiled model
+        :return: The compiled pMPO model
+        """
+        descriptors = self.descriptors
+        params = np.zeros((len(CompiledpMPOModel.PARAMETERS), len(descriptors)), dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            for idx, name in enumerate(descriptors):
+                gaussian = self.gaussians[name]
+                params[0, idx] = gaussian.weight
+                params[1, idx] = gaussian.mean
+                params[2, idx] = 1.0 / (2.0 * np.square(gaussian.std))
+                # A missing sigmoidal keeps b = 0, which makes the correction term exactly 1.0
+                if name in self.sigmoidals:
+                    sigmoidal = self.sigmoidals[name]
+                    params[3, idx] = sigmoidal.b
+                    params[4, idx] = np.log(sigmoidal.c)
+                    params[5, idx] = sigmoidal.cutoff
+        return CompiledpMPOModel(self.name, descriptors, params, case_insensitive=self.case_insensitive,
+                                 sigmoidal_correction=self.sigmoidal_correction)
+
+    def tabulate(self, steps: typing.Dict[str, float]=None, max_error: float=1e-4) -> 'TabulatedpMPOModel':
+        """
+        Precompute lookup tables of the descriptor contributions, so scoring is a gather and an add per descriptor
+        Descriptors in steps get exact tables on their grid, the others linearly interpolated tables
+        :param steps: The grid step of the descriptors that get exact tables, e.g. {'HBD': 1, 'TPSA': 0.01}
+        :param max_error: The maximum absolute error of a score, shared evenly by the interpolated descriptors
+        :return: The TabulatedpMPOModel (later changes to this model are not reflected in it)
+        """
+        from pMPO.lookup import tabulate
+        return tabulate(self, steps=steps, max_error=max_error)
+
+    def to_json(self, indent: int=None) -> str:
+        """
+        Serialize the model parameters, name and flags to JSON
+        :param indent: Optional indentation of the JSON text
+        :return: The JSON text
+        """
+        descriptors = []
+        for key in self.descriptors:
+            gaussian = self.gaussians[key]
+            entry = OrderedDict([('key', key), ('name', gaussian.name), ('weight', gaussian.weight),
+                                 ('mean', gaussian.mean), ('std', gaussian.std)])
+            if key in self.sigmoidals:
+                sigmoidal = self.sigmoidals[key]
+                entry.update([('b', sigmoidal.b), ('c', sigmoidal.c), ('cutoff', sigmoidal.cutoff)])
+            descriptors.append(entry)
+        return json.dumps(OrderedDict([('format', JSON_FORMAT),
+                                       ('version', JSON_FORMAT_VERSION),
+                                       ('name', self.name),
+                                       ('case_insensitive', self.case_insensitive),
+                                       ('sigmoidal_correction', self.sigmoidal_correction),
+                                       ('descriptors', descriptors)]), indent=indent)
+
+    @classmethod
+    def from_json(cls, text: str) -> 'pMPOModel':
+        """
+        Create a model from its JSON serialization (see to_json)
+        :param text: The JSON text
+        :return: The pMPO model
+        """
+        data = json.loads(text)
+        if data.get('format') != JSON_FORMAT:
+            raise AssertionError("Not a JSON pMPO model")
+        if data.get('version') != JSON_FORMAT_VERSION:
+            raise AssertionError("Unsupported JSON pMPO model version: {}".format(data.get('version')))
+        model = cls(data['name'], case_insensitive=data['case_insensitive'],
+                    sigmoidal_correction=data['sigmoidal_correction'])
+        for entry in data['descriptors']:
+            model.gaussians[entry['key']] = WeightedGaussianFunction(**entry)
+            if 'b' in entry:
+                model.sigmoidals[entry['key']] = SigmoidalFunction(**entry)
+        return model
+
     def __str__(self) -> str:
         """
         Stringify the model by creating an equation that represents the pMPO
@@ -369,16 +968,54 @@ class pMPOModel:
         return str(self)
 
 
+def model_from_statistics(column_stats: pd.DataFrame, model_name: str, sigmoidal_correction=True,
+                          case_insensitive=True) -> pMPOModel:
+    """
+    Create a pMPO model from the descriptor statistics of the selected descriptors
+    :param column_stats: The Pandas DataFrame with the column summary statistics and the selected and w columns
+    :param model_name: Name of the pMPO model
+    :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+    :param case_insensitive: Whether the model should be case insensitive to the descriptor keys
+    :return: A usable pMPO model
+    """
+    # TODO: This is currently set up for sigmoidal functions only (as is the rest of the pMPO)
+    # It could be extended to different functional forms
+    model = pMPOModel(model_name, sigmoidal_correction=sigmoidal_correction, case_insensitive=case_insensitive)
+    # Populate the model
+    for row in column_stats[(column_stats['selected'] == True)][['name', 'w', 'good_mean', 'good_std', 'b', 'c', 'cutoff']].iterrows():  # noqa
+        row_dict = row[1].to_dict()
+        # Rename the columns
+        row_dict['mean'] = row_dict.pop('good_mean')
+        row_dict['std'] = row_dict.pop('good_std')
+        row_dict['weight'] = row_dict.pop('w')
+        # Create the function
+        gaussian = WeightedGaussianFunction(**row_dict)
+        sigmoidal = SigmoidalFunction(**row_dict)
+        model.register(row_dict['name'], gaussian, sigmoidal)
+    return model
+
+
+class BuildCancelled(Exception):
+    """
+    Raised when the progress function of a pMPOBuilder stops the build
+    """
+    pass
+
+
 class pMPOBuilder:
     """
     Build a pMPO model
     """
     def __init__(self, df: pd.DataFrame, good_column: str, model_name: str, good_value='default',
                  pMPO_good_column_name: str=None, min_samples: int=10, p_cutoff: float=0.01, q_cutoff: float=0.05,
-                 r2_cutoff: float=0.53, sigmoidal_correction=True, case_insensitive=True):
+                 r2_cutoff: float=0.53, sigmoidal_correction=True, case_insensitive=True, n_jobs: int=1,
+                 lazy_correlation: bool=False, inplace: bool=True, lean: bool=False, cache=None,
+                 progress: typing.Callable=None, profile_memory: bool=False):
         """
         Build a pMPO model
-        :param df: Input DataFrame with good molecules, bad molecules, and data
+        :param df: Input DataFrame with good molecules, bad molecules, and data, or a descriptor matrix (a
+                   pMPO.matrix.DescriptorMatrix, Arrow table or record batch) read in row blocks and never modified
+                   (not with lazy_correlation or cache)
         :param good_column: Input DataFrame column that distinguishes good from bad values
         :param model_name: Name of the pMPO model
         :param good_value: Criteria to evaluate good from bad molecules ('default', str, callable)
@@ -389,51 +1026,238 @@ class pMPOBuilder:
         :param r2_cutoff: The r^2 cutoff for determining linearly correlated descriptors
         :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
         :param case_insensitive: Whether the models should be case insensitive to the descriptor keys
+        :param n_jobs: Number of worker processes for the descriptor statistics (-1 uses all CPUs)
+        :param lazy_correlation: Only compute the correlations of the selected descriptors
+        :param inplace: Add the boolean pMPO_good_column_name column to the input DataFrame, when False the input is
+                        never modified and the labels are kept in self.labels instead
+        :param lean: Save memory: never modify the input, compute the correlation in float32, keep it as a condensed
+                     upper triangle and drop the references to the input data once the model is built
+        :param cache: A cache directory (or pMPO.cache.StageCache) where the descriptor statistics and correlation are
+                      stored under a fingerprint of the descriptor values, labels and parameters
+        :param progress: Optional function called with a progress event dictionary (stage, done, total, unit) at the
+                         start and end of every stage and as the descriptor statistics and correlation advance. Each
+                         stage counts its work in one unit ('steps', 'columns', 'rows' or 'descriptors') against one
+                         total. Returning False (or raising) stops the build, False raises BuildCancelled
+        :param profile_memory: Also record the peak memory allocated during each stage in self.profile (tracemalloc,
+                               which slows the build down). The peak is None when tracemalloc was already tracing
+                               before Python 3.9, since the earlier peak cannot be reset
         """
         # -------------------------------------
         # | Set up the input Pandas DataFrame |
         # -------------------------------------
-        self.df = df
+        self.df = descriptor_data(df)
+        matrix = not isinstance(self.df, pd.DataFrame)
+        if matrix and (lazy_correlation or cache is not None):
+            raise AssertionError("pMPO lazy_correlation and cache need a Pandas DataFrame")
         # Make sure we at least have some data
         if not self.df.size:
             raise AssertionError("Input pMPO DataFrame has no data")
         # Make sure the good_column exists
         if good_column not in self.df.columns:
             raise AssertionError("{} does not exist in input pMPO DataFrame")
-        self.min_samples = min_samples
-        self.p_cutoff = p_cutoff
-        self.q_cutoff = q_cutoff
-        self.r2_cutoff = r2_cutoff
-        self.pMPO_model_name = model_name
-        self.sigmoidal_correction = sigmoidal_correction
-        self.case_insensitive = case_insensitive
-        self.pMPO = None
+        self._setup(model_name, good_value=good_value, min_samples=min_samples, p_cutoff=p_cutoff, q_cutoff=q_cutoff,
+                    r2_cutoff=r2_cutoff, sigmoidal_correction=sigmoidal_correction,
+                    case_insensitive=case_insensitive, n_jobs=n_jobs, lazy_correlation=lazy_correlation,
+                    inplace=inplace and not matrix, lean=lean, cache=cache, progress=progress,
+                    profile_memory=profile_memory)
         # The good_column name parameter is the name of the column specifying whether molecules are good or bad in the
         # input dataset. We want to have a boolean column in Pandas, which is going to be self.good_column
         if pMPO_good_column_name is None:
             self.good_column = "pMPO_POSITIVE"
         else:
             self.good_column = pMPO_good_column_name
-        # Create the evaluator that evaluates whether an individual value in the input good_column is True
-        good_value_evaluator = create_boolean_evaluator(good_value)
-        # Apply the evaluator to the input good_column and store it in the renamed self.good_column
-        self.df[self.good_column] = np.vectorize(good_value_evaluator)(self.df[good_column])
+        # Evaluate whether each value in the input good_column is True
+        with self._stage('labels'):
+            self.labels = evaluate_good_values(self.df[good_column], good_value)
+            # The descriptors are the numeric columns (the boolean labels are not numeric, in a matrix they are)
+            columns = [col for col in numeric_column_iterator(self.df) if col != self.good_column and
+                       not (matrix and col == good_column)]
+            if self.inplace:
+                # Store the labels in the renamed self.good_column
+                self.df[self.good_column] = self.labels
         # ---------------------------
         # | Do the pMPO calculation |
         # ---------------------------
+        if self.cache is not None:
+            from pMPO.cache import fingerprint
+            with self._stage('fingerprint'):
+                statistics_key = fingerprint(self.df[columns], self.labels, self.min_samples, self.p_cutoff,
+                                             self.q_cutoff)
+                correlation_key = fingerprint(statistics_key, self.r2_cutoff, self.lazy_correlation, self.lean)
         # Calculate the ability of each descriptor to separate good from bad
-        self.descriptor_stats = calculate_descriptor_statistics(self.df,
-                                                                good_column=self.good_column,
-                                                                min_samples=self.min_samples,
-                                                                p_cutoff=self.p_cutoff,
-                                                                q_cutoff=self.q_cutoff)
+        # Descriptor matrices are read in row blocks, DataFrames in column blocks
+        statistics_total, statistics_unit = (len(self.df), 'rows') if matrix else (len(columns), 'columns')
+        with self._stage('statistics', statistics_total, statistics_unit) as report:
+            self.descriptor_stats = self._cached_stage('statistics', statistics_key) if self.cache is not None \
+                else None
+            if self.descriptor_stats is None:
+                self.descriptor_stats = descriptor_statistics_from_mask(self.df,
+                                                                        columns,
+                                                                        self.labels,
+                                                                        ~self.labels,
+                                                                        min_samples=self.min_samples,
+                                                                        p_cutoff=self.p_cutoff,
+                                                                        q_cutoff=self.q_cutoff,
+                                                                        n_jobs=self.n_jobs,
+                                                                        shard_timings=self.shard_timings,
+                                                                        block_columns=LEAN_BLOCK_COLUMNS if self.lean
+                                                                        else STATISTICS_BLOCK_COLUMNS,
+                                                                        progress=lambda done, total: report(done))
+                if self.cache is not None:
+                    self.cache.put('statistics', statistics_key, self.descriptor_stats)
         # Calculate correlated descriptors
         # Note: Adds the critical "selected" column to self.descriptor_stats used to compute the weighting
-        self.descriptor_corr = pick_uncorrelated_columns(self.df,
-                                                         self.descriptor_stats,
-                                                         r2_cutoff=self.r2_cutoff,
-                                                         resort=False)
+        # With lazy_correlation the selection happens while the correlation is computed (both are in 'correlation')
+        significant_names = self.descriptor_stats[(self.descriptor_stats.significant == True)].name.values.tolist()
+        # The lean correlation advances over row blocks, the other paths only report their start and end
+        correlation_total, correlation_unit = (len(self.df), 'rows') if self.lean and not self.lazy_correlation \
+            else (len(significant_names), 'descriptors')
+        with self._stage('correlation', correlation_total, correlation_unit) as report:
+            cached_corr = self._cached_stage('correlation', correlation_key) if self.cache is not None else None
+            if self.lean and not self.lazy_correlation:
+                self.descriptor_corr = None
+                if cached_corr is None:
+                    r2 = pairwise_r2(self.df, significant_names, dtype=np.float32,
+                                     progress=lambda done, total: report(done))
+                    if self.cache is not None:
+                        self.cache.put('correlation', correlation_key,
+                                       pd.DataFrame(r2, index=significant_names, columns=significant_names))
+                else:
+                    r2 = cached_corr.values
+            elif cached_corr is not None:
+                self.descriptor_corr = cached_corr
+            else:
+                if self.lazy_correlation:
+                    self.descriptor_corr = pick_uncorrelated_columns(self.df,
+                                                                     self.descriptor_stats,
+                                                                     r2_cutoff=self.r2_cutoff,
+                                                                     resort=False,
+                                                                     lazy=True)
+                else:
+                    self.descriptor_corr = significant_correlation(self.df, self.descriptor_stats)
+                if self.lean:
+                    self.descriptor_corr = self.descriptor_corr.astype(np.float32)
+                if self.cache is not None:
+                    self.cache.put('correlation', correlation_key, self.descriptor_corr)
+        with self._stage('selection', len(significant_names), 'descriptors'):
+            if self.lean and not self.lazy_correlation:
+                annotate_selected_columns(self.descriptor_stats,
+                                          greedy_uncorrelated_selection(significant_names, r2, self.r2_cutoff))
+                self.descriptor_corr_condensed = condense_matrix(r2)
+                self.descriptor_corr_names = significant_names
+                del r2
+            elif self.lazy_correlation:
+                if cached_corr is not None:
+                    # The lazy correlation only has the columns of the selected descriptors
+                    annotate_selected_columns(self.descriptor_stats, cached_corr.columns)
+            else:
+                select_uncorrelated_columns(self.descriptor_stats, self.descriptor_corr, r2_cutoff=self.r2_cutoff)
+        if self.lean:
+            # Only the statistics and the correlation are needed from here on
+            self.df = None
+            self.labels = None
 
+    def _setup(self, model_name: str, good_value='default', min_samples: int=10, p_cutoff: float=0.01,
+               q_cutoff: float=0.05, r2_cutoff: float=0.53, sigmoidal_correction=True, case_insensitive=True,
+               n_jobs: int=1, lazy_correlation: bool=False, inplace: bool=True, lean: bool=False, cache=None,
+               progress: typing.Callable=None, profile_memory: bool=False):
+        """
+        Set the build parameters and the empty build state shared by every builder (see __init__ for the parameters)
+        """
+        self.good_value = good_value
+        self.min_samples = min_samples
+        self.p_cutoff = p_cutoff
+        self.q_cutoff = q_cutoff
+        self.r2_cutoff = r2_cutoff
+        self.pMPO_model_name = model_name
+        self.sigmoidal_correction = sigmoidal_correction
+        self.case_insensitive = case_insensitive
+        self.n_jobs = n_jobs
+        self.lazy_correlation = lazy_correlation
+        self.inplace = inplace and not lean
+        self.lean = lean
+        self.labels = None
+        self.pMPO = None
+        self.descriptor_stats = None
+        self.descriptor_corr = None
+        # The condensed float32 r^2 upper triangle and its descriptor names (lean builders only)
+        self.descriptor_corr_condensed = None
+        self.descriptor_corr_names = None
+        # Timing records for each shard of columns in the descriptor statistics
+        self.shard_timings = []
+        # The optional stage cache and whether each stage was a cache 'hit' or 'miss'
+        if cache is not None and not hasattr(cache, 'get'):
+            from pMPO.cache import StageCache
+            cache = StageCache(cache)
+        self.cache = cache
+        self.cache_events = OrderedDict()
+        # The wall time, CPU time and (optionally) peak memory of each stage
+        self.progress = progress
+        self.profile_memory = profile_memory
+        self.profile = OrderedDict()
+
+    def _emit(self, stage: str, done: int, total: typing.Optional[int], unit: str='steps'):
+        """
+        Send a progress event to the progress function
+        :param stage: The name of the stage
+        :param done: The amount of work done in the stage
+        :param total: The total amount of work in the stage (None when it is not known in advance)
+        :param unit: What the amounts of work count
+        """
+        if self.progress is not None and \
+                self.progress({'stage': stage, 'done': done, 'total': total, 'unit': unit}) is False:
+            raise BuildCancelled("pMPO build cancelled during the {} stage".format(stage))
+
+    @contextmanager
+    def _stage(self, stage: str, total: typing.Optional[int]=1, unit: str='steps'):
+        """
+        Record the wall time, CPU time and peak memory of a stage in self.profile and report its start and end
+        Yields a function reporting the amount of work done so far, in the same unit and against the same total
+        :param stage: The name of the stage
+        :param total: The total amount of work in the stage, for the progress events (None when it is not known in
+                      advance, and then the stage has no end event)
+        :param unit: What the amounts of work count ('steps', 'columns', 'rows' or 'descriptors')
+        """
+        reported = [None]
+
+        def report(done: int):
+            reported[0] = done
+            self._emit(stage, done, total, unit)
+
+        report(0)
+        tracing = self.profile_memory and not tracemalloc.is_tracing()
+        # When the caller is already tracing, the peak is only the stage's own if it can be reset (Python 3.9+)
+        measured = tracing or (self.profile_memory and hasattr(tracemalloc, 'reset_peak'))
+        if tracing:
+            tracemalloc.start()
+        elif measured:
+            tracemalloc.reset_peak()
+        if measured:
+            allocated = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield report
+            self.profile[stage] = OrderedDict([('wall_seconds', time.perf_counter() - wall),
+                                               ('cpu_seconds', time.process_time() - cpu),
+                                               ('peak_bytes', tracemalloc.get_traced_memory()[1] - allocated
+                                                if measured else None)])
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        if total is not None and reported[0] != total:
+            report(total)
+
+    def _cached_stage(self, stage: str, key: str) -> typing.Optional[pd.DataFrame]:
+        """
+        Load a stage output from the cache and record the hit or miss
+        :param stage: The name of the stage
+        :param key: The fingerprint of the stage inputs
+        :return: The stored DataFrame, or None on a miss
+        """
+        df = self.cache.get(stage, key)
+        self.cache_events[stage] = 'miss' if df is None else 'hit'
+        return df
 
     @property
     def statistics(self) -> pd.DataFrame:
@@ -446,9 +1270,15 @@ class pMPOBuilder:
     @property
     def correlation(self) -> pd.DataFrame:
         """
-        Get the correlation matrix for all input descriptors
-        :return: A DataFrame with a NxN correlation matrix
+        Get the r^2 correlation matrix for all the significant descriptors
+        With lazy_correlation only the columns of the selected descriptors are computed
+        :return: A DataFrame with a NxN (or NxK with lazy_correlation) r^2 correlation matrix
         """
+        if self.descriptor_corr is None and self.descriptor_corr_condensed is not None:
+            # Lean builders only expand the condensed matrix on request
+            return pd.DataFrame(expand_condensed_matrix(self.descriptor_corr_condensed,
+                                                        len(self.descriptor_corr_names)),
+                                index=self.descriptor_corr_names, columns=self.descriptor_corr_names)
         return self.descriptor_corr
 
     @property
@@ -457,23 +1287,11 @@ class pMPOBuilder:
         Return a simple pMPO model that can be reused for scoring
         :return: A usable pMPO model
         """
-        # TODO: This is currently set up for sigmoidal functions only (as is the rest of the pMPO)
-        # It could be extended to different functional forms
         if not self.pMPO:
-            # Create the empty model
-            self.pMPO = pMPOModel(self.pMPO_model_name, sigmoidal_correction=self.sigmoidal_correction,
-                                  case_insensitive=self.case_insensitive)
-            # Populate the model
-            for row in self.descriptor_stats[(self.descriptor_stats['selected'] == True)][['name', 'w', 'good_mean', 'good_std', 'b', 'c', 'cutoff']].iterrows():  # noqa
-                row_dict = row[1].to_dict()
-                # Rename the columns
-                row_dict['mean'] = row_dict.pop('good_mean')
-                row_dict['std'] = row_dict.pop('good_std')
-                row_dict['weight'] = row_dict.pop('w')
-                # Create the function
-                gaussian = WeightedGaussianFunction(**row_dict)
-                sigmoidal = SigmoidalFunction(**row_dict)
-                self.pMPO.register(row_dict['name'], gaussian, sigmoidal)
+            with self._stage('model'):
+                self.pMPO = model_from_statistics(self.descriptor_stats, self.pMPO_model_name,
+                                                  sigmoidal_correction=self.sigmoidal_correction,
+                                                  case_insensitive=self.case_insensitive)
             return self.pMPO
         else:
             return self.pMPO
@@ -0,0 +1,194 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import sys
+import time
+import typing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pMPO.pMPO import STATISTICS_BLOCK_COLUMNS, group_moments, concatenate_block_moments
+
+########################################################################################################################
+# Process-pool helpers for very wide descriptor tables
+# The descriptor matrix is written once into shared memory (column-major) and workers attach to it by name, so only the
+# shard boundaries and the label masks are sent to each worker
+########################################################################################################################
+
+
+def resolve_n_jobs(n_jobs: int) -> int:
+    """
+    Turn an n_jobs option into a number of worker processes
+    :param n_jobs: Number of processes (None or 1 for serial, -1 for all CPUs, -2 for all but one, ...)
+    :return: The number of worker processes
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+class SharedDescriptorMatrix:
+    """
+    A column-major float64 matrix held in shared memory
+    The creating process owns (and unlinks) the memory, worker processes attach to it by name
+    """
+    def __init__(self, shape: typing.Tuple[int, int], name: str=None):
+        """
+        Create or attach to a shared descriptor matrix
+        :param shape: The (rows x columns) shape of the matrix
+        :param name: The name of an existing shared memory block to attach to [default: create a new block]
+        """
+        self.shape = tuple(shape)
+        nbytes = max(1, int(np.prod(self.shape)) * np.dtype(np.float64).itemsize)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=nbytes if self.owner else 0)
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf, order='F')
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns: typing.Sequence[str]) -> 'SharedDescriptorMatrix':
+        """
+        Copy numeric DataFrame columns into a new shared matrix
+        :param df: The Pandas DataFrame
+        :param columns: The columns to copy
+        :return: The shared matrix
+        """
+        matrix = cls((len(df), len(columns)))
+        try:
+            for idx, col in enumerate(columns):
+                matrix.array[:, idx] = df[col].values
+        except BaseException:
+            # The shared memory outlives the process unless it is unlinked
+            matrix.close()
+            raise
+        return matrix
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        """
+        Detach from the shared memory (and release it if this process created it)
+        """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _moments_worker(name: str, shape: typing.Tuple[int, int], shard: int, start: int, stop: int,
+                    good_mask: np.ndarray, bad_mask: np.ndarray):
+    """
+    Compute the good/bad moments of one shard of columns of a shared descriptor matrix
+    :return: Tuple of the shard number, the per-block moments and the timing record
+    """
+    started = time.perf_counter()
+    matrix = SharedDescriptorMatrix(shape, name=name)
+    try:
+        moments = []
+        for block_start in range(start, stop, STATISTICS_BLOCK_COLUMNS):
+            X = matrix.array[:, block_start:min(stop, block_start + STATISTICS_BLOCK_COLUMNS)]
+            moments.append((group_moments(X, good_mask), group_moments(X, bad_mask)))
+    finally:
+        X = None
+        matrix.close()
+    return shard, moments, {'shard': shard, 'start': start, 'stop': stop, 'pid': os.getpid(),
+                            'seconds': time.perf_counter() - started}
+
+
+def shard_boundaries(ncolumns: int, nshards: int) -> typing.List[typing.Tuple[int, int]]:
+    """
+    Split columns into contiguous shards aligned to the statistics column blocks
+    Keeping the same blocks as the serial engine makes the parallel results identical to the serial ones
+    :param ncolumns: The number of columns
+    :param nshards: The maximum number of shards
+    :return: List of (start, stop) column ranges
+    """
+    nblocks = (ncolumns + STATISTICS_BLOCK_COLUMNS - 1) // STATISTICS_BLOCK_COLUMNS
+    nshards = max(1, min(nshards, nblocks))
+    bounds = np.linspace(0, nblocks, nshards + 1).round().astype(int) * STATISTICS_BLOCK_COLUMNS
+    return [(int(lo), int(min(hi, ncolumns))) for lo, hi in zip(bounds[:-1], bounds[1:]) if lo < ncolumns]
+
+
+def cancel_pool(pool: ProcessPoolExecutor, futures: typing.Sequence):
+    """
+    Shut a process pool down without running its queued work
+    :param pool: The process pool
+    :param futures: The futures submitted to the pool
+    """
+    for future in futures:
+        future.cancel()
+    if sys.version_info >= (3, 9):
+        pool.shutdown(wait=True, cancel_futures=True)
+    else:
+        pool.shutdown(wait=True)
+
+
+def parallel_descriptor_moments(df: pd.DataFrame, columns: typing.Sequence[str], good_mask: np.ndarray,
+                                bad_mask: np.ndarray, n_jobs: int=-1, shard_timings: list=None,
+                                progress: typing.Callable=None):
+    """
+    Compute the good/bad moments of many descriptor columns across a process pool
+    :param df: Input DataFrame with the descriptor columns
+    :param columns: The descriptor columns
+    :param good_mask: Boolean row mask of the good molecules
+    :param bad_mask: Boolean row mask of the bad molecules
+    :param n_jobs: Number of worker processes (-1 uses all CPUs)
+    :param shard_timings: Optional list that receives a timing record for each shard
+    :param progress: Optional function called with the number of columns processed so far and the total, as shards
+                     complete
+    :return: Tuple of the good moments and bad moments (see group_moments)
+    """
+    n_workers = resolve_n_jobs(n_jobs)
+    shards = shard_boundaries(len(columns), 2 * n_workers)
+    results = []
+    with SharedDescriptorMatrix.from_frame(df, columns) as matrix:
+        pool = ProcessPoolExecutor(max_workers=n_workers)
+        futures = []
+        try:
+            futures = [pool.submit(_moments_worker, matrix.name, matrix.shape, shard, start, stop, good_mask, bad_mask)
+                       for shard, (start, stop) in enumerate(shards)]
+            done = 0
+            for future in as_completed(futures):
+                results.append(future.result())
+                done += results[-1][2]['stop'] - results[-1][2]['start']
+                if progress is not None:
+                    progress(done, len(columns))
+        except BaseException:
+            # A cancelled build (or a failed shard) only waits for the shards already running
+            cancel_pool(pool, futures)
+            raise
+        pool.shutdown(wait=True)
+    results.sort(key=lambda x: x[0])
+    if shard_timings is not None:
+        shard_timings.extend(result[2] for result in results)
+    return concatenate_block_moments([block for result in results for block in result[1]])
@@ -0,0 +1,284 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import typing
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from scipy import stats
+from pMPO.pMPO import evaluate_good_values, numeric_column_iterator, statistics_from_moments, \
+    finalize_descriptor_statistics, greedy_uncorrelated_selection, annotate_selected_columns, model_from_statistics
+from pMPO.parallel import SharedDescriptorMatrix, resolve_n_jobs
+
+########################################################################################################################
+# Bootstrap and cross-validation of pMPO models
+# Every replicate is a vector of row weights over one shared descriptor matrix: bootstrap replicates weight each row by
+# the number of times it was drawn and cross-validation folds weight the training rows by 1. Integer weights give the
+# same statistics as building on the resampled copy of the DataFrame, without ever making that copy
+########################################################################################################################
+
+
+def weighted_group_moments(X: np.ndarray, weights: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    NaN-aware weighted sample counts, means and sums of squared deviations (M2) for every column of a matrix
+    With integer weights these are the moments of the matrix with every row repeated weight times
+    :param X: A 2D float array with one row per molecule and one column per descriptor
+    :param weights: The non-negative weight of each row (0 leaves the row out)
+    :return: Tuple of the per-column counts, means and M2 arrays
+    """
+    rows = weights > 0
+    values = X[rows]
+    w = weights[rows].astype(np.float64)[:, np.newaxis]
+    present = ~np.isnan(values)
+    counts = (w * present).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(present, w * values, 0.0).sum(axis=0) / counts
+    m2 = np.where(present, w * np.square(values - means), 0.0).sum(axis=0)
+    return counts, means, m2
+
+
+def weighted_pairwise_r2(X: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    The pairwise-complete r^2 matrix of the columns of a matrix with row weights (see pMPO.pairwise_r2)
+    :param X: A 2D float array with one row per molecule and one column per descriptor
+    :param weights: The non-negative weight of each row (0 leaves the row out)
+    :return: The square r^2 matrix
+    """
+    rows = weights > 0
+    values = X[rows]
+    w = weights[rows].astype(np.float64)[:, np.newaxis]
+    W = (~np.isnan(values)).astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        shift = np.nanmean(values, axis=0) if len(values) else np.zeros(values.shape[1])
+    shift[np.isnan(shift)] = 0.0
+    Y = np.where(W > 0, values - shift, 0.0)
+    counts = (w * W).T.dot(W)
+    sums = (w * Y).T.dot(W)
+    products = (w * Y).T.dot(Y)
+    squares = (w * np.square(Y)).T.dot(W)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variances = squares - np.square(sums) / counts
+        r2 = np.square(products - sums * sums.T / counts) / (variances * variances.T)
+    r2[counts < 2] = np.nan
+    return r2
+
+
+def roc_auc(scores: np.ndarray, labels: np.ndarray) -> float:
+    """
+    The area under the ROC curve from the Mann-Whitney U statistic (ties count one half)
+    :param scores: The scores of the molecules
+    :param labels: Boolean array, True for the good molecules
+    :return: The AUC (NaN without both good and bad molecules)
+    """
+    labels = np.asarray(labels, dtype=bool)
+    n_good = labels.sum()
+    n_bad = len(labels) - n_good
+    if n_good == 0 or n_bad == 0:
+        return np.nan
+    ranks = stats.rankdata(scores)
+    return float((ranks[labels].sum() - n_good * (n_good + 1) / 2.0) / (n_good * n_bad))
+
+
+def bootstrap_replicates(nrows: int, n_replicates: int=100, random_state=None) \
+        -> typing.Iterator[typing.Tuple[np.ndarray, np.ndarray]]:
+    """
+    Generate bootstrap replicates as row weights, held out on the out-of-bag rows
+    :param nrows: The number of rows
+    :param n_replicates: The number of replicates
+    :param random_state: Seed or np.random.RandomState
+    :return: Iterator of (row weights, held-out row indices) tuples
+    """
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    for _ in range(n_replicates):
+        weights = np.bincount(rng.randint(0, nrows, nrows), minlength=nrows).astype(np.int32)
+        yield weights, np.flatnonzero(weights == 0)
+
+
+def cross_validation_replicates(labels: np.ndarray, n_folds: int=5, n_repeats: int=1, random_state=None) \
+        -> typing.Iterator[typing.Tuple[np.ndarray, np.ndarray]]:
+    """
+    Generate stratified cross-validation folds as row weights, held out on the rows of the fold
+    :param labels: Boolean array, True for the good molecules (the folds keep their proportion)
+    :param n_folds: The number of folds
+    :param n_repeats: The number of times the folds are reshuffled
+    :param random_state: Seed or np.random.RandomState
+    :return: Iterator of (row weights, held-out row indices) tuples
+    """
+    if n_folds < 2:
+        raise AssertionError("Cross-validation needs at least 2 folds, got {}".format(n_folds))
+    labels = np.asarray(labels, dtype=bool)
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    for _ in range(n_repeats):
+        fold = np.empty(len(labels), dtype=np.intp)
+        for group in (np.flatnonzero(labels), np.flatnonzero(~labels)):
+            fold[rng.permutation(group)] = np.arange(len(group)) % n_folds
+        for k in range(n_folds):
+            yield (fold != k).astype(np.int32), np.flatnonzero(fold == k)
+
+
+def fit_replicate(X: np.ndarray, names: typing.Sequence[str], labels: np.ndarray, weights: np.ndarray,
+                  holdout: np.ndarray, model_name: str='pMPO', min_samples=10, p_cutoff=0.01, q_cutoff=0.05,
+                  r2_cutoff=0.53, sigmoidal_correction=True, case_insensitive=True) -> dict:
+    """
+    Build a pMPO model on weighted rows of a descriptor matrix and score it on the held-out rows
+    :param X: The (rows x descriptors) float matrix
+    :param names: The descriptor names of the columns of X
+    :param labels: Boolean array, True for the good molecules
+    :param weights: The training weight of each row
+    :param holdout: The indices of the held-out rows
+    :param model_name: Name of the pMPO model
+    :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+    :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
+    :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
+    :param r2_cutoff: The r^2 cutoff for determining linearly correlated descriptors
+    :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+    :param case_insensitive: Whether the models should be case insensitive to the descriptor keys
+    :return: Dictionary with the selected descriptors, their weights, the held-out AUC and the row counts
+    """
+    column_stats = statistics_from_moments(names,
+                                           weighted_group_moments(X, np.where(labels, weights, 0)),
+                                           weighted_group_moments(X, np.where(labels, 0, weights)),
+                                           min_samples=min_samples)
+    column_stats = finalize_descriptor_statistics(column_stats, p_cutoff=p_cutoff, q_cutoff=q_cutoff)
+    significant_names = column_stats[(column_stats.significant == True)].name.values.tolist()
+    position = {name: idx for idx, name in enumerate(names)}
+    r2 = weighted_pairwise_r2(X[:, [position[name] for name in significant_names]], weights)
+    annotate_selected_columns(column_stats, greedy_uncorrelated_selection(significant_names, r2, r2_cutoff))
+    selected = column_stats[(column_stats.selected == True)]
+    model = model_from_statistics(column_stats, model_name, sigmoidal_correction=sigmoidal_correction,
+                                  case_insensitive=case_insensitive).compile()
+    return {'selected': selected.name.tolist(),
+            'weights': OrderedDict(zip(selected.name, selected.w)),
+            'auc': roc_auc(model.score_array(X[holdout], names), labels[holdout]),
+            'n_train': int(weights.sum()),
+            'n_holdout': len(holdout)}
+
+
+def _replicate_worker(name: str, shape: typing.Tuple[int, int], names: typing.Sequence[str], labels: np.ndarray,
+                      replicate: int, weights: np.ndarray, holdout: np.ndarray, settings: dict):
+    """
+    Fit one replicate on a shared descriptor matrix
+    :return: Tuple of the replicate number and its results (see fit_replicate)
+    """
+    matrix = SharedDescriptorMatrix(shape, name=name)
+    try:
+        return replicate, fit_replicate(matrix.array, names, labels, weights, holdout, **settings)
+    finally:
+        matrix.close()
+
+
+class ResamplingResult:
+    """
+    The per-replicate and aggregate results of a bootstrap or cross-validation run
+    """
+    def __init__(self, names: typing.Sequence[str], records: typing.Sequence[dict]):
+        """
+        Collect the replicate results
+        :param names: All the descriptor names
+        :param records: The results of each replicate, in order (see fit_replicate)
+        """
+        self.replicates = pd.DataFrame(OrderedDict([('selected', [r['selected'] for r in records]),
+                                                    ('auc', [r['auc'] for r in records]),
+                                                    ('n_train', [r['n_train'] for r in records]),
+                                                    ('n_holdout', [r['n_holdout'] for r in records])]))
+        self.replicates.index.name = 'replicate'
+        # Replicate x descriptor weights, NaN when the descriptor was not selected
+        self.weights = pd.DataFrame([r['weights'] for r in records], columns=list(names), dtype=np.float64)
+        self.weights.index.name = 'replicate'
+
+    @property
+    def auc(self) -> pd.Series:
+        """
+        The held-out AUC of each replicate
+        """
+        return self.replicates.auc
+
+    @property
+    def selection_frequency(self) -> pd.Series:
+        """
+        The fraction of the replicates that selected each descriptor, most frequent first
+        """
+        frequency = self.weights.notnull().mean(axis=0) if len(self.weights) else self.weights.sum(axis=0)
+        return frequency.sort_values(ascending=False, kind='mergesort').rename('frequency')
+
+    @property
+    def summary(self) -> pd.DataFrame:
+        """
+        The selection frequency with the mean and standard deviation of the weights of every ever-selected descriptor
+        """
+        frequency = self.selection_frequency
+        frequency = frequency[frequency > 0]
+        return pd.DataFrame(OrderedDict([('frequency', frequency),
+                                         ('mean_weight', self.weights[frequency.index].mean(axis=0)),
+                                         ('std_weight', self.weights[frequency.index].std(axis=0))]))
+
+
+def resample_pMPO(df: pd.DataFrame, good_column: str, model_name: str='pMPO', good_value='default',
+                  method: str='bootstrap', n_replicates: int=100, n_folds: int=5, n_repeats: int=1, min_samples=10,
+                  p_cutoff=0.01, q_cutoff=0.05, r2_cutoff=0.53, sigmoidal_correction=True, case_insensitive=True,
+                  n_jobs: int=-1, random_state=None) -> ResamplingResult:
+    """
+    Rebuild a pMPO model on bootstrap resamples or cross-validation folds across a process pool
+    The descriptor matrix is written once into shared memory and each replicate only sends its row weights
+    :param df: Input DataFrame with good molecules, bad molecules, and data (not modified)
+    :param good_column: Input DataFrame column that distinguishes good from bad values
+    :param model_name: Name of the pMPO models
+    :param good_value: Criteria to evaluate good from bad molecules ('default', str, callable)
+    :param method: 'bootstrap' (held out on the out-of-bag rows) or 'cv' (stratified folds)
+    :param n_replicates: The number of bootstrap replicates
+    :param n_folds: The number of cross-validation folds
+    :param n_repeats: The number of times the cross-validation folds are reshuffled
+    :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+    :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
+    :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
+    :param r2_cutoff: The r^2 cutoff for determining linearly correlated descriptors
+    :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+    :param case_insensitive: Whether the models should be case insensitive to the descriptor keys
+    :param n_jobs: Number of worker processes (1 runs serially, -1 uses all CPUs)
+    :param random_state: Seed or np.random.RandomState for the resampling
+    :return: The per-replicate and aggregate results
+    """
+    labels = evaluate_good_values(df[good_column], good_value)
+    names = list(numeric_column_iterator(df))
+    if method == 'bootstrap':
+        replicates = bootstrap_replicates(len(df), n_replicates, random_state=random_state)
+    elif method == 'cv':
+        replicates = cross_validation_replicates(labels, n_folds, n_repeats, random_state=random_state)
+    else:
+        raise KeyError("Unknown resampling method: {}".format(method))
+    settings = {'model_name': model_name, 'min_samples': min_samples, 'p_cutoff': p_cutoff, 'q_cutoff': q_cutoff,
+                'r2_cutoff': r2_cutoff, 'sigmoidal_correction': sigmoidal_correction,
+                'case_insensitive': case_insensitive}
+    n_workers = resolve_n_jobs(n_jobs)
+    with SharedDescriptorMatrix.from_frame(df, names) as matrix:
+        if n_workers == 1:
+            records = [fit_replicate(matrix.array, names, labels, weights, holdout, **settings)
+                       for weights, holdout in replicates]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [pool.submit(_replicate_worker, matrix.name, matrix.shape, names, labels, replicate,
+                                       weights, holdout, settings)
+                           for replicate, (weights, holdout) in enumerate(replicates)]
+                results = sorted((future.result() for future in futures), key=lambda x: x[0])
+            records = [record for _, record in results]
+    return ResamplingResult(names, records)
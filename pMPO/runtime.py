@@ -0,0 +1,649 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import functools
+import struct
+import sys
+import typing
+import numpy as np
+from collections import OrderedDict
+
+########################################################################################################################
+# The scoring runtime
+# Compiled models and model banks only need NumPy: nothing here imports Pandas or SciPy, so short-lived scoring
+# processes can load and evaluate saved models without the cost of importing the model builder
+# Pandas is only imported by the score_frame methods, which are given a DataFrame anyway
+########################################################################################################################
+
+# The binary model format: magic, version, flags, number of descriptors, name size, descriptor keys size
+BINARY_MAGIC = b'pMPO'
+BINARY_FORMAT_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sHHIII')
+
+
+def is_matrix_input(X) -> bool:
+    """
+    Whether score_array input is a descriptor matrix read in row blocks (see pMPO.matrix.is_matrix_data)
+    """
+    if type(X) is np.ndarray or isinstance(X, (list, tuple)):
+        return False
+    from pMPO.matrix import is_matrix_data
+    return is_matrix_data(X)
+
+
+class CompiledpMPOModel:
+    """
+    An immutable, struct-of-arrays form of a pMPOModel (see pMPOModel.compile)
+    The parameters of every component are kept in contiguous float64 vectors ordered by descriptor:
+    weights, means, 1/(2*std^2), b, ln(c) and cutoffs
+    The score of an (n x k) block of descriptor values Z is then a single fused expression:
+
+                      2                    -1
+    sum_k w * exp(-a(Z - mean)) * (1 + b exp(-ln(c)(Z - cutoff)))
+
+    Instances cannot be modified, so one instance can be shared safely across threads and processes
+    """
+    PARAMETERS = ('weights', 'means', 'inv_two_var', 'b', 'ln_c', 'cutoffs')
+
+    __slots__ = ('name', 'descriptors', 'case_insensitive', 'sigmoidal_correction', 'parameters', '_index') + \
+        PARAMETERS
+
+    def __init__(self, name: str, descriptors: typing.Sequence[str], parameters, case_insensitive: bool=True,
+                 sigmoidal_correction: bool=True):
+        """
+        Create a compiled pMPO model
+        :param name: The name of the model
+        :param descriptors: The descriptor keys, in the column order of parameters
+        :param parameters: A (6 x k) float64 array (or its raw bytes) with one row per entry in PARAMETERS
+        :param case_insensitive: Whether the descriptor lookups will be case insensitive
+        :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+        """
+        descriptors = tuple(descriptors)
+        if isinstance(parameters, bytes):
+            parameters = np.frombuffer(parameters, dtype=np.float64)
+        parameters = np.array(parameters, dtype=np.float64).reshape(len(self.PARAMETERS), len(descriptors))
+        parameters.flags.writeable = False
+        _set = super().__setattr__
+        _set('name', name)
+        _set('descriptors', descriptors)
+        _set('case_insensitive', bool(case_insensitive))
+        _set('sigmoidal_correction', bool(sigmoidal_correction))
+        _set('parameters', parameters)
+        for row, attribute in enumerate(self.PARAMETERS):
+            _set(attribute, parameters[row])
+        _set('_index', {desc: idx for idx, desc in enumerate(descriptors)})
+
+    def __setattr__(self, key, value):
+        raise AttributeError("CompiledpMPOModel is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("CompiledpMPOModel is immutable")
+
+    def __reduce__(self):
+        return (CompiledpMPOModel, (self.name, self.descriptors, self.parameters.tobytes(), self.case_insensitive,
+                                    self.sigmoidal_correction))
+
+    def _lookup_key(self, key: str) -> str:
+        """
+        Resolve a descriptor name to the key used in this model
+        :param key: The descriptor name
+        :return: The descriptor key
+        """
+        return key.upper() if self.case_insensitive else key
+
+    def column_positions(self, columns: typing.Sequence[str]) -> np.ndarray:
+        """
+        Find the input column feeding each model descriptor
+        Columns differing only by case are ambiguous for a case insensitive model (the scalar pMPOModel would add up
+        both of their contributions), so more than one column resolving to the same descriptor is rejected
+        :param columns: The names of the input columns
+        :return: An integer array with the column position for each descriptor (-1 when missing)
+        """
+        positions = np.full(len(self.descriptors), -1, dtype=np.intp)
+        for position, column in enumerate(columns):
+            if not isinstance(column, str):
+                continue
+            idx = self._index.get(self._lookup_key(column))
+            if idx is not None:
+                if positions[idx] >= 0:
+                    raise AssertionError("Input columns {!r} and {!r} both resolve to the descriptor {} of {}".format(
+                        columns[positions[idx]], column, self.descriptors[idx], self.name))
+                positions[idx] = position
+        return positions
+
+    def score_block(self, Z) -> np.ndarray:
+        """
+        Score an (n x k) block of descriptor values already in the order of self.descriptors
+        Missing (NaN) values contribute 0.0 to the score
+        :param Z: The (n x k) block of descriptor values
+        :return: A float array of the pMPO scores
+        """
+        Z = np.asarray(Z, dtype=np.float64)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            if self.sigmoidal_correction:
+                terms = self.weights * np.exp(-np.square(Z - self.means) * self.inv_two_var) / \
+                    (1.0 + self.b * np.exp(-self.ln_c * (Z - self.cutoffs)))
+            else:
+                terms = self.weights * np.exp(-np.square(Z - self.means) * self.inv_two_var)
+        terms[np.isnan(Z)] = 0.0
+        return terms.sum(axis=1)
+
+    def score_array(self, X, columns: typing.Sequence[str]=None) -> np.ndarray:
+        """
+        Apply the compiled model to a 2D array of descriptor values
+        :param X: A 2D array-like with one row per molecule and one column per descriptor, or a descriptor matrix
+                  (memory map, raw buffer, Arrow table or record batch, see pMPO.matrix) scored in row blocks
+        :param columns: The descriptor names of the columns of X (Arrow data and DescriptorMatrix have their own)
+        :return: A float array with the pMPO score of each row
+        """
+        if is_matrix_input(X):
+            from pMPO.matrix import score_matrix
+            return score_matrix(self, X, columns)
+        if columns is None:
+            raise AssertionError("Input to pMPO score_array needs the names of its columns")
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise AssertionError("Input to pMPO score_array must be 2D, got shape {}".format(X.shape))
+        if X.shape[1] != len(columns):
+            raise AssertionError("Input to pMPO score_array has {} columns but {} column names".format(
+                X.shape[1], len(columns)))
+        positions = self.column_positions(columns)
+        Z = np.full((X.shape[0], len(self.descriptors)), np.nan, dtype=np.float64)
+        for idx, position in enumerate(positions):
+            if position >= 0:
+                Z[:, idx] = X[:, position]
+        return self.score_block(Z)
+
+    def score_frame(self, df: 'pandas.DataFrame') -> 'pandas.Series':
+        """
+        Apply the compiled model to every row of a DataFrame
+        :param df: A Pandas DataFrame with one row per molecule and descriptors as columns
+        :return: A Pandas Series of pMPO scores aligned to the DataFrame index
+        """
+        import pandas as pd
+        positions = self.column_positions(df.columns)
+        Z = np.full((len(df), len(self.descriptors)), np.nan, dtype=np.float64)
+        for idx, position in enumerate(positions):
+            if position >= 0:
+                Z[:, idx] = df.iloc[:, position].values
+        return pd.Series(self.score_block(Z), index=df.index, name=self.name)
+
+    def __call__(self, **kwargs) -> float:
+        """
+        Apply the compiled model to a single molecule
+        :param kwargs: The descriptor values to score against the model
+        :return: The pMPO score
+        """
+        values = list(kwargs.values())
+        Z = np.full((1, len(self.descriptors)), np.nan, dtype=np.float64)
+        for idx, position in enumerate(self.column_positions(list(kwargs.keys()))):
+            if position >= 0:
+                Z[0, idx] = values[position]
+        return float(self.score_block(Z)[0])
+
+    def tabulate(self, steps: typing.Dict[str, float]=None, max_error: float=1e-4) -> 'TabulatedpMPOModel':
+        """
+        Precompute lookup tables of the descriptor contributions (see pMPO.lookup.tabulate)
+        :param steps: The grid step of the descriptors that get exact tables, e.g. {'HBD': 1, 'TPSA': 0.01}
+        :param max_error: The maximum absolute error of a score, shared evenly by the interpolated descriptors
+        :return: The TabulatedpMPOModel
+        """
+        from pMPO.lookup import tabulate
+        return tabulate(self, steps=steps, max_error=max_error)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the compiled model into a flat binary buffer:
+        a fixed header (magic, version, flags, sizes), the UTF-8 name and descriptor keys, then the little-endian
+        (6 x k) float64 parameters aligned to 8 bytes
+        :return: The binary buffer
+        """
+        name = self.name.encode('utf-8')
+        descriptors = '\x00'.join(self.descriptors).encode('utf-8')
+        flags = int(self.case_insensitive) | int(self.sigmoidal_correction) << 1
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_FORMAT_VERSION, flags, len(self.descriptors), len(name),
+                                    len(descriptors))
+        buffer = header + name + descriptors
+        return buffer + b'\x00' * (-len(buffer) % 8) + self.parameters.astype('<f8').tobytes()
+
+    @classmethod
+    def from_bytes(cls, buffer) -> 'CompiledpMPOModel':
+        """
+        Create a compiled model from its binary serialization (see to_bytes)
+        :param buffer: The binary buffer (bytes, bytearray, memoryview or mmap)
+        :return: The compiled pMPO model
+        """
+        if len(buffer) < BINARY_HEADER.size:
+            raise AssertionError("Not a binary pMPO model")
+        magic, version, flags, k, name_size, descriptors_size = BINARY_HEADER.unpack_from(buffer, 0)
+        if magic != BINARY_MAGIC:
+            raise AssertionError("Not a binary pMPO model")
+        if version != BINARY_FORMAT_VERSION:
+            raise AssertionError("Unsupported binary pMPO model version: {}".format(version))
+        offset = BINARY_HEADER.size
+        name = bytes(buffer[offset:offset + name_size]).decode('utf-8')
+        offset += name_size
+        descriptors = bytes(buffer[offset:offset + descriptors_size]).decode('utf-8').split('\x00') if k else []
+        offset += descriptors_size
+        offset += -offset % 8
+        parameters = np.frombuffer(buffer, dtype='<f8', count=len(cls.PARAMETERS) * k, offset=offset)
+        return cls(name, descriptors, parameters, case_insensitive=bool(flags & 1),
+                   sigmoidal_correction=bool(flags & 2))
+
+    def save(self, path: str):
+        """
+        Write the binary serialization of the compiled model to a file
+        :param path: Path to the model file
+        """
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledpMPOModel':
+        """
+        Read a compiled model from a binary model file (see save)
+        :param path: Path to the model file
+        :return: The compiled pMPO model
+        """
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def __str__(self) -> str:
+        return "{} (compiled, {} descriptors)".format(self.name, len(self.descriptors))
+
+    def __repr__(self):
+        return str(self)
+
+
+# Number of molecules scored at once by a ModelBank
+BANK_BLOCK_ROWS = 4096
+
+
+class ModelBank:
+    """
+    Score many pMPO models in a single pass over the descriptor matrix
+    The parameters of all models are stacked into (models x descriptors) arrays over the union of their descriptors,
+    every descriptor column is read once and evaluated for all the models that use it
+    Models that do not use a descriptor keep a weight of 0.0, so a missing descriptor contributes nothing
+    """
+    def __init__(self, models: typing.Iterable):
+        """
+        Create a bank of pMPO models
+        :param models: pMPOModel or CompiledpMPOModel instances with distinct names
+        """
+        models = tuple(model if isinstance(model, CompiledpMPOModel) else model.compile() for model in models)
+        names = [model.name for model in models]
+        if len(set(names)) != len(names):
+            raise AssertionError("Models in a ModelBank must have distinct names: {}".format(names))
+        # Descriptors are keyed by (key, case_insensitive) so each model keeps its own lookup rule
+        union = OrderedDict()
+        for model in models:
+            for desc in model.descriptors:
+                union.setdefault((desc, model.case_insensitive), len(union))
+        params = np.zeros((len(CompiledpMPOModel.PARAMETERS), len(models), len(union)), dtype=np.float64)
+        present = np.zeros((len(models), len(union)), dtype=bool)
+        for row, model in enumerate(models):
+            idx = [union[(desc, model.case_insensitive)] for desc in model.descriptors]
+            params[:, row, idx] = model.parameters
+            present[row, idx] = True
+            # Without the sigmoidal correction b = 0 makes the correction term exactly 1.0
+            if not model.sigmoidal_correction:
+                params[3:, row, :] = 0.0
+        params.flags.writeable = False
+        self.models = models
+        self.names = names
+        self.descriptors = list(union.keys())
+        self.parameters = params
+        self.weights, self.means, self.inv_two_var, self.b, self.ln_c, self.cutoffs = params
+        # Per descriptor: the models using it and their parameters as column vectors
+        self._terms = []
+        for idx in range(len(union)):
+            users = np.flatnonzero(present[:, idx])
+            self._terms.append((users,) + tuple(param[users, idx][:, np.newaxis] for param in params))
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __getitem__(self, name: str) -> CompiledpMPOModel:
+        return self.models[self.names.index(name)]
+
+    def column_positions(self, columns: typing.Sequence[str]) -> np.ndarray:
+        """
+        Find the input column feeding each descriptor of the bank
+        More than one column resolving to the same descriptor is rejected, as in CompiledpMPOModel.column_positions
+        :param columns: The names of the input columns
+        :return: An integer array with the column position for each descriptor (-1 when missing)
+        """
+        exact, upper = {}, {}
+        for position, column in enumerate(columns):
+            if isinstance(column, str):
+                exact.setdefault(column, []).append(position)
+                upper.setdefault(column.upper(), []).append(position)
+        positions = np.full(len(self.descriptors), -1, dtype=np.intp)
+        for idx, (desc, case_insensitive) in enumerate(self.descriptors):
+            matches = (upper if case_insensitive else exact).get(desc, [])
+            if len(matches) > 1:
+                raise AssertionError("Input columns {} all resolve to the descriptor {} of the bank".format(
+                    [columns[position] for position in matches], desc))
+            if matches:
+                positions[idx] = matches[0]
+        return positions
+
+    def score_block(self, Z) -> np.ndarray:
+        """
+        Score an (n x d) block of descriptor values already in the order of self.descriptors against every model
+        Missing (NaN) values contribute 0.0 to the scores
+        :param Z: The (n x d) block of descriptor values
+        :return: An (n x models) float array of the pMPO scores
+        """
+        return self._score_descriptor_rows(np.ascontiguousarray(np.asarray(Z, dtype=np.float64).T))
+
+    def _score_descriptor_rows(self, ZT: np.ndarray, block_rows: int=BANK_BLOCK_ROWS) -> np.ndarray:
+        """
+        Score a (d x n) array with one row of values per descriptor of the bank
+        Molecules are processed in blocks so the (models x block) terms of a descriptor stay in cache
+        :param ZT: The (d x n) array of descriptor values
+        :param block_rows: The number of molecules per block
+        :return: An (n x models) float array of the pMPO scores
+        """
+        n = ZT.shape[1]
+        scores = np.zeros((len(self.models), n), dtype=np.float64)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            for start in range(0, n, block_rows):
+                block = scores[:, start:start + block_rows]
+                for idx, (users, weights, means, inv_two_var, b, ln_c, cutoffs) in enumerate(self._terms):
+                    z = ZT[idx, start:start + block_rows]
+                    missing = np.isnan(z)
+                    if missing.all():
+                        continue
+                    terms = weights * np.exp(-np.square(z - means) * inv_two_var) / \
+                        (1.0 + b * np.exp(-ln_c * (z - cutoffs)))
+                    terms[:, missing] = 0.0
+                    block[users] += terms
+        return scores.T
+
+    def score_array(self, X, columns: typing.Sequence[str]=None) -> np.ndarray:
+        """
+        Apply every model of the bank to a 2D array of descriptor values
+        :param X: A 2D array-like with one row per molecule and one column per descriptor, or a descriptor matrix
+                  (memory map, raw buffer, Arrow table or record batch, see pMPO.matrix) scored in row blocks
+        :param columns: The descriptor names of the columns of X (Arrow data and DescriptorMatrix have their own)
+        :return: An (n x models) float array with the pMPO scores, columns in the order of self.names
+        """
+        if is_matrix_input(X):
+            from pMPO.matrix import score_matrix
+            return score_matrix(self, X, columns)
+        if columns is None:
+            raise AssertionError("Input to ModelBank score_array needs the names of its columns")
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise AssertionError("Input to ModelBank score_array must be 2D, got shape {}".format(X.shape))
+        if X.shape[1] != len(columns):
+            raise AssertionError("Input to ModelBank score_array has {} columns but {} column names".format(
+                X.shape[1], len(columns)))
+        positions = self.column_positions(columns)
+        ZT = np.full((len(self.descriptors), X.shape[0]), np.nan, dtype=np.float64)
+        for idx, position in enumerate(positions):
+            if position >= 0:
+                ZT[idx] = X[:, position]
+        return self._score_descriptor_rows(ZT)
+
+    def score_frame(self, df: 'pandas.DataFrame') -> 'pandas.DataFrame':
+        """
+        Apply every model of the bank to every row of a DataFrame
+        :param df: A Pandas DataFrame with one row per molecule and descriptors as columns
+        :return: A Pandas DataFrame of pMPO scores with one column per model, aligned to the DataFrame index
+        """
+        import pandas as pd
+        positions = self.column_positions(df.columns)
+        ZT = np.full((len(self.descriptors), len(df)), np.nan, dtype=np.float64)
+        for idx, position in enumerate(positions):
+            if position >= 0:
+                ZT[idx] = df.iloc[:, position].values
+        return pd.DataFrame(self._score_descriptor_rows(ZT), index=df.index, columns=self.names)
+
+    def __call__(self, **kwargs) -> typing.Dict[str, float]:
+        """
+        Apply every model of the bank to a single molecule
+        :param kwargs: The descriptor values to score against the models
+        :return: A dictionary of the pMPO score of each model
+        """
+        columns = list(kwargs.keys())
+        scores = self.score_array(np.array([[kwargs[col] for col in columns]], dtype=np.float64), columns)
+        return OrderedDict(zip(self.names, scores[0].tolist()))
+
+    def __str__(self) -> str:
+        return "ModelBank ({} models, {} descriptors)".format(len(self.models), len(self.descriptors))
+
+    def __repr__(self):
+        return str(self)
+
+
+# Default number of descriptor vectors remembered by a ScoreCache
+SCORE_CACHE_ENTRIES = 65536
+
+
+def deduplicate_rows(Z: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the distinct rows of a float block by hashing the bits of each row (-0.0 matches 0.0 and all NaNs match)
+    Rows are grouped by a 64 bit hash and the grouping is checked against the values; should two different rows ever
+    share a hash the rows are compared exactly instead
+    :param Z: The (n x k) float64 block
+    :return: The index of the first occurrence of each distinct row, and the distinct row of each input row
+    """
+    # Adding 0.0 turns -0.0 into 0.0 (and copies), NaN payloads are reset so equal rows have equal bits
+    Z = np.asarray(Z, dtype=np.float64) + 0.0
+    Z[np.isnan(Z)] = np.nan
+    n = Z.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    bits = Z.view(np.uint64).reshape(n, -1)
+    # FNV-1a style mixing of the 64 bit words of each row
+    hashes = np.full(n, 0xcbf29ce484222325, dtype=np.uint64)
+    for column in bits.T:
+        hashes ^= column
+        hashes *= np.uint64(0x100000001b3)
+        hashes ^= hashes >> np.uint64(29)
+    # Pandas hashes in linear time, but is only used when something else already imported it
+    pd = sys.modules.get('pandas')
+    if pd is not None:
+        inverse, distinct = pd.factorize(hashes)
+        inverse = inverse.astype(np.intp, copy=False)
+        first = np.empty(len(distinct), dtype=np.intp)
+        first[inverse[::-1]] = np.arange(n - 1, -1, -1, dtype=np.intp)
+    else:
+        _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    if not np.array_equal(bits[first][inverse.ravel()], bits):
+        rows = bits.view(np.dtype((np.void, bits.dtype.itemsize * bits.shape[1]))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+class ScoreCache:
+    """
+    Remembers the scores of a model for repeated descriptor vectors (tautomers, salts, re-submitted candidates)
+    Single molecules go through a bounded LRU cache keyed on the values of the model descriptors. Batches are
+    deduplicated instead: only the distinct rows are scored and their scores are scattered back to every row
+    With decimals set the descriptor values are rounded before they are looked up and scored, so values that only differ
+    beyond that precision share one entry (and the score of the rounded values)
+    """
+
+    def __init__(self, model, max_entries: int=SCORE_CACHE_ENTRIES, decimals: int=None):
+        """
+        Create a score cache for a model
+        :param model: A pMPOModel or CompiledpMPOModel (the model must not change while it is cached)
+        :param max_entries: The maximum number of descriptor vectors remembered for single molecules
+        :param decimals: Optionally round the descriptor values to this many decimals
+        """
+        if max_entries < 1:
+            raise AssertionError("A ScoreCache needs max_entries of at least 1, got {}".format(max_entries))
+        self.model = model
+        self.name = model.name
+        self.max_entries = max_entries
+        self.decimals = decimals
+        self.case_insensitive = model.case_insensitive
+        self.descriptors = tuple(model.descriptors)
+        self._index = {desc: idx for idx, desc in enumerate(self.descriptors)}
+        self._lookup = functools.lru_cache(maxsize=max_entries)(self._score_values)
+        # Rows seen by the batch path and how many of them were distinct
+        self.rows = 0
+        self.unique_rows = 0
+
+    def __reduce__(self):
+        return (ScoreCache, (self.model, self.max_entries, self.decimals))
+
+    def _score_values(self, values: typing.Tuple) -> float:
+        """
+        Score the model descriptor values of one molecule (None when missing)
+        """
+        return float(self.model(**{desc: val for desc, val in zip(self.descriptors, values) if val is not None}))
+
+    def __call__(self, **kwargs) -> float:
+        """
+        Apply the model to a single molecule, using the remembered score of the same descriptor values if there is one
+        :param kwargs: The descriptor values to score against the model
+        :return: The pMPO score
+        """
+        values = [None] * len(self.descriptors)
+        filled = {}
+        for key, val in kwargs.items():
+            idx = self._index.get(key.upper() if self.case_insensitive else key)
+            if idx is not None:
+                if idx in filled:
+                    raise AssertionError("Input columns {!r} and {!r} both resolve to the descriptor {} of {}".format(
+                        filled[idx], key, self.descriptors[idx], self.name))
+                filled[idx] = key
+            # NaN is the only value not equal to itself, missing values are all keyed as None
+            if idx is not None and val is not None and val == val:
+                values[idx] = round(val, self.decimals) if self.decimals is not None else val
+        return self._lookup(tuple(values))
+
+    def _block(self, column_values: typing.Callable, columns: typing.Sequence[str], nrows: int) -> np.ndarray:
+        """
+        Gather the model descriptor columns into an (n x k) block
+        :param column_values: Function returning the values of an input column by position
+        :param columns: The names of the input columns
+        :param nrows: The number of rows
+        :return: The (n x k) block of (rounded) descriptor values
+        """
+        Z = np.full((nrows, len(self.descriptors)), np.nan, dtype=np.float64)
+        filled = {}
+        for position, column in enumerate(columns):
+            if not isinstance(column, str):
+                continue
+            idx = self._index.get(column.upper() if self.case_insensitive else column)
+            if idx is not None:
+                if idx in filled:
+                    raise AssertionError("Input columns {!r} and {!r} both resolve to the descriptor {} of {}".format(
+                        filled[idx], column, self.descriptors[idx], self.name))
+                Z[:, idx] = column_values(position)
+                filled[idx] = column
+        if self.decimals is not None:
+            np.round(Z, self.decimals, out=Z)
+        return Z
+
+    def score_block(self, Z: np.ndarray) -> np.ndarray:
+        """
+        Score an (n x k) block in the order of self.descriptors, scoring each distinct row only once
+        :param Z: The (n x k) block of descriptor values
+        :return: A float array of the pMPO scores
+        """
+        first, inverse = deduplicate_rows(Z)
+        self.rows += len(Z)
+        self.unique_rows += len(first)
+        distinct = Z[first]
+        if isinstance(self.model, CompiledpMPOModel):
+            scores = self.model.score_block(distinct)
+        else:
+            scores = self.model.score_array(distinct, self.descriptors)
+        return np.asarray(scores, dtype=np.float64)[inverse]
+
+    def score_array(self, X, columns: typing.Sequence[str]) -> np.ndarray:
+        """
+        Apply the model to a 2D array of descriptor values, scoring each distinct descriptor vector only once
+        :param X: A 2D array-like with one row per molecule and one column per descriptor
+        :param columns: The descriptor names of the columns of X
+        :return: A float array with the pMPO score of each row
+        """
+        X = np.asarray(X)
+        if X.ndim != 2:
+            raise AssertionError("Input to pMPO score_array must be 2D, got shape {}".format(X.shape))
+        if X.shape[1] != len(columns):
+            raise AssertionError("Input to pMPO score_array has {} columns but {} column names".format(
+                X.shape[1], len(columns)))
+        return self.score_block(self._block(lambda position: X[:, position], columns, X.shape[0]))
+
+    def score_frame(self, df: 'pandas.DataFrame') -> 'pandas.Series':
+        """
+        Apply the model to every row of a DataFrame, scoring each distinct descriptor vector only once
+        :param df: A Pandas DataFrame with one row per molecule and descriptors as columns
+        :return: A Pandas Series of pMPO scores aligned to the DataFrame index
+        """
+        import pandas as pd
+        Z = self._block(lambda position: df.iloc[:, position].values, df.columns, len(df))
+        return pd.Series(self.score_block(Z), index=df.index, name=self.name)
+
+    @property
+    def hits(self) -> int:
+        """
+        :return: The number of single molecules answered from the cache
+        """
+        return self._lookup.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        """
+        :return: The number of single molecules that had to be scored
+        """
+        return self._lookup.cache_info().misses
+
+    def stats(self) -> OrderedDict:
+        """
+        The cache counters
+        :return: An OrderedDict with the single molecule hits, misses, hit_rate, entries and max_entries, and the rows,
+                 unique_rows and duplicate_rate of the batch path
+        """
+        info = self._lookup.cache_info()
+        lookups = info.hits + info.misses
+        return OrderedDict([('hits', info.hits),
+                            ('misses', info.misses),
+                            ('hit_rate', info.hits / lookups if lookups else 0.0),
+                            ('entries', info.currsize),
+                            ('max_entries', self.max_entries),
+                            ('rows', self.rows),
+                            ('unique_rows', self.unique_rows),
+                            ('duplicate_rate', 1.0 - self.unique_rows / self.rows if self.rows else 0.0)])
+
+    def clear(self):
+        """
+        Forget every remembered score and reset the counters
+        """
+        self._lookup.cache_clear()
+        self.rows = 0
+        self.unique_rows = 0
+
+    def __str__(self) -> str:
+        return "ScoreCache ({}, {} of {} entries)".format(self.name, self._lookup.cache_info().currsize,
+                                                          self.max_entries)
+
+    def __repr__(self):
+        return str(self)
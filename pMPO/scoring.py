@@ -0,0 +1,228 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import sys
+import time
+import typing
+import numpy as np
+import pandas as pd
+from pMPO.runtime import CompiledpMPOModel
+
+########################################################################################################################
+# File-level scoring
+# Descriptor files are read in bounded-size chunks and only the columns the model needs are parsed. Each chunk is scored
+# with the compiled model and its scores are written out before the next chunk is read
+########################################################################################################################
+
+# Default number of rows per chunk
+DEFAULT_CHUNKSIZE = 100000
+
+
+def load_model(path: str) -> CompiledpMPOModel:
+    """
+    Load a model file (binary, JSON or pickled, see pMPO.serialization) and compile it for scoring
+    :param path: Path to the model file
+    :return: The compiled pMPO model
+    """
+    from pMPO.serialization import load_model as load_model_file
+    return compile_model(load_model_file(path))
+
+
+def compile_model(model) -> CompiledpMPOModel:
+    """
+    Turn any pMPO model into a compiled pMPO model
+    :param model: A pMPOModel or CompiledpMPOModel
+    :return: The compiled pMPO model
+    """
+    if isinstance(model, CompiledpMPOModel):
+        return model
+    if hasattr(model, 'compile'):
+        return model.compile()
+    raise AssertionError("Not a pMPO model: {}".format(type(model)))
+
+
+def table_format(path: str, fmt: str=None) -> str:
+    """
+    Determine the table format of a file
+    :param path: Path to the file
+    :param fmt: Explicit format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+    :return: The table format
+    """
+    if fmt is not None:
+        fmt = fmt.lower()
+    else:
+        name = path.lower()
+        if name.endswith('.gz') or name.endswith('.bz2') or name.endswith('.xz'):
+            name = os.path.splitext(name)[0]
+        fmt = {'.parquet': 'parquet', '.pq': 'parquet', '.tsv': 'tsv', '.txt': 'tsv'}.get(
+            os.path.splitext(name)[1], 'csv')
+    if fmt not in ('csv', 'tsv', 'parquet'):
+        raise KeyError("Unknown table format: {}".format(fmt))
+    return fmt
+
+
+def table_columns(path: str, fmt: str=None) -> typing.List[str]:
+    """
+    Read the column names of a table file without reading its data
+    :param path: Path to the file
+    :param fmt: Explicit format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+    :return: The column names
+    """
+    fmt = table_format(path, fmt)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return list(pq.ParquetFile(path).schema_arrow.names)
+    return list(pd.read_csv(path, sep='\t' if fmt == 'tsv' else ',', nrows=0).columns)
+
+
+def iter_table_chunks(path: str, columns: typing.Sequence[str], float_columns: typing.Sequence[str]=(),
+                      chunksize: int=DEFAULT_CHUNKSIZE, fmt: str=None) -> typing.Iterator[pd.DataFrame]:
+    """
+    Iterate over bounded-size chunks of selected columns of a table file
+    :param path: Path to the file
+    :param columns: The columns to read
+    :param float_columns: The columns to parse directly as float64
+    :param chunksize: The number of rows per chunk
+    :param fmt: Explicit format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+    :return: Iterator of Pandas DataFrames
+    """
+    fmt = table_format(path, fmt)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=list(columns)):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, sep='\t' if fmt == 'tsv' else ',', usecols=list(columns),
+                                 dtype={col: np.float64 for col in float_columns}, chunksize=chunksize):
+            yield chunk
+
+
+class TableWriter:
+    """
+    Write DataFrame chunks to a CSV, TSV or Parquet file one after the other
+    """
+    def __init__(self, path: str, fmt: str=None, columns: typing.Sequence[str]=None):
+        """
+        Open a table for writing
+        :param path: Path to the output file ('-' writes CSV to standard output)
+        :param fmt: Explicit format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+        :param columns: The output columns, written as an empty table on close when no chunk was written
+        """
+        self.path = path
+        self.fmt = 'csv' if path == '-' and fmt is None else table_format(path, fmt)
+        self.columns = None if columns is None else list(columns)
+        self.writer = None
+        self.started = False
+        self.rows = 0
+
+    def write(self, chunk: pd.DataFrame):
+        """
+        Append a chunk to the table
+        :param chunk: A Pandas DataFrame
+        """
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        else:
+            target = sys.stdout if self.path == '-' else self.path
+            chunk.to_csv(target, sep='\t' if self.fmt == 'tsv' else ',', index=False, header=not self.started,
+                         mode='a' if self.started else 'w')
+        self.started = True
+        self.rows += len(chunk)
+
+    def close(self):
+        """
+        Finish the table (when no chunk was written and the columns are known, an empty table still gets its header)
+        """
+        if not self.started and self.columns is not None:
+            self.write(pd.DataFrame(columns=self.columns))
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def peak_memory() -> int:
+    """
+    The peak resident memory of this process
+    :return: The peak resident set size in bytes (0 when the platform does not report it)
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def score_file(model, input_path: str, output_path: str, chunksize: int=DEFAULT_CHUNKSIZE,
+               id_columns: typing.Sequence[str]=(), score_column: str=None, input_format: str=None,
+               output_format: str=None) -> typing.Dict[str, float]:
+    """
+    Score a CSV/TSV/Parquet descriptor file in chunks and write the scores incrementally
+    Only the descriptor columns used by the model (and the id columns) are read from the input
+    :param model: A pMPOModel or CompiledpMPOModel
+    :param input_path: Path to the descriptor file
+    :param output_path: Path to the output file ('-' for standard output)
+    :param chunksize: The number of rows per chunk
+    :param id_columns: Input columns copied to the output next to the score
+    :param score_column: Name of the score column [default: the model name]
+    :param input_format: Explicit input format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+    :param output_format: Explicit output format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+    :return: A report with the rows scored, seconds, rows per second and peak memory in bytes
+    """
+    compiled = compile_model(model)
+    header = table_columns(input_path, input_format)
+    missing = [col for col in id_columns if col not in header]
+    if missing:
+        raise AssertionError("Id columns {} do not exist in {}".format(missing, input_path))
+    positions = compiled.column_positions(header)
+    descriptor_columns = [header[position] for position in positions if position >= 0]
+    read_columns = list(id_columns) + [col for col in descriptor_columns if col not in id_columns]
+    score_column = score_column or compiled.name
+    started = time.perf_counter()
+    with TableWriter(output_path, output_format, columns=list(id_columns) + [score_column]) as writer:
+        for chunk in iter_table_chunks(input_path, read_columns, float_columns=descriptor_columns,
+                                       chunksize=chunksize, fmt=input_format):
+            scores = compiled.score_frame(chunk[descriptor_columns]).values
+            output = chunk[list(id_columns)].copy() if id_columns else pd.DataFrame(index=chunk.index)
+            output[score_column] = scores
+            writer.write(output)
+        rows = writer.rows
+    seconds = time.perf_counter() - started
+    return {'rows': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds > 0 else float('inf'),
+            'peak_memory': peak_memory(),
+            'descriptors_found': len(descriptor_columns),
+            'descriptors_missing': len(compiled.descriptors) - len(descriptor_columns)}
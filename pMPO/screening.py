@@ -0,0 +1,282 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import time
+import typing
+import numpy as np
+from collections import OrderedDict
+from pMPO.runtime import CompiledpMPOModel
+
+########################################################################################################################
+# Top-k and threshold screening with upper-bound pruning
+# A pMPO score is a sum of per-descriptor terms and every term is at most its weight (the Gaussian is at most 1.0 and
+# so is the sigmoidal correction), so the partial score of a molecule plus the weights of the terms it has not been
+# scored on yet bounds its final score from above. Terms are evaluated highest weight first and a molecule is dropped
+# as soon as its bound falls below the score it has to beat: the threshold, or the k-th best score found so far
+########################################################################################################################
+
+# Molecules scored between updates of the k-th best score
+SCREEN_BLOCK_ROWS = 65536
+# Absolute slack on the bound so rounding in the partial sums never drops a molecule that makes the cut
+BOUND_SLACK = 1e-9
+
+
+class ScreeningResult:
+    """
+    The molecules that made the cut, best first, with the pruning statistics of the screen
+    """
+    def __init__(self, rows: np.ndarray, ids: np.ndarray, scores: np.ndarray, stats: OrderedDict):
+        """
+        Collect the screening results
+        :param rows: The position of each molecule in the screened input (counting across chunks)
+        :param ids: The id of each molecule (the DataFrame index or id column, the row position for arrays)
+        :param scores: The pMPO score of each molecule
+        :param stats: The pruning statistics (see Screener.stats)
+        """
+        order = np.lexsort((rows, -scores))
+        self.rows = rows[order]
+        self.ids = ids[order]
+        self.scores = scores[order]
+        self.stats = stats
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_frame(self, id_name: str='id', score_name: str='score') -> 'pandas.DataFrame':
+        """
+        The results as a DataFrame
+        :param id_name: The name of the id column
+        :param score_name: The name of the score column
+        :return: A Pandas DataFrame with the row, id and score of each molecule, best first
+        """
+        import pandas as pd
+        return pd.DataFrame(OrderedDict([('row', self.rows), (id_name, self.ids), (score_name, self.scores)]))
+
+
+class Screener:
+    """
+    Screens molecules chunk by chunk, keeping the k best (or all of those at or above a threshold)
+    Only the molecules that can still make the cut are scored on each descriptor, highest weight first
+    """
+    def __init__(self, model, k: int=None, threshold: float=None):
+        """
+        Create a screener
+        :param model: A pMPOModel or CompiledpMPOModel
+        :param k: Keep the k best molecules
+        :param threshold: Keep the molecules scoring at least this much
+        """
+        if k is None and threshold is None:
+            raise AssertionError("Screening needs k, a threshold or both")
+        if k is not None and k < 1:
+            raise AssertionError("Screening k must be at least 1, got {}".format(k))
+        self.model = model if isinstance(model, CompiledpMPOModel) else model.compile()
+        self.k = k
+        self.threshold = threshold
+        params = self.model.parameters.copy()
+        if not self.model.sigmoidal_correction:
+            # b = 0 makes the sigmoidal correction exactly 1.0, and ln_c = 0 keeps it finite for outlying values
+            params[3:] = 0.0
+        # The largest value of each term: its weight (0.0 for negative weights), unbounded if the correction can
+        # exceed 1.0 (b < 0)
+        bounds = np.where(params[3] >= 0.0, np.maximum(params[0], 0.0), np.inf)
+        self.order = np.argsort(-bounds, kind='mergesort')
+        self.params = params[:, self.order]
+        # The bound on the terms still to come before each term is evaluated
+        self.remaining = np.cumsum(bounds[self.order][::-1])[::-1]
+        self.rows = 0
+        self.terms_evaluated = 0
+        self.pruned = np.zeros(len(self.order), dtype=np.int64)
+        self.seconds = 0.0
+        self._scores = np.zeros(0, dtype=np.float64)
+        self._rows = np.zeros(0, dtype=np.int64)
+        self._ids = []
+
+    @property
+    def floor(self) -> float:
+        """
+        The score a molecule has to reach: the larger of the threshold and the k-th best score so far
+        """
+        floor = -np.inf if self.threshold is None else self.threshold
+        if self.k is not None and len(self._scores) >= self.k:
+            floor = max(floor, self._scores.min())
+        return floor
+
+    def add(self, X, columns: typing.Sequence[str]=None, ids=None):
+        """
+        Screen a chunk of molecules
+        :param X: A Pandas DataFrame or a 2D array with one row per molecule
+        :param columns: The descriptor names of the columns of a 2D array [default: the DataFrame columns]
+        :param ids: The id of each molecule [default: the DataFrame index, the row position for arrays]
+        """
+        started = time.perf_counter()
+        if hasattr(X, 'iloc'):
+            columns = X.columns if columns is None else columns
+            if ids is None:
+                ids = X.index.values
+            column_values = lambda position: X.iloc[:, position].values  # noqa: E731
+        else:
+            X = np.asarray(X)
+            if X.ndim != 2:
+                raise AssertionError("Input to screening must be 2D, got shape {}".format(X.shape))
+            if columns is None or len(columns) != X.shape[1]:
+                raise AssertionError("Screening a 2D array needs one column name per column")
+            column_values = lambda position: X[:, position]  # noqa: E731
+        nrows = len(X)
+        if ids is None:
+            ids = np.arange(self.rows, self.rows + nrows)
+        ids = np.asarray(ids)
+        positions = self.model.column_positions(list(columns))[self.order]
+        values = [np.asarray(column_values(position), dtype=np.float64) if position >= 0 else None
+                  for position in positions]
+        for start in range(0, nrows, SCREEN_BLOCK_ROWS):
+            stop = min(start + SCREEN_BLOCK_ROWS, nrows)
+            survivors, scores = self._screen_block([None if v is None else v[start:stop] for v in values],
+                                                   stop - start)
+            self._keep(survivors + self.rows + start, ids[start:stop][survivors], scores)
+        self.rows += nrows
+        self.seconds += time.perf_counter() - started
+
+    def _screen_block(self, values: typing.List[typing.Optional[np.ndarray]], nrows: int) -> \
+            typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Score a block of molecules term by term, dropping those whose bound falls below the floor
+        :param values: The values of each model descriptor (None when missing), in the order of self.order
+        :param nrows: The number of molecules in the block
+        :return: The positions in the block of the molecules that made the cut and their scores
+        """
+        floor = self.floor - BOUND_SLACK
+        alive = np.arange(nrows)
+        partial = np.zeros(nrows, dtype=np.float64)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            for idx, (weight, mean, inv_two_var, b, ln_c, cutoff) in enumerate(self.params.T):
+                if floor > -np.inf:
+                    keep = partial + self.remaining[idx] >= floor
+                    if not keep.all():
+                        self.pruned[idx] += len(keep) - np.count_nonzero(keep)
+                        alive = alive[keep]
+                        partial = partial[keep]
+                        if not len(alive):
+                            break
+                if values[idx] is None:
+                    continue
+                z = values[idx][alive]
+                terms = weight * np.exp(-np.square(z - mean) * inv_two_var) / (1.0 + b * np.exp(-ln_c * (z - cutoff)))
+                terms[np.isnan(z)] = 0.0
+                partial += terms
+                self.terms_evaluated += len(z)
+        if self.threshold is not None and len(alive):
+            keep = partial >= self.threshold
+            alive = alive[keep]
+            partial = partial[keep]
+        return alive, partial
+
+    def _keep(self, rows: np.ndarray, ids: np.ndarray, scores: np.ndarray):
+        """
+        Merge newly scored molecules into the kept molecules, keeping only the k best
+        """
+        if not len(rows):
+            return
+        self._scores = np.concatenate([self._scores, scores])
+        self._rows = np.concatenate([self._rows, rows.astype(np.int64)])
+        self._ids.append(ids)
+        if self.k is not None and len(self._scores) > self.k:
+            ids = np.concatenate(self._ids)
+            # Ties at the k-th score keep the earliest molecules
+            best = np.lexsort((self._rows, -self._scores))[:self.k]
+            self._scores, self._rows, self._ids = self._scores[best], self._rows[best], [ids[best]]
+
+    def stats(self) -> OrderedDict:
+        """
+        The pruning statistics
+        :return: An OrderedDict with the rows screened, rows kept, the final floor, the terms evaluated out of the
+                 terms of an exhaustive scoring, the fraction skipped, the molecules pruned before each descriptor
+                 (highest weight first), seconds and rows per second
+        """
+        terms_total = self.rows * len(self.order)
+        return OrderedDict([('rows', self.rows),
+                            ('kept', len(self._scores)),
+                            ('floor', float(self.floor)),
+                            ('terms_evaluated', self.terms_evaluated),
+                            ('terms_total', terms_total),
+                            ('terms_skipped', 1.0 - self.terms_evaluated / terms_total if terms_total else 0.0),
+                            ('pruned', OrderedDict(zip([self.model.descriptors[idx] for idx in self.order],
+                                                       self.pruned.tolist()))),
+                            ('seconds', self.seconds),
+                            ('rows_per_second', self.rows / self.seconds if self.seconds > 0 else float('inf'))])
+
+    def result(self) -> ScreeningResult:
+        """
+        :return: The ScreeningResult of everything screened so far
+        """
+        ids = np.concatenate(self._ids) if self._ids else np.zeros(0, dtype=np.int64)
+        return ScreeningResult(self._rows, ids, self._scores, self.stats())
+
+
+def screen(model, chunks, k: int=None, threshold: float=None, columns: typing.Sequence[str]=None,
+           id_column: str=None) -> ScreeningResult:
+    """
+    Find the k best molecules (or all of those at or above a threshold) without scoring every descriptor of every
+    molecule
+    :param model: A pMPOModel or CompiledpMPOModel
+    :param chunks: A Pandas DataFrame or 2D array, or an iterable of them (e.g. pd.read_csv(..., chunksize=100000))
+    :param k: Keep the k best molecules
+    :param threshold: Keep the molecules scoring at least this much
+    :param columns: The descriptor names of the columns of 2D arrays
+    :param id_column: DataFrame column with the molecule ids [default: the DataFrame index]
+    :return: The ScreeningResult
+    """
+    screener = Screener(model, k=k, threshold=threshold)
+    if hasattr(chunks, 'iloc') or isinstance(chunks, np.ndarray):
+        chunks = [chunks]
+    for chunk in chunks:
+        screener.add(chunk, columns=columns, ids=chunk[id_column].values if id_column is not None else None)
+    return screener.result()
+
+
+def screen_file(model, path: str, k: int=None, threshold: float=None, id_column: str=None, chunksize: int=None,
+                fmt: str=None) -> ScreeningResult:
+    """
+    Screen a CSV/TSV/Parquet descriptor file in chunks, only reading the model descriptors (and the id column)
+    :param model: A pMPOModel or CompiledpMPOModel
+    :param path: Path to the descriptor file
+    :param k: Keep the k best molecules
+    :param threshold: Keep the molecules scoring at least this much
+    :param id_column: Column with the molecule ids [default: the row position]
+    :param chunksize: The number of rows per chunk
+    :param fmt: Explicit format ('csv', 'tsv' or 'parquet') [default: from the file extension]
+    :return: The ScreeningResult
+    """
+    from pMPO.scoring import DEFAULT_CHUNKSIZE, iter_table_chunks, table_columns
+    compiled = model if isinstance(model, CompiledpMPOModel) else model.compile()
+    header = table_columns(path, fmt)
+    if id_column is not None and id_column not in header:
+        raise AssertionError("Id column {} does not exist in {}".format(id_column, path))
+    descriptor_columns = [header[position] for position in compiled.column_positions(header) if position >= 0]
+    read_columns = ([id_column] if id_column is not None else []) + \
+        [col for col in descriptor_columns if col != id_column]
+    screener = Screener(compiled, k=k, threshold=threshold)
+    for chunk in iter_table_chunks(path, read_columns, float_columns=descriptor_columns,
+                                   chunksize=chunksize or DEFAULT_CHUNKSIZE, fmt=fmt):
+        ids = chunk[id_column].values if id_column is not None else \
+            np.arange(screener.rows, screener.rows + len(chunk))
+        screener.add(chunk[descriptor_columns], ids=ids)
+    return screener.result()
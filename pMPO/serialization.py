@@ -0,0 +1,172 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import pickle
+import typing
+from pMPO.runtime import CompiledpMPOModel, ModelBank
+
+########################################################################################################################
+# Model files and directories of model files
+#   .pmpo  the flat binary format of a compiled model (see CompiledpMPOModel.to_bytes), loads in microseconds
+#   .json  the JSON format of a pMPOModel (see pMPOModel.to_json)
+#   .pkl   a pickled model
+# The format comes from the file extension, so a model file is only ever unpickled when it is named as a pickle
+# Only the JSON format needs the full pMPO module, so loading binary models stays within the NumPy-only runtime
+########################################################################################################################
+
+MODEL_EXTENSIONS = ('.pmpo', '.json', '.pkl')
+
+
+def load_model(path: str):
+    """
+    Load a model file in the format given by its extension (.pmpo, .json or .pkl)
+    :param path: Path to the model file
+    :return: A CompiledpMPOModel for binary files, a pMPOModel for JSON files or the pickled model
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in MODEL_EXTENSIONS:
+        raise KeyError("Unknown model file extension: {}".format(extension))
+    with open(path, 'rb') as f:
+        buffer = f.read()
+    if extension == '.pmpo':
+        return CompiledpMPOModel.from_bytes(buffer)
+    if extension == '.json':
+        if not buffer.lstrip().startswith(b'{'):
+            raise AssertionError("Not a JSON pMPO model: {}".format(path))
+        from pMPO.pMPO import pMPOModel
+        return pMPOModel.from_json(buffer.decode('utf-8'))
+    return pickle.loads(buffer)
+
+
+def save_model(model, path: str):
+    """
+    Save a model in the format given by the file extension (.pmpo, .json or .pkl)
+    pMPOModels are compiled for the binary format, only pMPOModels can be saved as JSON
+    :param model: A pMPOModel or CompiledpMPOModel
+    :param path: Path to the model file
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.pmpo':
+        (model if isinstance(model, CompiledpMPOModel) else model.compile()).save(path)
+    elif extension == '.json':
+        if not hasattr(model, 'to_json'):
+            raise AssertionError("Only a pMPOModel can be saved as JSON, got {}".format(type(model)))
+        with open(path, 'w') as f:
+            f.write(model.to_json())
+    elif extension == '.pkl':
+        with open(path, 'wb') as f:
+            pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+    else:
+        raise KeyError("Unknown model file extension: {}".format(extension))
+
+
+class ModelDirectory:
+    """
+    A directory of model files loaded lazily by name
+    A model named NAME is stored as NAME.pmpo, NAME.json or NAME.pkl (looked up in that order) and is only read the
+    first time it is requested
+    """
+    def __init__(self, directory: str, cache: bool=True, create: bool=False):
+        """
+        Open a model directory
+        :param directory: The directory of model files
+        :param cache: Keep the models loaded so far in memory
+        :param create: Create the directory if it does not exist (otherwise a missing directory is an error)
+        """
+        self.directory = os.path.expanduser(directory)
+        self.cache = cache
+        self.models = {}
+        if create:
+            os.makedirs(self.directory, exist_ok=True)
+        elif not os.path.isdir(self.directory):
+            raise AssertionError("No model directory {}".format(self.directory))
+
+    def path(self, name: str) -> typing.Optional[str]:
+        """
+        Find the file of a model
+        :param name: The model name
+        :return: The path of the model file, or None when there is none (or the name is not a plain file name)
+        """
+        if not name or name in ('.', '..') or '/' in name or '\\' in name:
+            return None
+        for extension in MODEL_EXTENSIONS:
+            path = os.path.join(self.directory, name + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def __getitem__(self, name: str):
+        if name in self.models:
+            return self.models[name]
+        path = self.path(name)
+        if path is None:
+            raise KeyError("No model named {} in {}".format(name, self.directory))
+        model = load_model(path)
+        if self.cache:
+            self.models[name] = model
+        return model
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models or self.path(name) is not None
+
+    def names(self) -> typing.List[str]:
+        """
+        The names of all the models in the directory
+        :return: The sorted model names
+        """
+        names = set()
+        for filename in os.listdir(self.directory):
+            name, extension = os.path.splitext(filename)
+            if extension in MODEL_EXTENSIONS:
+                names.add(name)
+        return sorted(names)
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self) -> int:
+        return len(self.names())
+
+    def add(self, model, name: str=None, fmt: str='pmpo') -> str:
+        """
+        Save a model into the directory
+        :param model: A pMPOModel or CompiledpMPOModel
+        :param name: The name to store the model under [default: the model name]
+        :param fmt: The file format ('pmpo', 'json' or 'pkl')
+        :return: The path of the model file
+        """
+        name = model.name if name is None else name
+        if not name or os.sep in name or (os.altsep and os.altsep in name) or name.startswith('.'):
+            raise AssertionError("Model name cannot be used as a file name: {}".format(name))
+        path = os.path.join(self.directory, name + '.' + fmt)
+        save_model(model, path)
+        self.models.pop(name, None)
+        return path
+
+    def bank(self, names: typing.Iterable[str]=None) -> ModelBank:
+        """
+        Stack models of the directory into a ModelBank
+        :param names: The model names [default: all the models]
+        :return: The model bank
+        """
+        return ModelBank([self[name] for name in (self.names() if names is None else names)])
@@ -0,0 +1,595 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import bisect
+import csv
+import json
+import time
+import typing
+import numpy as np
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+from pMPO.runtime import CompiledpMPOModel
+
+########################################################################################################################
+# The scoring server
+# Many small concurrent score requests are queued per model and coalesced into micro-batches, so the Gaussian and
+# sigmoid terms of a whole batch are evaluated in one vectorized pass instead of one Python call per molecule
+# The server speaks a minimal HTTP/1.1 (JSON bodies, keep-alive) over TCP or a unix socket and only needs NumPy
+#
+#   POST /score/MODEL   {"TPSA": 50.0, ...} -> {"model": MODEL, "score": 0.87}
+#                       [{"TPSA": 50.0, ...}, ...] -> {"model": MODEL, "scores": [0.87, ...]}
+#   GET  /models        -> {"models": [...]}
+#   GET  /metrics       -> request counts with the latency and batch size histograms
+#   GET  /health        -> {"status": "ok"}
+########################################################################################################################
+
+# Upper bounds of the latency histogram buckets in seconds (4 per decade from 10 us to 10 s)
+LATENCY_BOUNDS = tuple(10 ** (exponent / 4) for exponent in range(-20, 5))
+# Upper bounds of the batch size histogram buckets in molecules
+BATCH_SIZE_BOUNDS = tuple(2 ** exponent for exponent in range(17))
+# Largest accepted request body
+MAX_BODY_BYTES = 64 * 2 ** 20
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class Histogram:
+    """
+    A fixed-bucket histogram with approximate quantiles (the upper bound of the bucket holding the quantile)
+    """
+
+    def __init__(self, bounds: typing.Sequence[float]):
+        """
+        Create an empty histogram
+        :param bounds: The increasing upper bounds of the buckets, values above the last bound go to an overflow bucket
+        """
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """
+        Add a value to the histogram
+        :param value: The value
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Approximate a quantile by the upper bound of the bucket that holds it
+        :param q: The quantile (0.0 - 1.0)
+        :return: The bucket upper bound (the maximum value for the overflow bucket, 0.0 when empty)
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> OrderedDict:
+        """
+        Summarize the histogram
+        :return: An OrderedDict with the count, mean, max, p50, p90, p99 and the non-empty buckets as [bound, count]
+        """
+        buckets = [[bound, count] for bound, count in zip(self.bounds + (None,), self.counts) if count]
+        return OrderedDict([('count', self.count),
+                            ('mean', self.total / self.count if self.count else 0.0),
+                            ('max', self.max),
+                            ('p50', self.quantile(0.5)),
+                            ('p90', self.quantile(0.9)),
+                            ('p99', self.quantile(0.99)),
+                            ('buckets', buckets)])
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent score requests for one model into micro-batches
+    A batch is scored as soon as it holds max_batch_size molecules or max_wait seconds after its first request arrived,
+    whichever comes first. Requests are never split, so a single large request can exceed max_batch_size
+    """
+
+    def __init__(self, model: CompiledpMPOModel, max_batch_size: int=256, max_wait: float=0.001,
+                 batch_sizes: Histogram=None):
+        """
+        Create the batcher (must be created inside the running event loop)
+        :param model: The compiled model
+        :param max_batch_size: Maximum number of molecules gathered into one batch
+        :param max_wait: Maximum time in seconds the first request of a batch waits for others
+        :param batch_sizes: Optional histogram that receives the number of molecules in each batch
+        """
+        if max_batch_size < 1:
+            raise AssertionError("max_batch_size must be at least 1, got {}".format(max_batch_size))
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_sizes = batch_sizes if batch_sizes is not None else Histogram(BATCH_SIZE_BOUNDS)
+        self.batches = 0
+        self._queue = asyncio.Queue()
+        self._positions = {}
+        self._task = asyncio.ensure_future(self._run())
+
+    def block(self, molecules: typing.Sequence[typing.Dict[str, float]]) -> np.ndarray:
+        """
+        Convert molecules to a block of descriptor values in the order of the model descriptors
+        Missing descriptors are NaN (they score 0.0), keys that are not model descriptors are ignored
+        :param molecules: The descriptor dictionary of each molecule
+        :return: The (n x k) block of descriptor values
+        """
+        Z = np.full((len(molecules), len(self.model.descriptors)), np.nan, dtype=np.float64)
+        for row, molecule in enumerate(molecules):
+            if not isinstance(molecule, dict):
+                raise AssertionError("Each molecule must be a JSON object of descriptor values")
+            # Molecules from one client nearly always share the same keys, so their positions are looked up once
+            keys = tuple(molecule.keys())
+            positions = self._positions.get(keys)
+            if positions is None:
+                positions = [(idx, position) for idx, position in enumerate(self.model.column_positions(keys))
+                             if position >= 0]
+                if len(self._positions) < 1024:
+                    self._positions[keys] = positions
+            values = tuple(molecule.values())
+            for idx, position in positions:
+                if values[position] is not None:
+                    Z[row, idx] = values[position]
+        return Z
+
+    async def score(self, molecules: typing.Sequence[typing.Dict[str, float]]) -> np.ndarray:
+        """
+        Score molecules as part of the next micro-batch
+        :param molecules: The descriptor dictionary of each molecule
+        :return: A float array with the score of each molecule
+        """
+        Z = self.block(molecules)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((Z, future))
+        return await future
+
+    async def _run(self):
+        """
+        Gather and score micro-batches until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self._queue.get_nowait())
+                size += len(batch[-1][0])
+            self._score(batch, size)
+
+    def _score(self, batch: list, size: int):
+        """
+        Score a batch in one vectorized pass and resolve the future of each request with its slice of the scores
+        :param batch: The (block, future) of each request
+        :param size: The total number of molecules in the batch
+        """
+        self.batches += 1
+        self.batch_sizes.observe(size)
+        try:
+            scores = self.model.score_block(np.vstack([Z for Z, _ in batch]))
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        start = 0
+        for Z, future in batch:
+            if not future.done():
+                future.set_result(scores[start:start + len(Z)])
+            start += len(Z)
+
+    def close(self):
+        """
+        Stop gathering batches
+        """
+        self._task.cancel()
+
+
+class ScoringServer:
+    """
+    An asyncio HTTP scoring server holding models in memory and scoring concurrent requests in micro-batches
+    """
+
+    def __init__(self, models, max_batch_size: int=256, max_wait: float=0.001):
+        """
+        Create the server
+        :param models: A mapping of model name to model (pMPOModel or CompiledpMPOModel), a sequence of models (served
+                       under their names) or a ModelDirectory (models are loaded on first request)
+        :param max_batch_size: Maximum number of molecules gathered into one batch
+        :param max_wait: Maximum time in seconds the first request of a batch waits for others
+        """
+        if not hasattr(models, '__getitem__') or isinstance(models, (list, tuple)):
+            models = OrderedDict((model.name, model) for model in models)
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.latency = Histogram(LATENCY_BOUNDS)
+        self.batch_sizes = Histogram(BATCH_SIZE_BOUNDS)
+        self.requests = OrderedDict()
+        self.molecules = 0
+        self.errors = 0
+        self._batchers = {}
+        self._servers = []
+
+    def model_names(self) -> typing.List[str]:
+        """
+        :return: The names of the served models
+        """
+        return list(self.models.names() if hasattr(self.models, 'names') else self.models.keys())
+
+    def batcher(self, name: str) -> MicroBatcher:
+        """
+        Get the micro-batcher of a model, compiling the model on first use
+        :param name: The model name
+        :return: The MicroBatcher
+        """
+        batcher = self._batchers.get(name)
+        if batcher is None:
+            model = self.models[name]
+            if not isinstance(model, CompiledpMPOModel):
+                model = model.compile()
+            batcher = MicroBatcher(model, max_batch_size=self.max_batch_size, max_wait=self.max_wait,
+                                   batch_sizes=self.batch_sizes)
+            self._batchers[name] = batcher
+        return batcher
+
+    async def score(self, name: str, molecules: typing.Sequence[typing.Dict[str, float]]) -> np.ndarray:
+        """
+        Score molecules against a model as part of a micro-batch
+        :param name: The model name
+        :param molecules: The descriptor dictionary of each molecule
+        :return: A float array with the score of each molecule
+        """
+        scores = await self.batcher(name).score(molecules)
+        self.requests[name] = self.requests.get(name, 0) + 1
+        self.molecules += len(molecules)
+        return scores
+
+    def metrics(self) -> OrderedDict:
+        """
+        :return: The request counts with the latency (seconds) and batch size (molecules) histograms
+        """
+        return OrderedDict([('requests', OrderedDict(self.requests)),
+                            ('molecules', self.molecules),
+                            ('errors', self.errors),
+                            ('batches', sum(batcher.batches for batcher in self._batchers.values())),
+                            ('max_batch_size', self.max_batch_size),
+                            ('max_wait', self.max_wait),
+                            ('latency', self.latency.summary()),
+                            ('batch_size', self.batch_sizes.summary())])
+
+    async def respond(self, method: str, path: str, body: bytes) -> typing.Tuple[int, dict]:
+        """
+        Answer one request
+        :param method: The HTTP method
+        :param path: The request path
+        :param body: The request body
+        :return: The HTTP status and the JSON response
+        """
+        route = path.split('?', 1)[0].strip('/').split('/', 1)
+        if route[0] == 'score' and len(route) == 2:
+            if method != 'POST':
+                return 405, {'error': 'Use POST to score molecules'}
+            name = unquote(route[1])
+            if name not in self.models:
+                return 404, {'error': 'Unknown model: {}'.format(name)}
+            try:
+                payload = json.loads(body.decode('utf-8'))
+            except ValueError as error:
+                return 400, {'error': 'Invalid JSON: {}'.format(error)}
+            start = time.perf_counter()
+            try:
+                scores = await self.score(name, [payload] if isinstance(payload, dict) else payload)
+            except (AssertionError, TypeError, ValueError) as error:
+                return 400, {'error': str(error)}
+            self.latency.observe(time.perf_counter() - start)
+            if isinstance(payload, dict):
+                return 200, {'model': name, 'score': float(scores[0])}
+            return 200, {'model': name, 'scores': scores.tolist()}
+        if method != 'GET':
+            return 405, {'error': 'Use GET for {}'.format(path)}
+        if route == ['models']:
+            return 200, {'models': self.model_names()}
+        if route == ['metrics']:
+            return 200, self.metrics()
+        if route == ['health']:
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'Not found: {}'.format(path)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serve the requests of one (keep-alive) connection
+        :param reader: The connection reader
+        :param writer: The connection writer
+        """
+        try:
+            while True:
+                request = await read_http_message(reader)
+                if request is None:
+                    break
+                (method, path, _), headers, body = request
+                if body is None:
+                    status, response = 413, {'error': 'Request body is too large'}
+                else:
+                    try:
+                        status, response = await self.respond(method, path, body)
+                    except Exception as error:
+                        status, response = 500, {'error': str(error)}
+                if status != 200:
+                    self.errors += 1
+                keep_alive = headers.get('connection', '').lower() != 'close' and body is not None
+                writer.write(http_message('HTTP/1.1 {} {}'.format(status, HTTP_REASONS[status]),
+                                          json.dumps(response).encode('utf-8'), keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str='127.0.0.1', port: int=8080, path: str=None):
+        """
+        Start listening for connections (call serve_forever or close on the result)
+        :param host: The TCP host
+        :param port: The TCP port (0 picks a free port)
+        :param path: Listen on this unix socket path instead of TCP
+        :return: The asyncio server
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+        self._servers.append(server)
+        return server
+
+    async def close(self):
+        """
+        Stop listening and stop the micro-batchers
+        """
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        for batcher in self._batchers.values():
+            batcher.close()
+        self._batchers = {}
+
+
+def serve(models, host: str='127.0.0.1', port: int=8080, path: str=None, max_batch_size: int=256,
+          max_wait: float=0.001):
+    """
+    Run a ScoringServer until interrupted
+    :param models: The models (see ScoringServer)
+    :param host: The TCP host
+    :param port: The TCP port
+    :param path: Listen on this unix socket path instead of TCP
+    :param max_batch_size: Maximum number of molecules gathered into one batch
+    :param max_wait: Maximum time in seconds the first request of a batch waits for others
+    """
+    server = ScoringServer(models, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    async def run():
+        listener = await server.start(host=host, port=port, path=path)
+        try:
+            await listener.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+########################################################################################################################
+# HTTP messages
+########################################################################################################################
+
+
+def http_message(start_line: str, body: bytes, keep_alive: bool=True) -> bytes:
+    """
+    Format an HTTP/1.1 request or response with a JSON body
+    :param start_line: The request or status line
+    :param body: The JSON body
+    :param keep_alive: Whether the connection stays open
+    :return: The message bytes
+    """
+    return '{}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+        start_line, len(body), 'keep-alive' if keep_alive else 'close').encode('latin-1') + body
+
+
+async def read_http_message(reader: asyncio.StreamReader):
+    """
+    Read an HTTP/1.1 request or response with a Content-Length body
+    :param reader: The connection reader
+    :return: The split start line, the lower case headers and the body (None when larger than MAX_BODY_BYTES), or
+             None when the connection was closed
+    """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    start_line = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        return start_line, headers, None
+    body = await reader.readexactly(length) if length else b''
+    return start_line, headers, body
+
+########################################################################################################################
+# The load test client
+########################################################################################################################
+
+
+class ScoringClient:
+    """
+    A minimal asyncio client for one keep-alive connection to a ScoringServer
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str='127.0.0.1', port: int=8080, path: str=None) -> 'ScoringClient':
+        """
+        Open a connection
+        :param host: The TCP host
+        :param port: The TCP port
+        :param path: Connect to this unix socket path instead of TCP
+        :return: The client
+        """
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, method: str, path: str, payload=None) -> typing.Tuple[int, dict]:
+        """
+        Send a request and read the response
+        :param method: The HTTP method
+        :param path: The request path
+        :param payload: The JSON payload (POST only)
+        :return: The HTTP status and the JSON response
+        """
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.writer.write(http_message('{} {} HTTP/1.1'.format(method, path), body))
+        await self.writer.drain()
+        response = await read_http_message(self.reader)
+        if response is None:
+            raise ConnectionError("The scoring server closed the connection")
+        (_, status, _), _, body = response
+        return int(status), json.loads(body.decode('utf-8'))
+
+    async def score(self, model: str, molecules):
+        """
+        Score one molecule (a dictionary) or a list of molecules
+        :param model: The model name
+        :param molecules: The descriptor dictionary of one molecule or a list of them
+        :return: The score or the list of scores
+        """
+        status, response = await self.request('POST', '/score/{}'.format(quote(model)), molecules)
+        if status != 200:
+            raise AssertionError("Scoring failed ({}): {}".format(status, response.get('error')))
+        return response['score'] if isinstance(molecules, dict) else response['scores']
+
+    async def close(self):
+        """
+        Close the connection
+        """
+        self.writer.close()
+
+
+async def load_test(model: str, molecules: typing.Sequence[typing.Dict[str, float]], host: str='127.0.0.1',
+                    port: int=8080, path: str=None, concurrency: int=64, requests: int=10000,
+                    batch: int=1) -> OrderedDict:
+    """
+    Fire score requests at a ScoringServer from many concurrent connections and measure the client-side latency
+    :param model: The model name
+    :param molecules: The molecules to send (cycled through)
+    :param host: The TCP host
+    :param port: The TCP port
+    :param path: Connect to this unix socket path instead of TCP
+    :param concurrency: Number of concurrent connections
+    :param requests: Total number of requests
+    :param batch: Molecules per request (1 sends single-molecule objects)
+    :return: An OrderedDict with the requests, molecules, seconds, requests_per_second, molecules_per_second, the
+             latency histogram summary and the server metrics
+    """
+    if not molecules:
+        raise AssertionError("load_test needs at least one molecule")
+    latency = Histogram(LATENCY_BOUNDS)
+    counter = iter(range(requests))
+
+    async def worker(client: ScoringClient):
+        for idx in counter:
+            start = (idx * batch) % len(molecules)
+            payload = [molecules[(start + offset) % len(molecules)] for offset in range(batch)]
+            began = time.perf_counter()
+            await client.score(model, payload[0] if batch == 1 else payload)
+            latency.observe(time.perf_counter() - began)
+
+    clients = [await ScoringClient.connect(host=host, port=port, path=path) for _ in range(max(1, concurrency))]
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for client in clients])
+        seconds = time.perf_counter() - start
+        _, metrics = await clients[0].request('GET', '/metrics')
+    finally:
+        for client in clients:
+            await client.close()
+    return OrderedDict([('requests', requests),
+                        ('molecules', requests * batch),
+                        ('seconds', seconds),
+                        ('requests_per_second', requests / seconds if seconds > 0 else float('inf')),
+                        ('molecules_per_second', requests * batch / seconds if seconds > 0 else float('inf')),
+                        ('latency', latency.summary()),
+                        ('server', metrics)])
+
+
+def read_molecules(path: str) -> typing.List[typing.Dict[str, float]]:
+    """
+    Read the numeric columns of a CSV or TSV file (or a JSON list of objects) as molecules for load_test
+    :param path: The file path
+    :return: The descriptor dictionary of each row
+    """
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    molecules = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t' if path.endswith(('.tsv', '.tab')) else ','):
+            molecule = {}
+            for key, value in row.items():
+                try:
+                    molecule[key] = float(value)
+                except (TypeError, ValueError):
+                    pass
+            molecules.append(molecule)
+    return molecules
@@ -0,0 +1,446 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import typing
+import numpy as np
+import pandas as pd
+from pMPO.pMPO import pMPOBuilder, evaluate_good_values, numeric_column_iterator, group_moments, \
+    statistics_from_moments, finalize_descriptor_statistics, select_uncorrelated_columns
+
+########################################################################################################################
+# Mergeable sufficient statistics
+# Each chunk of rows is reduced to counts, means and sums of squared deviations (M2) that are merged into the running
+# totals with the pairwise update of Chan et al., so the final statistics never need more than one chunk in memory
+########################################################################################################################
+
+
+def merge_moments(a: tuple, b: tuple) -> tuple:
+    """
+    Merge two sets of (count, mean, M2) moments computed over disjoint sets of rows
+    Rows are removed again by merging their moments with a negated count and M2 (see negate_moments)
+    :param a: Tuple of the count, mean and M2 arrays of the first set of rows
+    :param b: Tuple of the count, mean and M2 arrays of the second set of rows
+    :return: Tuple of the count, mean and M2 arrays over the union of the rows
+    """
+    na, ma, qa = a
+    nb, mb, qb = b
+    n = na + nb
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(nb != 0, mb, 0.0) - np.where(na != 0, ma, 0.0)
+        mean = np.where(na != 0, ma, 0.0) + delta * nb / n
+        m2 = np.where(na != 0, qa, 0.0) + np.where(nb != 0, qb, 0.0) + np.square(delta) * na * nb / n
+    return n, np.where(n > 0, mean, np.nan), np.where(n > 0, np.maximum(m2, 0.0), 0.0)
+
+
+def negate_moments(moments: tuple) -> tuple:
+    """
+    Negate (count, mean, M2) moments so that merging them removes the rows they were computed over
+    :param moments: Tuple of the count, mean and M2 arrays
+    :return: Tuple of the negated count, mean and negated M2 arrays
+    """
+    n, mean, m2 = moments
+    return -n, mean, -m2
+
+
+def scale_moments(moments: tuple, factor: float) -> tuple:
+    """
+    Scale the weight of every row behind (count, mean, M2) moments, e.g. for exponential time-decay
+    :param moments: Tuple of the count, mean and M2 arrays
+    :param factor: The weight multiplier
+    :return: Tuple of the scaled count, mean and scaled M2 arrays
+    """
+    n, mean, m2 = moments
+    return n * factor, mean, m2 * factor
+
+
+class DescriptorMoments:
+    """
+    Running good/bad sample moments for a fixed list of descriptor columns
+    """
+    def __init__(self, names: typing.Sequence[str]):
+        """
+        Create empty moments
+        :param names: The descriptor names
+        """
+        self.names = list(names)
+        empty = (np.zeros(len(self.names), dtype=np.int64), np.full(len(self.names), np.nan),
+                 np.zeros(len(self.names)))
+        self.good = empty
+        self.bad = empty
+
+    def update(self, X: np.ndarray, good_mask: np.ndarray, bad_mask: np.ndarray):
+        """
+        Add a block of rows
+        :param X: A 2D float array with one row per molecule and one column per descriptor
+        :param good_mask: Boolean row mask of the good molecules
+        :param bad_mask: Boolean row mask of the bad molecules
+        """
+        self.good = merge_moments(self.good, group_moments(X, good_mask))
+        self.bad = merge_moments(self.bad, group_moments(X, bad_mask))
+
+    def remove(self, X: np.ndarray, good_mask: np.ndarray, bad_mask: np.ndarray, weight: float=1.0):
+        """
+        Remove a block of rows that was previously added
+        :param X: A 2D float array with one row per molecule and one column per descriptor
+        :param good_mask: Boolean row mask of the good molecules
+        :param bad_mask: Boolean row mask of the bad molecules
+        :param weight: The current weight of the rows (see scale)
+        """
+        self.good = merge_moments(self.good, negate_moments(scale_moments(group_moments(X, good_mask), weight)))
+        self.bad = merge_moments(self.bad, negate_moments(scale_moments(group_moments(X, bad_mask), weight)))
+
+    def scale(self, factor: float):
+        """
+        Multiply the weight of every row accumulated so far
+        :param factor: The weight multiplier
+        """
+        self.good = scale_moments(self.good, factor)
+        self.bad = scale_moments(self.bad, factor)
+
+    def merge(self, other: 'DescriptorMoments'):
+        """
+        Add the moments accumulated over another (disjoint) set of rows
+        :param other: The other moments over the same descriptors
+        """
+        self.good = merge_moments(self.good, other.good)
+        self.bad = merge_moments(self.bad, other.bad)
+
+    def statistics(self, min_samples=10) -> pd.DataFrame:
+        """
+        The raw separation statistics (see statistics_from_moments)
+        :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+        :return: A Pandas DataFrame with the name, p_value, good/bad means, stds and sample counts
+        """
+        return statistics_from_moments(self.names, self.good, self.bad, min_samples=min_samples)
+
+
+class PairwiseComoments:
+    """
+    Running pairwise-complete co-moments for a fixed list of descriptor columns
+    Like DataFrame.corr(), each pair of descriptors only uses the rows where both values are present. For every pair
+    (i, j) this keeps the number of shared rows, the mean and M2 of descriptor i over those rows and the co-moment
+    """
+    def __init__(self, names: typing.Sequence[str]):
+        """
+        Create empty co-moments
+        :param names: The descriptor names
+        """
+        self.names = list(names)
+        d = len(self.names)
+        self.n = np.zeros((d, d), dtype=np.float64)
+        self.mean = np.zeros((d, d), dtype=np.float64)
+        self.m2 = np.zeros((d, d), dtype=np.float64)
+        self.comoment = np.zeros((d, d), dtype=np.float64)
+
+    @staticmethod
+    def _block(X: np.ndarray) -> tuple:
+        """
+        Co-moments of one block of rows
+        """
+        present = ~np.isnan(X)
+        weights = present.astype(np.float64)
+        # Shift by the block means so the sums of squares below do not lose precision
+        with np.errstate(invalid='ignore', divide='ignore'):
+            shift = np.where(present, X, 0.0).sum(axis=0) / weights.sum(axis=0)
+        Y = np.where(present, X - np.where(np.isnan(shift), 0.0, shift), 0.0)
+        n = weights.T.dot(weights)
+        sums = Y.T.dot(weights)
+        squares = np.square(Y).T.dot(weights)
+        products = Y.T.dot(Y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, sums / n, 0.0)
+        m2 = squares - mean * sums
+        comoment = products - mean * sums.T
+        return n, mean + np.where(np.isnan(shift), 0.0, shift)[:, np.newaxis], m2, comoment
+
+    def _merge(self, n, mean, m2, comoment):
+        """
+        Merge co-moments over another set of rows into the running totals (negated n, m2, comoment remove the rows)
+        """
+        total = self.n + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(n != 0, mean - self.mean, 0.0)
+            factor = np.where(total > 0, self.n * n / total, 0.0)
+            self.mean = np.where(total > 0, self.mean + delta * n / total, 0.0)
+        self.m2 = self.m2 + m2 + np.square(delta) * factor
+        self.comoment = self.comoment + comoment + delta * delta.T * factor
+        self.n = total
+
+    def update(self, X: np.ndarray):
+        """
+        Add a block of rows
+        :param X: A 2D float array with one row per molecule and one column per descriptor
+        """
+        self._merge(*self._block(X))
+
+    def remove(self, X: np.ndarray, weight: float=1.0):
+        """
+        Remove a block of rows that was previously added
+        :param X: A 2D float array with one row per molecule and one column per descriptor
+        :param weight: The current weight of the rows (see scale)
+        """
+        n, mean, m2, comoment = self._block(X)
+        self._merge(-weight * n, mean, -weight * m2, -weight * comoment)
+
+    def scale(self, factor: float):
+        """
+        Multiply the weight of every row accumulated so far
+        :param factor: The weight multiplier
+        """
+        self.n = self.n * factor
+        self.m2 = self.m2 * factor
+        self.comoment = self.comoment * factor
+
+    def correlation(self, names: typing.Sequence[str]=None) -> pd.DataFrame:
+        """
+        The Pearson correlation matrix, equivalent to DataFrame.corr()
+        :param names: Optional subset (and order) of the descriptors
+        :return: A Pandas DataFrame with the correlation matrix
+        """
+        idx = np.arange(len(self.names)) if names is None else np.array([self.names.index(n) for n in names],
+                                                                          dtype=np.intp)
+        sub = np.ix_(idx, idx)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = self.comoment[sub] / np.sqrt(self.m2[sub] * self.m2[sub].T)
+        r[self.n[sub] < 2] = np.nan
+        labels = [self.names[i] for i in idx]
+        return pd.DataFrame(r, index=labels, columns=labels)
+
+
+########################################################################################################################
+# Streaming model builder
+########################################################################################################################
+
+
+class pMPOStreamingBuilder(pMPOBuilder):
+    """
+    Build a pMPO model from chunks of rows, e.g. lambda: pd.read_csv(..., chunksize=100000)
+    The statistics, correlation and model are the same as the in-memory pMPOBuilder (up to floating point rounding)
+    Memory: only one chunk is held at a time. The first pass keeps O(d) moments for the d descriptor columns, the second
+    pass keeps the O(s^2) co-moments of the s significant descriptors only. Chunks that can only be read once need
+    full_correlation, which keeps the co-moments of every pair of columns in a single pass: O(d^2) memory (four d x d
+    float64 arrays, 12.8 GB for 20,000 columns), so restrict very wide data with columns
+    Progress events while the chunks are read have the rows read so far as done and None as total
+    """
+    def __init__(self, chunks, good_column: str, model_name: str, good_value='default', min_samples: int=10,
+                 p_cutoff: float=0.01, q_cutoff: float=0.05, r2_cutoff: float=0.53, sigmoidal_correction=True,
+                 case_insensitive=True, columns: typing.Sequence[str]=None, full_correlation: bool=False,
+                 progress: typing.Callable=None, profile_memory: bool=False):
+        """
+        Build a pMPO model from chunks of data (Pandas DataFrames with good molecules, bad molecules, and data)
+        :param chunks: A function returning an iterable of chunks or a list of chunks (both read twice), or with
+                       full_correlation any iterable of chunks (read once)
+        :param good_column: Input DataFrame column that distinguishes good from bad values
+        :param model_name: Name of the pMPO model
+        :param good_value: Criteria to evaluate good from bad molecules ('default', str, callable)
+        :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+        :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
+        :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
+        :param r2_cutoff: The r^2 cutoff for determining linearly correlated descriptors
+        :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+        :param case_insensitive: Whether the models should be case insensitive to the descriptor keys
+        :param columns: The descriptor columns to use [default: the numeric columns of the first chunk]
+        :param full_correlation: Read the chunks once and keep the co-moments of every pair of columns (O(d^2) memory)
+        :param progress: Optional function called with a progress event dictionary (see pMPOBuilder)
+        :param profile_memory: Also record the peak memory allocated during each stage in self.profile
+        """
+        # The input is never modified and there is no DataFrame to cache
+        self._setup(model_name, good_value=good_value, min_samples=min_samples, p_cutoff=p_cutoff, q_cutoff=q_cutoff,
+                    r2_cutoff=r2_cutoff, sigmoidal_correction=sigmoidal_correction,
+                    case_insensitive=case_insensitive, inplace=False, progress=progress, profile_memory=profile_memory)
+        self.df = None
+        self.good_column = good_column
+        self.full_correlation = full_correlation
+        if full_correlation:
+            self.read_chunks = None
+            first_pass = chunks() if callable(chunks) else chunks
+        elif callable(chunks) or isinstance(chunks, (list, tuple)):
+            self.read_chunks = chunks if callable(chunks) else lambda: chunks
+            first_pass = self.read_chunks()
+        else:
+            raise AssertionError("pMPO streaming reads the chunks twice: pass a function returning the chunks, a list "
+                                 "of chunks, or full_correlation=True")
+        self.columns = None if columns is None else list(columns)
+        self.moments = None
+        self.comoments = None
+        self.nrows = 0
+        # The number of rows is only known once every chunk has been read
+        with self._stage('statistics', None, 'rows') as report:
+            for chunk in first_pass:
+                self.consume(chunk)
+                report(self.nrows)
+            if self.moments is None:
+                raise AssertionError("Input pMPO chunks have no data")
+            self._finalize_statistics()
+        self._select()
+
+    def _start_moments(self):
+        """
+        Create the empty running statistics once the descriptor columns are known
+        """
+        if self.moments is None:
+            self.moments = DescriptorMoments(self.columns)
+            if self.full_correlation:
+                self.comoments = PairwiseComoments(self.columns)
+
+    def _chunk_arrays(self, chunk: pd.DataFrame,
+                      positions: typing.Sequence[int]=None) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Extract the descriptor matrix and the good molecule mask of a chunk
+        :param chunk: A Pandas DataFrame with the good_column and the descriptor columns
+        :param positions: Optional positions of the descriptor columns to extract [default: all]
+        :return: Tuple of the (rows x descriptors) float matrix and the boolean good mask
+        """
+        if self.good_column not in chunk.columns:
+            raise AssertionError("{} does not exist in input pMPO DataFrame".format(self.good_column))
+        if self.columns is None:
+            self.columns = list(numeric_column_iterator(chunk))
+        self._start_moments()
+        good_mask = evaluate_good_values(chunk[self.good_column], self.good_value)
+        names = self.columns if positions is None else [self.columns[idx] for idx in positions]
+        X = np.empty((len(chunk), len(names)), dtype=np.float64, order='F')
+        for idx, col in enumerate(names):
+            X[:, idx] = chunk[col].values
+        return X, good_mask
+
+    def consume(self, chunk: pd.DataFrame):
+        """
+        Add a chunk of rows to the running statistics (and to the co-moments with full_correlation)
+        :param chunk: A Pandas DataFrame with the good_column and the descriptor columns
+        """
+        X, good_mask = self._chunk_arrays(chunk)
+        self.moments.update(X, good_mask, ~good_mask)
+        if self.comoments is not None and self.full_correlation:
+            self.comoments.update(X)
+        self.nrows += len(X)
+
+    def _finalize_statistics(self):
+        """
+        Calculate the descriptor statistics from the running moments
+        """
+        self.descriptor_stats = finalize_descriptor_statistics(self.moments.statistics(min_samples=self.min_samples),
+                                                               p_cutoff=self.p_cutoff, q_cutoff=self.q_cutoff)
+
+    def _select(self):
+        """
+        Calculate the correlation of the significant descriptors and select the uncorrelated ones
+        Without full_correlation this reads the chunks a second time for the co-moments of the significant descriptors
+        """
+        significant = self.descriptor_stats[(self.descriptor_stats.significant == True)].name.values.tolist()
+        # The second pass advances over the rows, the full co-moments only report the start and end
+        correlation_total, correlation_unit = (len(significant), 'descriptors') if self.full_correlation \
+            else (self.nrows, 'rows')
+        with self._stage('correlation', correlation_total, correlation_unit) as report:
+            if not self.full_correlation:
+                positions = [self.columns.index(name) for name in significant]
+                self.comoments = PairwiseComoments(significant)
+                rows = 0
+                for chunk in self.read_chunks():
+                    X, _ = self._chunk_arrays(chunk, positions)
+                    self.comoments.update(X)
+                    rows += len(X)
+                    report(rows)
+            self.descriptor_corr = np.square(self.comoments.correlation(significant))
+        with self._stage('selection', len(significant), 'descriptors'):
+            select_uncorrelated_columns(self.descriptor_stats, self.descriptor_corr, r2_cutoff=self.r2_cutoff)
+        self.pMPO = None
+
+    def refresh(self):
+        """
+        Recalculate the descriptor statistics, the correlation and the selection from the running statistics
+        """
+        with self._stage('statistics'):
+            self._finalize_statistics()
+        self._select()
+
+
+class pMPOIncrementalBuilder(pMPOStreamingBuilder):
+    """
+    A pMPO builder that keeps its sufficient statistics so labelled compounds can be added or removed later
+    Each update or removal costs time proportional to the rows involved, not to the whole history
+    With a decay factor every update first multiplies the weight of all earlier rows by the decay, so older compounds
+    count exponentially less than newer ones. The sample counts then become effective counts (the sums of the row
+    weights, not rounded): they are reported in good_nsamples/bad_nsamples, compared to min_samples and used as the
+    sample sizes of the Welch t-test and its degrees of freedom
+    Updates and removals can change which descriptors are significant, so the co-moments of every pair of columns are
+    kept (O(d^2) memory, see pMPOStreamingBuilder), restrict very wide data with columns
+    """
+    def __init__(self, data, good_column: str, model_name: str, good_value='default', min_samples: int=10,
+                 p_cutoff: float=0.01, q_cutoff: float=0.05, r2_cutoff: float=0.53, sigmoidal_correction=True,
+                 case_insensitive=True, columns: typing.Sequence[str]=None, decay: float=None,
+                 progress: typing.Callable=None, profile_memory: bool=False):
+        """
+        Build an updatable pMPO model
+        :param data: Pandas DataFrame (or iterable of DataFrame chunks) with good molecules, bad molecules, and data
+        :param good_column: Input DataFrame column that distinguishes good from bad values
+        :param model_name: Name of the pMPO model
+        :param good_value: Criteria to evaluate good from bad molecules ('default', str, callable)
+        :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+        :param p_cutoff: The p-value cutoff to determine significant separation between good and bad molecules
+        :param q_cutoff: The q-value cutoff used in parameterizing the sigmoidal functions
+        :param r2_cutoff: The r^2 cutoff for determining linearly correlated descriptors
+        :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+        :param case_insensitive: Whether the models should be case insensitive to the descriptor keys
+        :param columns: The descriptor columns to use [default: the numeric columns of the first chunk]
+        :param decay: Optional weight multiplier (0 < decay <= 1) applied to all earlier rows on every update
+        :param progress: Optional function called with a progress event dictionary (see pMPOBuilder)
+        :param profile_memory: Also record the peak memory allocated during each stage in self.profile
+        """
+        if decay is not None and not 0.0 < decay <= 1.0:
+            raise AssertionError("pMPO decay must be in (0, 1], got {}".format(decay))
+        self.decay = decay
+        # The number of updates so far, the weight of rows added at update u is decay ** (self.updates - u)
+        self.updates = 0
+        super().__init__([data] if isinstance(data, pd.DataFrame) else data, good_column, model_name,
+                         good_value=good_value, min_samples=min_samples, p_cutoff=p_cutoff, q_cutoff=q_cutoff,
+                         r2_cutoff=r2_cutoff, sigmoidal_correction=sigmoidal_correction,
+                         case_insensitive=case_insensitive, columns=columns, full_correlation=True,
+                         progress=progress, profile_memory=profile_memory)
+
+    def update(self, new_df: pd.DataFrame):
+        """
+        Add newly labelled compounds and refresh the model
+        :param new_df: A Pandas DataFrame with the good_column and the descriptor columns
+        """
+        if self.decay is not None:
+            self.moments.scale(self.decay)
+            self.comoments.scale(self.decay)
+        self.updates += 1
+        self.consume(new_df)
+        self.refresh()
+
+    def remove(self, old_df: pd.DataFrame, added_at: int=None):
+        """
+        Remove compounds that were added before and refresh the model
+        :param old_df: A Pandas DataFrame with exactly the rows that were added
+        :param added_at: The update number the rows were added at (0 for the initial data), needed with decay
+        """
+        weight = 1.0
+        if self.decay is not None:
+            if added_at is None:
+                raise AssertionError("pMPO removal with decay needs the update number the rows were added at")
+            weight = self.decay ** (self.updates - added_at)
+        X, good_mask = self._chunk_arrays(old_df)
+        self.moments.remove(X, good_mask, ~good_mask, weight=weight)
+        self.comoments.remove(X, weight=weight)
+        self.nrows -= len(old_df)
+        self.refresh()
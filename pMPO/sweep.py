@@ -0,0 +1,100 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import itertools
+import typing
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from pMPO.pMPO import evaluate_good_values, numeric_column_iterator, descriptor_statistics_from_mask, \
+    finalize_descriptor_statistics, pairwise_r2, greedy_uncorrelated_selection, annotate_selected_columns, \
+    model_from_statistics
+from pMPO.resampling import roc_auc
+
+########################################################################################################################
+# Sweeps over the pMPO cutoffs
+# The per-descriptor statistics and the r^2 matrix of the descriptors significant at the loosest p_cutoff are computed
+# once. Every grid point then only redoes the cheap stages that depend on it:
+#   p_cutoff  -> the significant descriptors (a subset of the candidates, r^2 values are looked up by name)
+#   q_cutoff  -> the c parameters of the sigmoidal functions
+#   r2_cutoff -> the greedy selection of uncorrelated descriptors
+########################################################################################################################
+
+
+def sweep_cutoffs(df: pd.DataFrame, good_column: str, model_name: str='pMPO', good_value='default',
+                  p_cutoffs: typing.Sequence[float]=(0.01,), q_cutoffs: typing.Sequence[float]=(0.05,),
+                  r2_cutoffs: typing.Sequence[float]=(0.53,), min_samples=10, sigmoidal_correction=True,
+                  case_insensitive=True, metric: typing.Callable=roc_auc, n_jobs: int=1) -> pd.DataFrame:
+    """
+    Build the pMPO model of every combination of p_cutoff, q_cutoff and r2_cutoff from one set of statistics
+    :param df: Input DataFrame with good molecules, bad molecules, and data (not modified)
+    :param good_column: Input DataFrame column that distinguishes good from bad values
+    :param model_name: Name of the pMPO models
+    :param good_value: Criteria to evaluate good from bad molecules ('default', str, callable)
+    :param p_cutoffs: The p-value cutoffs to try
+    :param q_cutoffs: The q-value cutoffs to try
+    :param r2_cutoffs: The r^2 cutoffs to try
+    :param min_samples: The minimum number of samples with good or bad data to calculate p-value statistics
+    :param sigmoidal_correction: Use the sigmoidal correction to the weighted Gaussian scores
+    :param case_insensitive: Whether the models should be case insensitive to the descriptor keys
+    :param metric: Function of the (scores, labels) of the input molecules [default: the ROC AUC]
+    :param n_jobs: Number of worker processes for the descriptor statistics (-1 uses all CPUs)
+    :return: A Pandas DataFrame with one row per configuration: the cutoffs, the number of significant and selected
+             descriptors, the selected descriptors, their weights and the metric
+    """
+    labels = evaluate_good_values(df[good_column], good_value)
+    columns = list(numeric_column_iterator(df))
+    # Stage 1: the per-descriptor statistics, independent of all the cutoffs
+    base_stats = descriptor_statistics_from_mask(df, columns, labels, ~labels, min_samples=min_samples,
+                                                 p_cutoff=max(p_cutoffs), q_cutoff=q_cutoffs[0], n_jobs=n_jobs)
+    # Stage 2: the r^2 matrix of the descriptors significant at the loosest p_cutoff
+    candidates = base_stats[(base_stats.significant == True)].name.values.tolist()
+    r2 = pairwise_r2(df, candidates)
+    positions = {name: idx for idx, name in enumerate(candidates)}
+    X = np.column_stack([df[col].values.astype(np.float64) for col in candidates]) if candidates else \
+        np.empty((len(df), 0))
+    selections = {}
+    records = []
+    for p_cutoff, q_cutoff in itertools.product(p_cutoffs, q_cutoffs):
+        column_stats = finalize_descriptor_statistics(base_stats.copy(), p_cutoff=p_cutoff, q_cutoff=q_cutoff)
+        significant_names = column_stats[(column_stats.significant == True)].name.values.tolist()
+        # Look the r^2 values up by name, the significant descriptors are a subset of the candidates
+        k = len(significant_names)
+        idx = [positions[name] for name in significant_names]
+        for r2_cutoff in r2_cutoffs:
+            if (p_cutoff, r2_cutoff) not in selections:
+                selections[(p_cutoff, r2_cutoff)] = greedy_uncorrelated_selection(significant_names,
+                                                                                  r2[np.ix_(idx, idx)], r2_cutoff)
+            annotate_selected_columns(column_stats, selections[(p_cutoff, r2_cutoff)])
+            selected = column_stats[(column_stats.selected == True)]
+            model = model_from_statistics(column_stats, model_name, sigmoidal_correction=sigmoidal_correction,
+                                          case_insensitive=case_insensitive).compile()
+            records.append(OrderedDict([('p_cutoff', p_cutoff),
+                                        ('q_cutoff', q_cutoff),
+                                        ('r2_cutoff', r2_cutoff),
+                                        ('n_significant', k),
+                                        ('n_selected', len(selected)),
+                                        ('selected', selected.name.tolist()),
+                                        ('weights', OrderedDict(zip(selected.name, selected.w))),
+                                        ('metric', metric(model.score_array(X, candidates), labels))]))
+    return pd.DataFrame(records, columns=['p_cutoff', 'q_cutoff', 'r2_cutoff', 'n_significant', 'n_selected',
+                                          'selected', 'weights', 'metric'])
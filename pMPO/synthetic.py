@@ -0,0 +1,79 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import typing
+import numpy as np
+import pandas as pd
+
+########################################################################################################################
+# Synthetic labelled descriptor tables for benchmarks and tests
+# Descriptors come in blocks sharing a latent factor, so descriptors in the same block have the requested pairwise
+# correlation and descriptors in different blocks are independent. A fraction of the descriptors is shifted for the good
+# molecules so there is something for the pMPO to find
+########################################################################################################################
+
+
+def make_descriptor_table(nrows: int=10000, ncolumns: int=100, missing_rate: float=0.05, correlation: float=0.5,
+                          block_size: int=10, good_fraction: float=0.4, informative_fraction: float=0.2,
+                          effect_size: float=0.5, good_column: str='good', random_state=None,
+                          return_informative: bool=False) \
+        -> typing.Union[pd.DataFrame, typing.Tuple[pd.DataFrame, typing.List[str]]]:
+    """
+    Generate a synthetic table of labelled descriptors
+    :param nrows: The number of molecules
+    :param ncolumns: The number of descriptor columns
+    :param missing_rate: The fraction of descriptor values replaced by NaN
+    :param correlation: The pairwise correlation of descriptors in the same block (0 <= correlation < 1)
+    :param block_size: The number of descriptors sharing a latent factor
+    :param good_fraction: The expected fraction of good molecules
+    :param informative_fraction: The fraction of descriptors whose mean differs between good and bad molecules
+    :param effect_size: The difference of the means of the informative descriptors, in standard deviations
+    :param good_column: The name of the boolean label column
+    :param random_state: Seed or np.random.RandomState
+    :param return_informative: Also return the names of the informative descriptors
+    :return: The Pandas DataFrame (and the informative descriptor names when return_informative)
+    """
+    if not 0.0 <= correlation < 1.0:
+        raise AssertionError("correlation must be in [0, 1), got {}".format(correlation))
+    if block_size < 1:
+        raise AssertionError("block_size must be at least 1, got {}".format(block_size))
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    labels = rng.rand(nrows) < good_fraction
+    X = rng.standard_normal((nrows, ncolumns))
+    X *= np.sqrt(1.0 - correlation)
+    for start in range(0, ncolumns, block_size):
+        X[:, start:start + block_size] += np.sqrt(correlation) * rng.standard_normal((nrows, 1))
+    informative = np.sort(rng.choice(ncolumns, int(round(informative_fraction * ncolumns)), replace=False))
+    signs = rng.choice([-1.0, 1.0], len(informative))
+    for idx, sign in zip(informative, signs):
+        X[labels, idx] += sign * effect_size
+    # Give every descriptor its own scale and offset, like real descriptors
+    X *= rng.uniform(0.5, 50.0, ncolumns)
+    X += rng.uniform(-10.0, 300.0, ncolumns)
+    if missing_rate > 0:
+        X[rng.rand(nrows, ncolumns) < missing_rate] = np.nan
+    names = ['D{:0{}d}'.format(idx, len(str(max(ncolumns - 1, 0)))) for idx in range(ncolumns)]
+    df = pd.DataFrame(X, columns=names)
+    df[good_column] = labels
+    if return_informative:
+        return df, [names[idx] for idx in informative]
+    return df
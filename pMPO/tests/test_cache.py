@@ -0,0 +1,95 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.cache import StageCache, fingerprint
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_stage_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test001_repeat_build_hits(self):
+        """
+        A repeat build loads both stages from the cache and gives the same statistics, correlation and model
+        """
+        for idx, options in enumerate(({}, {'lazy_correlation': True}, {'lean': True})):
+            cache = StageCache(os.path.join(self.directory, str(idx)))
+            first = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', cache=cache, **options)
+            second = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', cache=cache, **options)
+            self.assertEqual(list(first.cache_events.values()), ['miss', 'miss'])
+            self.assertEqual(list(second.cache_events.values()), ['hit', 'hit'])
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            pd.testing.assert_frame_equal(first.statistics, second.statistics)
+            pd.testing.assert_frame_equal(first.correlation, second.correlation)
+            self.assertEqual(str(first.model), str(second.model))
+
+    def test002_fingerprint_changes(self):
+        """
+        Changing a parameter only misses the dependent stages and changing the data misses every stage
+        """
+        pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', cache=self.directory)
+        builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', cache=self.directory,
+                              r2_cutoff=0.3)
+        self.assertEqual(list(builder.cache_events.values()), ['hit', 'miss'])
+        changed = self.df.copy()
+        changed.loc[changed.index[0], 'TPSA'] += 1.0
+        builder = pMPOBuilder(changed, good_column='CNS', model_name='CNS pMPO', cache=self.directory)
+        self.assertEqual(list(builder.cache_events.values()), ['miss', 'miss'])
+        self.assertNotEqual(fingerprint(self.df[['TPSA']]), fingerprint(changed[['TPSA']]))
+
+    def test003_lru_eviction(self):
+        """
+        Entries above the size limit are evicted least recently used first
+        """
+        cache = StageCache(self.directory, max_bytes=10 ** 9)
+        frames = [pd.DataFrame({'x': np.arange(1000, dtype=np.float64) + i}) for i in range(3)]
+        for i, df in enumerate(frames):
+            self.assertTrue(cache.put('stage', str(i), df))
+            os.utime(cache.path('stage', str(i)), (i, i))
+        # Using the oldest entry makes the second one the least recently used
+        pd.testing.assert_frame_equal(cache.get('stage', '0'), frames[0])
+        cache.max_bytes = cache.size() - 1
+        cache.evict()
+        self.assertIsNone(cache.get('stage', '1'))
+        self.assertIsNotNone(cache.get('stage', '0'))
+        self.assertIsNotNone(cache.get('stage', '2'))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
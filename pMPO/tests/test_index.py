@@ -0,0 +1,103 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.index import DescriptorIndex, term_interval, term_log
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_descriptor_index(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.model = pMPOBuilder(df.copy(), good_column='CNS', model_name='CNS pMPO').model
+        columns = ['TPSA', 'HBD', 'MW', 'cLogD_ACD_v15', 'mbpKa']
+        rng = np.random.RandomState(7)
+        library = df[columns].sample(20000, replace=True, random_state=rng).reset_index(drop=True)
+        library += rng.normal(size=library.shape) * np.array([10.0, 1.0, 50.0, 1.0, 1.0])
+        library.loc[rng.rand(len(library)) < 0.05, 'TPSA'] = np.nan
+        cls.library = library
+        cls.scores = cls.model.score_frame(library).values
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test001_term_interval(self):
+        """
+        A term reaches a level exactly within the interval found for it
+        """
+        compiled = self.model.compile()
+        for idx in range(len(compiled.descriptors)):
+            params = compiled.parameters[:, idx]
+            level = params[0] * 0.5
+            low, high = term_interval(level, *params)
+            x = np.linspace(low - 3 * (high - low), high + 3 * (high - low), 10001)
+            reached = np.exp(term_log(x, *params)) >= level
+            self.assertTrue(np.all((x[reached] >= low) & (x[reached] <= high)))
+            self.assertTrue(reached[(x > low + 1e-6 * (high - low)) & (x < high - 1e-6 * (high - low))].all())
+            self.assertIsNone(term_interval(params[0] * 1.01, *params))
+
+    def test002_queries_match_a_full_scan(self):
+        """
+        Threshold queries return exactly the rows a full scan finds, while scoring fewer rows
+        """
+        DescriptorIndex.build(self.directory, self.library)
+        index = DescriptorIndex(self.directory)
+        self.assertEqual(len(index), len(self.library))
+        self.assertEqual(index.columns, list(self.library.columns))
+        for threshold in (0.3, 0.7, 0.9, 1.5):
+            result = index.query(self.model, threshold)
+            expected = np.flatnonzero(self.scores >= threshold)
+            self.assertEqual(sorted(result.rows), list(expected))
+            self.assertTrue(np.allclose(result.scores, self.scores[result.rows], rtol=1e-12))
+            self.assertTrue(np.all(np.diff(result.scores) <= 0.0))
+        result = index.query(self.model, 0.9)
+        self.assertIsNotNone(result.stats['driver'])
+        self.assertLess(result.stats['scored'], len(self.library) / 5)
+        self.assertTrue(index.plan(self.model, 1.5)['empty'])
+        self.assertIsNone(index.plan(self.model, 0.1)['driver'])
+
+    def test003_array_index(self):
+        """
+        An index built from a 2D array (missing a model descriptor) answers the same as scoring the array
+        """
+        columns = ['tpsa', 'hbd', 'mw', 'clogd_acd_v15']
+        X = self.library.values[:, :4]
+        index = DescriptorIndex.build(self.directory, X, columns=columns)
+        scores = self.model.score_array(X, columns)
+        result = index.query(self.model, 0.6)
+        self.assertEqual(sorted(result.rows), list(np.flatnonzero(scores >= 0.6)))
+        rows = index.rows_between('hbd', 0.0, 1.0)
+        self.assertEqual(sorted(rows), list(np.flatnonzero((X[:, 1] >= 0.0) & (X[:, 1] <= 1.0))))
+        self.assertTrue(np.all(np.diff(X[rows, 1]) >= 0.0))
@@ -0,0 +1,81 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.lookup import ExactTable, InterpolatedTable
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_lookup_tables(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.model = pMPOBuilder(df.copy(), good_column='CNS', model_name='CNS pMPO').model
+        cls.columns = ['TPSA', 'HBD', 'MW', 'cLogD_ACD_v15', 'mbpKa']
+        rng = np.random.RandomState(3)
+        library = df[cls.columns].sample(20000, replace=True, random_state=rng).reset_index(drop=True)
+        library[['MW', 'cLogD_ACD_v15', 'mbpKa']] += rng.normal(size=(len(library), 3)) * [20.0, 0.5, 0.5]
+        library['TPSA'] = (library.TPSA + rng.normal(scale=5.0, size=len(library))).round(2)
+        library.loc[rng.rand(len(library)) < 0.05, 'MW'] = np.nan
+        cls.library = library
+        cls.scores = cls.model.score_frame(library).values
+
+    def test001_interpolated_error_bound(self):
+        """
+        Interpolated tables keep every score within max_error of the exact score
+        """
+        for max_error in (1e-3, 1e-5):
+            tabulated = self.model.tabulate(max_error=max_error)
+            self.assertTrue(all(isinstance(table, InterpolatedTable) for table in tabulated.tables))
+            self.assertLessEqual(tabulated.max_error, max_error * (1 + 1e-9))
+            scores = tabulated.score_frame(self.library).values
+            self.assertLessEqual(np.max(np.abs(scores - self.scores)), tabulated.max_error)
+            self.assertAlmostEqual(tabulated(TPSA=50.0, HBD=1, MW=300.0), self.model(TPSA=50.0, HBD=1, MW=300.0),
+                                   delta=max_error)
+            self.assertEqual(tabulated(unknown=1.0), 0.0)
+
+    def test002_exact_tables(self):
+        """
+        Descriptors on a fixed grid are looked up exactly, off-grid values are evaluated exactly
+        """
+        tabulated = self.model.compile().tabulate(steps={'hbd': 1, 'TPSA': 0.01}, max_error=1e-6)
+        errors = tabulated.errors
+        self.assertEqual((errors['HBD'], errors['TPSA']), (0.0, 0.0))
+        self.assertIsInstance(tabulated.tables[tabulated.descriptors.index('HBD')], ExactTable)
+        exact_only = self.model.tabulate(steps={key: 0.01 for key in self.columns})
+        self.assertEqual(exact_only.max_error, 0.0)
+        off_grid = self.library[self.columns].values + np.array([0.0, 0.5, 0.001, 0.0001, 0.0])
+        self.assertTrue(np.allclose(exact_only.score_array(off_grid, self.columns),
+                                    self.model.score_array(off_grid, self.columns), rtol=0, atol=1e-12))
+        report = tabulated.benchmark(self.library.values, self.columns, repeat=1)
+        self.assertEqual(report['rows'], len(self.library))
+        self.assertLessEqual(report['observed_error'], report['max_error'])
+        self.assertGreater(report['speedup'], 0.0)
+        with self.assertRaises(KeyError):
+            self.model.tabulate(steps={'unknown': 1})
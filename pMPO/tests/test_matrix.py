@@ -0,0 +1,135 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.pMPO import calculate_descriptor_statistics
+from pMPO.runtime import ModelBank
+from pMPO.matrix import DescriptorMatrix, score_matrix
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME, assert_progress_events
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_descriptor_matrix(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.builder = pMPOBuilder(cls.df.copy(), good_column='CNS', model_name='CNS pMPO')
+        cls.model = cls.builder.model
+        cls.columns = [col for col in cls.df.columns if cls.df[col].dtype == np.float64]
+        cls.expected = cls.model.score_frame(cls.df[cls.columns]).values
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def _assert_same_build(self, expected: pMPOBuilder, actual: pMPOBuilder):
+        self.assertEqual(list(expected.statistics.name), list(actual.statistics.name))
+        for col in ('p_value', 'good_mean', 'good_std', 'bad_mean', 'bad_std', 'cutoff', 'b', 'c', 'z', 'w'):
+            self.assertTrue(np.allclose(expected.statistics[col].values.astype(float),
+                                        actual.statistics[col].values.astype(float), rtol=1e-9, equal_nan=True), col)
+        self.assertTrue(np.allclose(expected.correlation.values, actual.correlation.values, atol=1e-10))
+        self.assertEqual(str(expected.model), str(actual.model))
+
+    def test001_memmap_scoring(self):
+        """
+        score_array reads memory-mapped matrix files and raw buffers block by block like the equivalent DataFrame
+        """
+        path = os.path.join(self.directory, 'descriptors.f64')
+        header = os.path.join(self.directory, 'descriptors.txt')
+        self.df[self.columns].values.astype(np.float64).tofile(path)
+        with open(header, 'w') as f:
+            f.write('\n'.join(self.columns) + '\n')
+        matrix = DescriptorMatrix.open(path, header, dtype='float64')
+        self.assertEqual((len(matrix), matrix.kind), (len(self.df), 'array'))
+        self.assertTrue(np.allclose(self.model.score_array(matrix), self.expected, rtol=1e-12))
+        self.assertTrue(np.allclose(self.model.compile().score_array(matrix.data, self.columns), self.expected,
+                                    rtol=1e-12))
+        tabulated = self.model.tabulate()
+        self.assertLessEqual(np.max(np.abs(tabulated.score_array(matrix) - self.expected)), tabulated.max_error)
+        out = np.empty(len(self.df))
+        self.assertIs(score_matrix(self.model, matrix, block_rows=100, out=out), out)
+        self.assertTrue(np.allclose(out, self.expected, rtol=1e-12))
+        buffer = self.df[self.columns].values.astype(np.float32).tobytes()
+        self.assertTrue(np.allclose(self.model.score_array(buffer, self.columns), self.expected, rtol=1e-4))
+        bank = ModelBank([self.model, pMPOBuilder(self.df.copy(), good_column='CNS', model_name='Copy').model])
+        scores = bank.score_array(matrix)
+        self.assertEqual(scores.shape, (len(self.df), 2))
+        self.assertTrue(np.allclose(scores, self.expected[:, np.newaxis], rtol=1e-12))
+        with self.assertRaises(AssertionError):
+            DescriptorMatrix(buffer[:-4], self.columns)
+        with self.assertRaises(AssertionError):
+            DescriptorMatrix.open(path, self.columns[:-1] + ['extra', 'extra2'])
+        with self.assertRaises(AssertionError):
+            self.model.score_array(buffer)
+
+    def test002_matrix_build(self):
+        """
+        pMPOBuilder and calculate_descriptor_statistics read a matrix block by block and match the DataFrame
+        """
+        X = np.column_stack([self.df[self.columns].values, self.df.CNS.values.astype(np.float64)])
+        matrix = DescriptorMatrix(X, self.columns + ['CNS'])
+        stats = calculate_descriptor_statistics(matrix, 'CNS')
+        expected = calculate_descriptor_statistics(self.df, 'CNS')
+        self.assertEqual(list(stats.name), list(expected.name))
+        for col in ('good_mean', 'bad_mean', 'good_std', 'bad_std', 'p_value', 'cutoff'):
+            self.assertTrue(np.allclose(stats[col].values, expected[col].values, rtol=1e-9), col)
+        events = []
+        builder = pMPOBuilder(matrix, good_column='CNS', model_name='CNS pMPO', progress=events.append)
+        self.assertIs(builder.df, matrix)
+        assert_progress_events(self, events)
+        self.assertIn({'stage': 'statistics', 'done': len(self.df), 'total': len(self.df), 'unit': 'rows'}, events)
+        self._assert_same_build(self.builder, builder)
+        lean = pMPOBuilder(matrix, good_column='CNS', model_name='CNS pMPO', lean=True)
+        self.assertEqual(str(lean.model), str(self.model))
+        with self.assertRaises(AssertionError):
+            pMPOBuilder(matrix, good_column='CNS', model_name='CNS pMPO', lazy_correlation=True)
+        with self.assertRaises(AssertionError):
+            pMPOBuilder(X, good_column='CNS', model_name='CNS pMPO')
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test003_arrow(self):
+        """
+        Arrow tables and record batches are read column by column by score_array and pMPOBuilder
+        """
+        frame = self.df[self.columns + ['CNS', 'SMILES']].copy()
+        frame.loc[frame.index[::7], 'MW'] = np.nan
+        table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+        expected = self.model.score_frame(frame).values
+        self.assertTrue(np.allclose(self.model.score_array(table), expected, rtol=1e-12))
+        self.assertTrue(np.allclose(self.model.compile().score_array(table.to_batches()[0]), expected, rtol=1e-12))
+        builder = pMPOBuilder(table, good_column='CNS', model_name='CNS pMPO')
+        self._assert_same_build(pMPOBuilder(frame.copy(), good_column='CNS', model_name='CNS pMPO'), builder)
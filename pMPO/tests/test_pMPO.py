@@ -24,9 +24,14 @@ import unittest
 import csv
 import os
 import pickle
+import tracemalloc
+import numpy as np
 import pandas as pd
 from io import StringIO
 from pMPO import pMPOBuilder
+from pMPO.pMPO import calculate_descriptor_statistics, pick_uncorrelated_columns, create_boolean_evaluator, \
+    evaluate_good_values, ModelBank, BuildCancelled, ScoreCache, LazyCorrelation
+from pMPO.runtime import deduplicate_rows
 
 ########################################################################################################################
 ########################################################################################################################
@@ -726,6 +731,34 @@ def _read_csv_to_dict(csv_text: str) -> dict:
 
 REFERENCE_INTERMEDIATE_VALUES = _read_csv_to_dict(REFERENCE_INTERMEDIATE_VALUES_CSV)
 
+
+def split_progress_events(events: list) -> list:
+    """
+    Split builder progress events into the runs of consecutive events of one stage
+    :param events: The progress event dictionaries
+    :return: A list of (stage, events) tuples
+    """
+    runs = []
+    for event in events:
+        if not runs or runs[-1][0] != event['stage'] or event['done'] == 0:
+            runs.append((event['stage'], []))
+        runs[-1][1].append(event)
+    return runs
+
+
+def assert_progress_events(test: unittest.TestCase, events: list):
+    """
+    Each stage starts at 0, counts in one unit against one total, never goes past the total or back, and ends once
+    """
+    for stage, stage_events in split_progress_events(events):
+        test.assertEqual(stage_events[0]['done'], 0, stage)
+        test.assertEqual(len({(event['unit'], event['total']) for event in stage_events}), 1, stage)
+        done = [event['done'] for event in stage_events]
+        test.assertEqual(done, sorted(done), stage)
+        test.assertEqual(len(done[1:]), len(set(done[1:])), stage)
+        if stage_events[0]['total'] is not None:
+            test.assertEqual(done[-1], stage_events[0]['total'], stage)
+
 ########################################################################################################################
 ########################################################################################################################
 
@@ -878,3 +911,367 @@ class test_suite002_behavior(unittest.TestCase):
         equations = self.model.equations
         for descriptor in self.model.descriptors:
             self.assertIn(descriptor, equations)
+
+
+class test_suite003_batch_scoring(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.model = pMPOBuilder(self.df, good_column='CNS', model_name='CNS pMPO', sigmoidal_correction=False).model
+        self.sig_model = pMPOBuilder(self.df, good_column='CNS', model_name='CNS pMPO SIG').model
+
+    def test015_score_frame_matches_scalar(self):
+        """
+        Batch scoring a DataFrame gives the same numbers as scoring row by row
+        """
+        for model in (self.model, self.sig_model):
+            scores = model.score_frame(self.df)
+            self.assertTrue(scores.index.equals(self.df.index))
+            for idx, row in self.df.iterrows():
+                row_data = row.to_dict()
+                row_data.pop('Drug')
+                self.assertAlmostEqual(model(**row_data), scores[idx], places=12)
+
+    def test016_score_array_missing_values(self):
+        """
+        Missing values and missing columns contribute 0.0 to the batch score
+        """
+        X = np.array([[50.0, 1.0, np.nan],
+                      [np.nan, np.nan, np.nan]])
+        scores = self.sig_model.score_array(X, ['tpsa', 'HBD', 'IRRELEVANT'])
+        self.assertAlmostEqual(scores[0], self.sig_model(TPSA=50.0, HBD=1.0), places=12)
+        self.assertEqual(scores[1], 0.0)
+        with self.assertRaises(AssertionError):
+            self.sig_model.score_array(X, ['TPSA'])
+
+    def test017_compiled_model_matches(self):
+        """
+        The compiled array-backed model scores the same as the original model
+        """
+        for model in (self.model, self.sig_model):
+            compiled = model.compile()
+            self.assertEqual(compiled.descriptors, tuple(model.descriptors))
+            self.assertTrue(np.allclose(compiled.score_frame(self.df).values, model.score_frame(self.df).values,
+                                        rtol=1e-12, atol=1e-12))
+            self.assertAlmostEqual(compiled(TPSA=50.0, hbd=1.0), model(TPSA=50.0, hbd=1.0), places=12)
+
+    def test018_compiled_model_immutable_and_compact(self):
+        """
+        The compiled model cannot be modified and pickles into a small payload
+        """
+        compiled = self.sig_model.compile()
+        with self.assertRaises(AttributeError):
+            compiled.name = 'other'
+        with self.assertRaises(ValueError):
+            compiled.weights[0] = 1.0
+        serialized_model = pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(serialized_model), 1000)
+        unserialized_model = pickle.loads(serialized_model)
+        self.assertEqual(compiled.descriptors, unserialized_model.descriptors)
+        self.assertTrue(np.array_equal(compiled.parameters, unserialized_model.parameters))
+
+
+class test_suite004_descriptor_statistics(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+
+    def test019_vectorized_matches_columnwise(self):
+        """
+        The vectorized statistics engine reproduces the column-by-column t-tests
+        """
+        columnwise = calculate_descriptor_statistics(self.df, 'CNS', engine='columnwise')
+        vectorized = calculate_descriptor_statistics(self.df, 'CNS', engine='vectorized')
+        self.assertEqual(list(columnwise.columns), list(vectorized.columns))
+        self.assertEqual(list(columnwise.name), list(vectorized.name))
+        self.assertTrue(columnwise.index.equals(vectorized.index))
+        self.assertTrue(columnwise.dtypes.equals(vectorized.dtypes))
+        for col in columnwise.columns.drop('name'):
+            self.assertTrue(np.allclose(columnwise[col].values.astype(float), vectorized[col].values.astype(float),
+                                        rtol=1e-9, atol=0.0, equal_nan=True), col)
+
+    def test020_unknown_engine(self):
+        with self.assertRaises(KeyError):
+            calculate_descriptor_statistics(self.df, 'CNS', engine='I DO NOT EXIST')
+
+
+class test_suite005_descriptor_selection(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO')
+
+    def test021_lazy_correlation(self):
+        """
+        Lazy correlation selects the same descriptors and only computes the selected columns
+        """
+        lazy_builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', lazy_correlation=True)
+        self.assertEqual(list(self.builder.statistics.selected), list(lazy_builder.statistics.selected))
+        self.assertTrue(np.allclose(self.builder.statistics.w, lazy_builder.statistics.w, equal_nan=True))
+        self.assertEqual(str(self.builder.model), str(lazy_builder.model))
+        partial = lazy_builder.correlation
+        selected = lazy_builder.statistics[lazy_builder.statistics.selected].name.tolist()
+        self.assertEqual(sorted(partial.columns), sorted(selected))
+        self.assertEqual(list(partial.index), list(self.builder.correlation.index))
+        full = self.builder.correlation.loc[partial.index, partial.columns]
+        computed = ~np.isnan(partial.values)
+        self.assertTrue(computed.any())
+        self.assertTrue(np.allclose(partial.values[computed], full.values[computed], atol=1e-12))
+        # Centering the candidates a few columns at a time gives the same correlations
+        names = list(self.builder.correlation.index)
+        correlation = LazyCorrelation(self.df, names, block_columns=2)
+        for name in names:
+            self.assertTrue(np.allclose(correlation.r2(name)[names.index(name):],
+                                        self.builder.correlation[name].values[names.index(name):], atol=1e-12))
+
+    def test022_array_selection_matches_label_lookups(self):
+        """
+        The array-based greedy selection picks the same descriptors as pairwise label lookups
+        """
+        rng = np.random.RandomState(42)
+        nrows, ncolumns = 300, 60
+        labels = rng.rand(nrows) < 0.5
+        latent = rng.normal(size=(nrows, 8))
+        X = latent[:, rng.randint(0, 8, ncolumns)] + 0.5 * rng.normal(size=(nrows, ncolumns)) + \
+            rng.rand(ncolumns) * labels[:, np.newaxis]
+        df = pd.DataFrame(X, columns=['desc{}'.format(i) for i in range(ncolumns)])
+        df['label'] = labels
+        column_stats = calculate_descriptor_statistics(df, 'label')
+        desc_correlation = pick_uncorrelated_columns(df, column_stats, r2_cutoff=0.3)
+        # Reference: the greedy selection written with label lookups
+        selected = set()
+        for this_desc in column_stats[column_stats.significant].name:
+            if not any(desc_correlation[this_desc][that_desc] > 0.3 for that_desc in selected):
+                selected.add(this_desc)
+        self.assertGreater(len(selected), 1)
+        self.assertLess(len(selected), column_stats.significant.sum())
+        self.assertEqual(set(column_stats[column_stats.selected].name), selected)
+        self.assertAlmostEqual(column_stats.w.sum(), 1.0)
+
+
+class test_suite006_input_handling(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+
+    def test023_vectorized_good_values(self):
+        """
+        Vectorized good value evaluation agrees with the per-value evaluator
+        """
+        columns = (pd.Series([True, False, True]),
+                   pd.Series([1, 0, 2, 1]),
+                   pd.Series([1.0, 0.0, np.nan]),
+                   pd.Series(['yes', 'no', 'Active', 'GOOD', '1', 'false', None]))
+        for column in columns:
+            expected = np.vectorize(create_boolean_evaluator('default'), otypes=[bool])(column)
+            self.assertEqual(list(evaluate_good_values(column)), list(expected))
+        column = pd.Series(['x', 'y', 'x'])
+        self.assertEqual(list(evaluate_good_values(column, 'x')), [True, False, True])
+        # Callables take one value at a time unless they are declared vectorized
+        self.assertEqual(list(evaluate_good_values(pd.Series([1.0, 5.0]), lambda x: x > 2)), [False, True])
+        self.assertEqual(list(evaluate_good_values(column, lambda x: x.startswith('x'))), [True, False, True])
+        self.assertEqual(list(evaluate_good_values(pd.Series([1.0, 5.0]), lambda x: x > 2, vectorized=True)),
+                         [False, True])
+        # Scalar callables are never given the Series, whatever its index
+        indexed = pd.Series(['AB', 'BA', 'AA'], index=[10, 11, 12])
+        self.assertEqual(list(evaluate_good_values(indexed, lambda x: x[0] == 'A')), [True, False, True])
+        self.assertEqual(list(evaluate_good_values(pd.Series(['AB', 'B'], index=[0, 5]), lambda x: x[0] == 'A')),
+                         [True, False])
+        with self.assertRaises(AssertionError):
+            evaluate_good_values(indexed, lambda x: True, vectorized=True)
+
+    def test024_non_mutating_builder(self):
+        """
+        A builder with inplace=False leaves the input DataFrame untouched and builds the same model
+        """
+        original = self.df.copy()
+        builder = pMPOBuilder(self.df, good_column='CNS', model_name='CNS pMPO', inplace=False)
+        self.assertTrue(self.df.equals(original))
+        self.assertNotIn('pMPO_POSITIVE', self.df.columns)
+        self.assertEqual(list(builder.labels), list(original.CNS))
+        reference = pMPOBuilder(original, good_column='CNS', model_name='CNS pMPO')
+        self.assertIn('pMPO_POSITIVE', original.columns)
+        self.assertTrue(builder.statistics.equals(reference.statistics))
+        self.assertEqual(str(builder.model), str(reference.model))
+
+    def test025_lean_builder(self):
+        """
+        A lean builder builds the same model, keeps a compact correlation and releases the input data
+        """
+        original = self.df.copy()
+        lean_builder = pMPOBuilder(self.df, good_column='CNS', model_name='CNS pMPO', lean=True)
+        reference = pMPOBuilder(original, good_column='CNS', model_name='CNS pMPO')
+        self.assertNotIn('pMPO_POSITIVE', self.df.columns)
+        self.assertIsNone(lean_builder.df)
+        self.assertEqual(str(lean_builder.model), str(reference.model))
+        d = len(reference.correlation)
+        self.assertEqual(lean_builder.descriptor_corr_condensed.dtype, np.float32)
+        self.assertEqual(len(lean_builder.descriptor_corr_condensed), d * (d - 1) // 2)
+        self.assertTrue(np.allclose(lean_builder.correlation.values, reference.correlation.values, atol=1e-5))
+        self.assertTrue(lean_builder.correlation.index.equals(reference.correlation.index))
+        self.assertLess(len(pickle.dumps(lean_builder)), len(pickle.dumps(reference)) / 10)
+
+
+class test_suite007_model_bank(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.models = [pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO').model,
+                       pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO (no sigmoid)',
+                                   sigmoidal_correction=False).model,
+                       pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO (strict)', p_cutoff=1e-6,
+                                   r2_cutoff=0.2, case_insensitive=False).model]
+
+    def test026_bank_matches_models(self):
+        """
+        A ModelBank scores every model in one pass with the same results as the models one by one
+        """
+        bank = ModelBank(self.models)
+        self.assertEqual(len(bank), 3)
+        self.assertLessEqual(len(bank.descriptors), sum(len(model.descriptors) for model in self.models))
+        scores = bank.score_frame(self.df)
+        self.assertEqual(list(scores.columns), [model.name for model in self.models])
+        for model in self.models:
+            self.assertTrue(np.allclose(scores[model.name].values, model.score_frame(self.df).values, rtol=1e-12))
+        columns = ['TPSA', 'mbpKa', 'MW', 'HBD', 'cLogD_ACD_v15']
+        self.assertTrue(np.allclose(bank.score_array(self.df[columns].values, columns),
+                                    scores.values, rtol=1e-12))
+
+    def test027_bank_lookups(self):
+        """
+        Each model in a ModelBank keeps its own case sensitivity and missing descriptors contribute 0.0
+        """
+        bank = ModelBank(self.models)
+        molecule = {'tpsa': 50.0, 'MBPKA': 8.0, 'mw': 300.0}
+        scores = bank(**molecule)
+        for model in self.models:
+            self.assertAlmostEqual(scores[model.name], model(**molecule), places=12)
+        self.assertEqual(bank(**{'unknown': 1.0}), {model.name: 0.0 for model in self.models})
+        with self.assertRaises(AssertionError):
+            ModelBank([self.models[0], self.models[0]])
+
+    def test028_ambiguous_keys(self):
+        """
+        Keys differing only by case are rejected by the compiled models, banks and score caches of a case insensitive
+        model, and exact duplicates by a case sensitive one
+        """
+        compiled = self.models[0].compile()
+        bank = ModelBank(self.models)
+        X = np.array([[50.0, 60.0, 8.0]])
+        for scorer in (compiled, bank, ScoreCache(compiled)):
+            with self.assertRaises(AssertionError):
+                scorer(TPSA=50.0, tpsa=60.0)
+            with self.assertRaises(AssertionError):
+                scorer.score_array(X, ['TPSA', 'tpsa', 'mbpKa'])
+        strict = ModelBank([self.models[2]])
+        strict_descriptor = self.models[2].descriptors[0]
+        self.assertAlmostEqual(strict(**{strict_descriptor: 50.0, strict_descriptor.lower(): 60.0})[strict.names[0]],
+                               self.models[2](**{strict_descriptor: 50.0}), places=12)
+        with self.assertRaises(AssertionError):
+            strict.score_array(X, [strict_descriptor, strict_descriptor, 'mbpKa'])
+        with self.assertRaises(AssertionError):
+            compiled.score_frame(pd.DataFrame(X, columns=['TPSA', 'tpsa', 'mbpKa']))
+
+
+class test_suite008_profiling(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+
+    def test029_stage_profile(self):
+        """
+        The builder records the wall time, CPU time and peak memory of each stage
+        """
+        builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', profile_memory=True)
+        self.assertEqual(list(builder.profile.keys()), ['labels', 'statistics', 'correlation', 'selection'])
+        builder.model
+        self.assertEqual(list(builder.profile.keys())[-1], 'model')
+        for stage, record in builder.profile.items():
+            self.assertEqual(list(record.keys()), ['wall_seconds', 'cpu_seconds', 'peak_bytes'])
+            self.assertGreaterEqual(record['wall_seconds'], 0.0)
+            self.assertGreaterEqual(record['cpu_seconds'], 0.0)
+            self.assertGreaterEqual(record['peak_bytes'], 0)
+        builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO')
+        self.assertIsNone(builder.profile['statistics']['peak_bytes'])
+        # A caller that is already tracing does not see its own earlier peak attributed to the stages
+        tracemalloc.start()
+        try:
+            allocation = np.ones(4 * 1024 * 1024)
+            del allocation
+            builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', profile_memory=True)
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+        for stage, record in builder.profile.items():
+            if hasattr(tracemalloc, 'reset_peak'):
+                self.assertLess(record['peak_bytes'], 8 * 1024 * 1024)
+            else:
+                self.assertIsNone(record['peak_bytes'])
+
+    def test030_progress_and_cancellation(self):
+        """
+        The progress function sees every stage advance to its total and can cancel the build by returning False
+        """
+        events = []
+        builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', progress=events.append)
+        reference = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO')
+        self.assertEqual(str(builder.model), str(reference.model))
+        assert_progress_events(self, events)
+        self.assertEqual([stage for stage, _ in split_progress_events(events)],
+                         ['labels', 'statistics', 'correlation', 'selection', 'model'])
+        statistics = [event for event in events if event['stage'] == 'statistics']
+        self.assertEqual({(event['unit'], event['total']) for event in statistics},
+                         {('columns', len(builder.statistics))})
+        lean_events = []
+        pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', lean=True, progress=lean_events.append)
+        assert_progress_events(self, lean_events)
+        self.assertIn({'stage': 'correlation', 'done': len(self.df), 'total': len(self.df), 'unit': 'rows'},
+                      lean_events)
+        with self.assertRaises(BuildCancelled):
+            pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO',
+                        progress=lambda event: event['stage'] != 'correlation')
+
+
+class test_suite009_score_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.model = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO').model
+
+    def test031_scalar_lru(self):
+        """
+        Repeated descriptor vectors are answered from a bounded LRU cache with the same scores
+        """
+        cache = ScoreCache(self.model, max_entries=2)
+        molecule = {'TPSA': 50.0, 'MBPKA': 8.0, 'mw': 300.0, 'unknown': 1.0}
+        self.assertAlmostEqual(cache(**molecule), self.model(**molecule), places=12)
+        self.assertAlmostEqual(cache(tpsa=50.0, mbpKa=8.0, MW=300.0, HBD=float('nan')), self.model(**molecule),
+                               places=12)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache(TPSA=60.0)
+        cache(TPSA=70.0)
+        cache(**molecule)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 4, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 0.2)
+        rounded = ScoreCache(self.model, decimals=1)
+        self.assertEqual(rounded(TPSA=50.04), rounded(TPSA=49.96))
+        self.assertAlmostEqual(rounded(TPSA=50.04), self.model(TPSA=50.0), places=12)
+        self.assertEqual(rounded.hits, 2)
+
+    def test032_batch_deduplication(self):
+        """
+        The batch path scores each distinct row once and scatters the scores back to every row
+        """
+        repeated = pd.concat([self.df] * 3, ignore_index=True)
+        for model in (self.model, self.model.compile()):
+            cache = ScoreCache(model)
+            scores = cache.score_frame(repeated)
+            self.assertTrue(np.allclose(scores.values, self.model.score_frame(repeated).values, rtol=1e-12))
+            self.assertEqual(cache.rows, len(repeated))
+            self.assertLessEqual(cache.unique_rows, len(self.df))
+            self.assertAlmostEqual(cache.stats()['duplicate_rate'], 1.0 - cache.unique_rows / len(repeated))
+        Z = np.array([[0.0, np.nan], [-0.0, np.nan], [1.0, 2.0], [0.0, np.nan]])
+        first, inverse = deduplicate_rows(Z)
+        self.assertEqual(len(first), 2)
+        self.assertTrue(np.array_equal(inverse, [inverse[0], inverse[0], inverse[2], inverse[0]]))
@@ -0,0 +1,113 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import time
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.pMPO import STATISTICS_BLOCK_COLUMNS, calculate_descriptor_statistics
+from concurrent.futures import ProcessPoolExecutor
+from pMPO.parallel import SharedDescriptorMatrix, cancel_pool, shard_boundaries
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+def _wide_dataframe(nrows: int, ncolumns: int, seed: int=0) -> pd.DataFrame:
+    rng = np.random.RandomState(seed)
+    labels = rng.rand(nrows) < 0.4
+    X = rng.normal(size=(nrows, ncolumns)) + 0.2 * labels[:, np.newaxis]
+    X[rng.rand(nrows, ncolumns) < 0.1] = np.nan
+    df = pd.DataFrame(X, columns=['desc{}'.format(i) for i in range(ncolumns)])
+    df['label'] = labels
+    return df
+
+
+class test_suite001_parallel_statistics(unittest.TestCase):
+
+    def test001_shard_boundaries(self):
+        """
+        Shards cover every column once and start on a statistics block boundary
+        """
+        ncolumns = 5 * STATISTICS_BLOCK_COLUMNS + 7
+        shards = shard_boundaries(ncolumns, 4)
+        self.assertEqual(shards[0][0], 0)
+        self.assertEqual(shards[-1][1], ncolumns)
+        for (_, stop), (start, _) in zip(shards[:-1], shards[1:]):
+            self.assertEqual(stop, start)
+            self.assertEqual(start % STATISTICS_BLOCK_COLUMNS, 0)
+
+    def test002_parallel_matches_serial(self):
+        """
+        The process pool gives exactly the same statistics as the serial path
+        """
+        df = _wide_dataframe(300, 2 * STATISTICS_BLOCK_COLUMNS + 10)
+        serial = calculate_descriptor_statistics(df, 'label')
+        shard_timings = []
+        parallel = calculate_descriptor_statistics(df, 'label', n_jobs=2, shard_timings=shard_timings)
+        self.assertTrue(serial.equals(parallel))
+        self.assertEqual(len(shard_timings), 3)
+        self.assertEqual(sum(t['stop'] - t['start'] for t in shard_timings), 2 * STATISTICS_BLOCK_COLUMNS + 10)
+
+    def test003_parallel_builder(self):
+        """
+        A builder using a process pool produces the same model
+        """
+        df = pd.read_pickle(REFERENCE_DATAFRAME)
+        serial = pMPOBuilder(df, good_column='CNS', model_name='CNS pMPO')
+        parallel = pMPOBuilder(df, good_column='CNS', model_name='CNS pMPO', n_jobs=2)
+        self.assertTrue(serial.statistics.equals(parallel.statistics))
+        self.assertEqual(str(serial.model), str(parallel.model))
+        self.assertEqual(len(parallel.shard_timings), 1)
+
+    def test004_cancel_pool(self):
+        """
+        Cancelling a pool drops the queued work instead of waiting for it
+        """
+        pool = ProcessPoolExecutor(max_workers=1)
+        futures = [pool.submit(time.sleep, 0.2) for _ in range(20)]
+        futures[0].result()
+        started = time.perf_counter()
+        cancel_pool(pool, futures)
+        self.assertLess(time.perf_counter() - started, 2.0)
+        self.assertGreaterEqual(sum(future.cancelled() for future in futures), 15)
+
+    def test005_shared_matrix_released_on_error(self):
+        """
+        A shared matrix whose columns cannot be copied is released instead of leaking its shared memory
+        """
+        created = []
+
+        class RecordingMatrix(SharedDescriptorMatrix):
+            def __init__(self, shape, name=None):
+                super().__init__(shape, name=name)
+                created.append(self.name)
+
+        df = pd.DataFrame({'desc0': [1.0, 2.0], 'text': ['a', 'b']})
+        with self.assertRaises(ValueError):
+            RecordingMatrix.from_frame(df, ['desc0', 'text'])
+        self.assertEqual(len(created), 1)
+        with self.assertRaises(FileNotFoundError):
+            SharedDescriptorMatrix((2, 2), name=created[0])
+
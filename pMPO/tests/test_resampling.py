@@ -0,0 +1,89 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.pMPO import numeric_column_iterator
+from pMPO.resampling import bootstrap_replicates, cross_validation_replicates, fit_replicate, resample_pMPO
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_resampling(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+
+    def test001_weights_match_resampled_frame(self):
+        """
+        A bootstrap replicate built from row weights matches a builder on the resampled copy of the DataFrame
+        """
+        names = list(numeric_column_iterator(self.df))
+        weights, holdout = next(bootstrap_replicates(len(self.df), 1, random_state=3))
+        self.assertTrue(np.all(weights[holdout] == 0))
+        record = fit_replicate(self.df[names].values.astype(np.float64), names, self.df.CNS.values, weights, holdout)
+        resampled = self.df.iloc[np.repeat(np.arange(len(self.df)), weights)].reset_index(drop=True)
+        builder = pMPOBuilder(resampled, good_column='CNS', model_name='CNS pMPO')
+        selected = builder.statistics[(builder.statistics.selected == True)]
+        self.assertEqual(record['selected'], selected.name.tolist())
+        self.assertTrue(np.allclose(list(record['weights'].values()), selected.w.values, rtol=1e-9))
+        self.assertEqual(record['n_train'], len(self.df))
+        self.assertGreater(record['auc'], 0.5)
+
+    def test002_cross_validation_folds(self):
+        """
+        Stratified folds hold out every row exactly once and keep the proportion of good molecules
+        """
+        labels = self.df.CNS.values
+        folds = list(cross_validation_replicates(labels, n_folds=5, random_state=0))
+        self.assertEqual(len(folds), 5)
+        held_out = np.concatenate([holdout for _, holdout in folds])
+        self.assertEqual(sorted(held_out), list(range(len(self.df))))
+        for weights, holdout in folds:
+            self.assertTrue(np.all(weights[holdout] == 0))
+            self.assertEqual(weights.sum() + len(holdout), len(self.df))
+            self.assertLessEqual(abs(labels[holdout].sum() - labels.sum() / 5.0), 1)
+
+    def test003_parallel_matches_serial(self):
+        """
+        The process pool gives the same replicates as the serial run and aggregates the selection frequencies
+        """
+        serial = resample_pMPO(self.df, 'CNS', n_replicates=6, n_jobs=1, random_state=0)
+        parallel = resample_pMPO(self.df, 'CNS', n_replicates=6, n_jobs=2, random_state=0)
+        self.assertTrue(serial.weights.equals(parallel.weights))
+        self.assertTrue(serial.auc.equals(parallel.auc))
+        frequency = serial.selection_frequency
+        self.assertEqual(frequency.index[0], 'MW')
+        self.assertTrue(np.all((frequency >= 0) & (frequency <= 1)))
+        self.assertEqual(list(serial.summary.index), list(frequency[frequency > 0].index))
+        cv = resample_pMPO(self.df, 'CNS', method='cv', n_folds=4, n_repeats=2, n_jobs=1, random_state=0)
+        self.assertEqual(len(cv.replicates), 8)
+        with self.assertRaises(KeyError):
+            resample_pMPO(self.df, 'CNS', method='jackknife')
+
+
+if __name__ == '__main__':
+    unittest.main()
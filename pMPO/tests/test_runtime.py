@@ -0,0 +1,111 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import pandas as pd
+import pMPO
+import pMPO.pMPO
+import pMPO.runtime
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+# The largest fraction of the time to import the builder dependencies (Pandas and SciPy) that importing the scoring
+# runtime may take, both measured in the same interpreter so a slow or loaded machine slows down both
+RUNTIME_IMPORT_BUDGET_FRACTION = 0.25
+# Modules the scoring runtime must never import
+HEAVY_MODULES = ('pandas', 'scipy', 'statsmodels')
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _run_python(code: str) -> dict:
+    """
+    Run code in a fresh interpreter and return the JSON it prints
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGE_ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=PACKAGE_ROOT)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+class test_suite001_runtime(unittest.TestCase):
+
+    def test001_runtime_import_is_light(self):
+        """
+        Loading and evaluating a binary model never imports the builder dependencies
+        """
+        handle, path = tempfile.mkstemp(suffix='.pmpo')
+        os.close(handle)
+        builder = pMPO.pMPOBuilder(pd.read_pickle(REFERENCE_DATAFRAME), good_column='CNS', model_name='CNS pMPO')
+        builder.model.compile().save(path)
+        try:
+            result = _run_python("import json, sys\n"
+                                 "import pMPO\n"
+                                 "from pMPO.serialization import load_model\n"
+                                 "model = load_model({!r})\n"
+                                 "score = model(TPSA=101.88, HBD=3, MW=286.33, cLogD_ACD_v15=0.72, mbpKa=6.53)\n"
+                                 "print(json.dumps({{'score': score, 'modules': sorted(sys.modules)}}))".format(path))
+        finally:
+            os.unlink(path)
+        self.assertAlmostEqual(result['score'], builder.model(TPSA=101.88, HBD=3, MW=286.33, cLogD_ACD_v15=0.72,
+                                                              mbpKa=6.53), places=12)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, result['modules'])
+
+    def test002_runtime_import_time(self):
+        """
+        Importing the package and the scoring runtime takes a small fraction of importing the builder dependencies
+        """
+        result = _run_python("import json, time\n"
+                             "import numpy\n"
+                             "started = time.perf_counter()\n"
+                             "import pMPO, pMPO.runtime, pMPO.serialization\n"
+                             "runtime_seconds = time.perf_counter() - started\n"
+                             "started = time.perf_counter()\n"
+                             "import pandas, scipy.stats\n"
+                             "print(json.dumps({'runtime': runtime_seconds, 'builder': time.perf_counter() - started}))")
+        self.assertLess(result['runtime'], RUNTIME_IMPORT_BUDGET_FRACTION * result['builder'],
+                        "Importing the runtime took {:.1f} ms (Pandas and SciPy {:.1f} ms)"
+                        .format(1000 * result['runtime'], 1000 * result['builder']))
+
+    def test003_builder_exports(self):
+        """
+        The builder is still available from the package and the runtime classes from pMPO.pMPO
+        """
+        from pMPO import pMPOBuilder
+        self.assertIs(pMPOBuilder, pMPO.pMPO.pMPOBuilder)
+        self.assertIs(pMPO.pMPO.CompiledpMPOModel, pMPO.runtime.CompiledpMPOModel)
+        self.assertIs(pMPO.pMPO.ModelBank, pMPO.runtime.ModelBank)
+        self.assertIn('pMPOBuilder', dir(pMPO))
+        with self.assertRaises(AttributeError):
+            pMPO.pMPOBuilders
+
+
+if __name__ == '__main__':
+    unittest.main()
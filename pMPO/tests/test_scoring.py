@@ -0,0 +1,118 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.cli import main
+from pMPO.scoring import score_file
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_file_scoring(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.model = pMPOBuilder(cls.df.copy(), good_column='CNS', model_name='CNS pMPO').model
+        cls.expected = cls.model.score_frame(cls.df).values
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test001_csv_in_chunks(self):
+        """
+        Chunked CSV scoring matches scoring the whole DataFrame
+        """
+        input_path = os.path.join(self.directory, 'descriptors.csv')
+        output_path = os.path.join(self.directory, 'scores.csv')
+        self.df.to_csv(input_path, index=False)
+        report = score_file(self.model, input_path, output_path, chunksize=50, id_columns=['Drug'])
+        self.assertEqual(report['rows'], len(self.df))
+        self.assertEqual(report['descriptors_missing'], 0)
+        scores = pd.read_csv(output_path)
+        self.assertEqual(list(scores.columns), ['Drug', 'CNS pMPO'])
+        self.assertEqual(list(scores.Drug), list(self.df.Drug))
+        self.assertTrue(np.allclose(scores['CNS pMPO'].values, self.expected, rtol=1e-12))
+
+    def test002_command_line(self):
+        """
+        The pmpo score command scores a TSV file with a pickled model
+        """
+        model_path = os.path.join(self.directory, 'model.pkl')
+        input_path = os.path.join(self.directory, 'descriptors.tsv')
+        output_path = os.path.join(self.directory, 'scores.csv')
+        with open(model_path, 'wb') as f:
+            pickle.dump(self.model, f)
+        self.df.to_csv(input_path, sep='\t', index=False)
+        self.assertEqual(main(['score', model_path, input_path, output_path, '--chunksize', '64',
+                               '--score-column', 'score', '--quiet']), 0)
+        scores = pd.read_csv(output_path)
+        self.assertEqual(list(scores.columns), ['score'])
+        self.assertTrue(np.allclose(scores.score.values, self.expected, rtol=1e-12))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test003_parquet(self):
+        """
+        Parquet input is read in record batches and Parquet output is written incrementally
+        """
+        input_path = os.path.join(self.directory, 'descriptors.parquet')
+        output_path = os.path.join(self.directory, 'scores.parquet')
+        self.df.to_parquet(input_path, index=False)
+        score_file(self.model.compile(), input_path, output_path, chunksize=100, id_columns=['Drug'])
+        scores = pd.read_parquet(output_path)
+        self.assertEqual(list(scores.Drug), list(self.df.Drug))
+        self.assertTrue(np.allclose(scores['CNS pMPO'].values, self.expected, rtol=1e-12))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test004_empty_input(self):
+        """
+        Input without rows gives an output table with only its header
+        """
+        input_path = os.path.join(self.directory, 'empty.parquet')
+        self.df.iloc[:0].to_parquet(input_path, index=False)
+        for name in ('scores.csv', 'scores.parquet'):
+            output_path = os.path.join(self.directory, name)
+            report = score_file(self.model, input_path, output_path, id_columns=['Drug'])
+            self.assertEqual(report['rows'], 0)
+            scores = pd.read_csv(output_path) if name.endswith('.csv') else pd.read_parquet(output_path)
+            self.assertEqual((list(scores.columns), len(scores)), (['Drug', 'CNS pMPO'], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.cli import main
+from pMPO.screening import Screener, screen
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_screening(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.model = pMPOBuilder(df.copy(), good_column='CNS', model_name='CNS pMPO').model
+        columns = ['Drug', 'TPSA', 'HBD', 'MW', 'cLogD_ACD_v15', 'mbpKa']
+        # A larger library of jittered copies of the reference molecules, with some descriptors missing
+        rng = np.random.RandomState(42)
+        library = df[columns].sample(20000, replace=True, random_state=rng).reset_index(drop=True)
+        library[columns[1:]] += rng.normal(scale=0.5, size=(len(library), len(columns) - 1))
+        library.loc[rng.rand(len(library)) < 0.05, 'TPSA'] = np.nan
+        library['Drug'] = ['M{}'.format(idx) for idx in range(len(library))]
+        cls.library = library
+        cls.scores = cls.model.score_frame(library).values
+
+    def test001_top_k_matches_exhaustive_scoring(self):
+        """
+        The k best molecules and their scores are those of scoring everything, while most terms are skipped
+        """
+        result = screen(self.model, (self.library.iloc[start:start + 3000] for start in range(0, 20000, 3000)),
+                        k=100, id_column='Drug')
+        best = np.argsort(-self.scores, kind='mergesort')[:100]
+        self.assertEqual(list(result.rows), list(best))
+        self.assertEqual(list(result.ids), list(self.library.Drug.values[best]))
+        self.assertTrue(np.allclose(result.scores, self.scores[best], rtol=0, atol=1e-12))
+        stats = result.stats
+        self.assertEqual(stats['rows'], 20000)
+        self.assertEqual(stats['terms_total'], 20000 * len(self.model.descriptors))
+        self.assertGreater(stats['terms_skipped'], 0.3)
+        self.assertLessEqual(sum(stats['pruned'].values()), 20000 - 100)
+        self.assertAlmostEqual(stats['floor'], result.scores[-1])
+
+    def test002_threshold(self):
+        """
+        Threshold screening keeps exactly the molecules at or above the threshold, alone or with k
+        """
+        columns = ['TPSA', 'HBD', 'MW', 'cLogD_ACD_v15', 'mbpKa']
+        result = screen(self.model.compile(), self.library[columns].values, threshold=0.8, columns=columns)
+        expected = np.flatnonzero(self.scores >= 0.8)
+        self.assertEqual(sorted(result.rows), list(expected))
+        self.assertTrue(np.all(result.scores >= 0.8))
+        self.assertTrue(np.all(np.diff(result.scores) <= 0.0))
+        both = screen(self.model, self.library, k=10, threshold=0.8)
+        self.assertEqual(list(both.rows), list(result.rows[:10]))
+        self.assertEqual(len(screen(self.model, self.library, threshold=2.0)), 0)
+        with self.assertRaises(AssertionError):
+            Screener(self.model)
+
+    def test003_command_line(self):
+        """
+        The pmpo screen command writes the best molecules of a file with their ids
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            model_path = os.path.join(directory, 'model.pmpo')
+            input_path = os.path.join(directory, 'library.csv')
+            output_path = os.path.join(directory, 'best.csv')
+            self.model.compile().save(model_path)
+            self.library.to_csv(input_path, index=False)
+            self.assertEqual(main(['screen', model_path, input_path, output_path, '--top-k', '25', '--id-column',
+                                   'Drug', '--chunksize', '5000', '--quiet']), 0)
+            best = pd.read_csv(output_path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(list(best.columns), ['row', 'Drug', 'score'])
+        expected = np.argsort(-self.scores, kind='mergesort')[:25]
+        self.assertEqual(list(best.row), list(expected))
+        self.assertTrue(np.allclose(best.score.values, self.scores[expected], atol=1e-9))
+
+    def test004_no_sigmoidal_correction_extreme_values(self):
+        """
+        Without the sigmoidal correction, outlying descriptor values still get the scores of exhaustive scoring
+        """
+        df = pd.read_pickle(REFERENCE_DATAFRAME)
+        model = pMPOBuilder(df.copy(), good_column='CNS', model_name='CNS pMPO', sigmoidal_correction=False).model
+        library = self.library.head(1000).copy()
+        columns = [column for column in library.columns if column.upper() in model.descriptors]
+        library.loc[0, columns] = 1e6
+        library.loc[1, columns] = -1e6
+        scores = model.compile().score_frame(library).values
+        self.assertTrue(np.all(np.isfinite(scores)))
+        result = screen(model, library, k=5, id_column='Drug')
+        best = np.argsort(-scores, kind='mergesort')[:5]
+        self.assertEqual(list(result.rows), list(best))
+        self.assertTrue(np.allclose(result.scores, scores[best], rtol=0, atol=1e-12))
+        everything = screen(model, library, threshold=0.0, id_column='Drug')
+        self.assertEqual(sorted(everything.rows), list(range(len(library))))
+        self.assertTrue(np.allclose(everything.scores, np.sort(scores)[::-1], rtol=0, atol=1e-12))
@@ -0,0 +1,129 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.pMPO import pMPOModel, CompiledpMPOModel
+from pMPO.serialization import ModelDirectory, load_model, save_model
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_serialization(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.model = pMPOBuilder(cls.df.copy(), good_column='CNS', model_name='CNS pMPO').model
+        cls.plain_model = pMPOBuilder(cls.df.copy(), good_column='CNS', model_name='CNS pMPO (plain)',
+                                      sigmoidal_correction=False, case_insensitive=False).model
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test001_json_round_trip(self):
+        """
+        A model read back from JSON has the same parameters, flags and scores
+        """
+        for model in (self.model, self.plain_model):
+            loaded = pMPOModel.from_json(model.to_json())
+            self.assertEqual(str(model), str(loaded))
+            self.assertEqual(model.to_json(), loaded.to_json())
+            self.assertEqual((model.case_insensitive, model.sigmoidal_correction),
+                             (loaded.case_insensitive, loaded.sigmoidal_correction))
+            self.assertTrue(np.array_equal(model.score_frame(self.df).values, loaded.score_frame(self.df).values))
+        with self.assertRaises(AssertionError):
+            pMPOModel.from_json('{"format": "other"}')
+
+    def test002_binary_round_trip(self):
+        """
+        A compiled model read back from the binary format has the same parameters and flags
+        """
+        for model in (self.model.compile(), self.plain_model.compile()):
+            buffer = model.to_bytes()
+            self.assertEqual(len(buffer) % 8, 0)
+            loaded = CompiledpMPOModel.from_bytes(buffer)
+            self.assertEqual((loaded.name, loaded.descriptors, loaded.case_insensitive, loaded.sigmoidal_correction),
+                             (model.name, model.descriptors, model.case_insensitive, model.sigmoidal_correction))
+            self.assertTrue(np.array_equal(loaded.parameters, model.parameters))
+        with self.assertRaises(AssertionError):
+            CompiledpMPOModel.from_bytes(b'not a model at all!!')
+
+    def test003_model_directory(self):
+        """
+        Models in a directory are found by name, loaded on first use and can be stacked into a bank
+        """
+        directory = ModelDirectory(self.directory)
+        directory.add(self.model)
+        directory.add(self.plain_model, fmt='json')
+        save_model(self.model, os.path.join(self.directory, 'pickled.pkl'))
+        self.assertEqual(directory.names(), ['CNS pMPO', 'CNS pMPO (plain)', 'pickled'])
+        self.assertNotIn('CNS pMPO', directory.models)
+        self.assertIsInstance(directory['CNS pMPO'], CompiledpMPOModel)
+        self.assertIsInstance(directory['CNS pMPO (plain)'], pMPOModel)
+        self.assertIsInstance(load_model(os.path.join(self.directory, 'pickled.pkl')), pMPOModel)
+        self.assertIn('CNS pMPO', directory.models)
+        self.assertNotIn('missing', directory)
+        with self.assertRaises(KeyError):
+            directory['missing']
+        scores = directory.bank(['CNS pMPO', 'CNS pMPO (plain)']).score_frame(self.df)
+        self.assertTrue(np.allclose(scores['CNS pMPO (plain)'].values, self.plain_model.score_frame(self.df).values,
+                                    rtol=1e-12))
+
+    def test004_formats_from_extensions(self):
+        """
+        Model files are read in the format of their extension, pickles are never loaded from other extensions and a
+        missing model directory is only created on request
+        """
+        pickled = pickle.dumps(self.model, pickle.HIGHEST_PROTOCOL)
+        for name in ('pickled.pmpo', 'pickled.json', 'pickled.txt'):
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(pickled)
+        with self.assertRaises(AssertionError):
+            load_model(os.path.join(self.directory, 'pickled.pmpo'))
+        with self.assertRaises(AssertionError):
+            load_model(os.path.join(self.directory, 'pickled.json'))
+        with self.assertRaises(KeyError):
+            load_model(os.path.join(self.directory, 'pickled.txt'))
+        with self.assertRaises(AssertionError):
+            ModelDirectory(self.directory)['pickled']
+        missing = os.path.join(self.directory, 'missing')
+        with self.assertRaises(AssertionError):
+            ModelDirectory(missing)
+        self.assertFalse(os.path.exists(missing))
+        ModelDirectory(missing, create=True).add(self.model)
+        self.assertEqual(ModelDirectory(missing).names(), ['CNS pMPO'])
+
+
+if __name__ == '__main__':
+    unittest.main()
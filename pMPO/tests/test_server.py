@@ -0,0 +1,139 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from pMPO import pMPOBuilder
+from pMPO.server import Histogram, ScoringServer, ScoringClient, load_test
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_server(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        df = pd.read_pickle(REFERENCE_DATAFRAME)
+        cls.model = pMPOBuilder(df.copy(), good_column='CNS', model_name='CNS pMPO').model
+        cls.molecules = [{key: float(value) for key, value in row.items()}
+                         for row in df[['TPSA', 'HBD', 'MW', 'cLogD_ACD_v15', 'mbpKa']].to_dict('records')]
+
+    def run_server(self, coroutine, path: str=None, **kwargs):
+        """
+        Run a coroutine against a fresh server and return its result
+        """
+        async def run():
+            server = ScoringServer([self.model], **kwargs)
+            listener = await server.start(port=0, path=path)
+            port = None if path else listener.sockets[0].getsockname()[1]
+            try:
+                return await coroutine(server, port)
+            finally:
+                await server.close()
+        return asyncio.run(run())
+
+    def test001_histogram(self):
+        """
+        Histogram quantiles are the upper bounds of the buckets holding them
+        """
+        histogram = Histogram([1, 2, 4, 8])
+        for value in (0.5, 1.5, 1.5, 3, 100):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.quantile(0.2), 1)
+        self.assertEqual(histogram.quantile(0.5), 2)
+        self.assertEqual(histogram.quantile(0.8), 4)
+        self.assertEqual(histogram.quantile(1.0), 100)
+        self.assertEqual(histogram.summary()['buckets'], [[1, 1], [2, 2], [4, 1], [None, 1]])
+
+    def test002_concurrent_requests_are_batched(self):
+        """
+        Concurrent requests are coalesced into batches and score the same as the model
+        """
+        async def client_requests(server, port):
+            clients = [await ScoringClient.connect(port=port) for _ in range(16)]
+            scores = await asyncio.gather(*[client.score('CNS pMPO', molecule)
+                                            for client, molecule in zip(clients, self.molecules)])
+            batch_scores = await clients[0].score('CNS pMPO', self.molecules[:50])
+            for client in clients:
+                await client.close()
+            return scores, batch_scores, server.metrics()
+
+        scores, batch_scores, metrics = self.run_server(client_requests, max_wait=0.05)
+        for score, molecule in zip(scores, self.molecules):
+            self.assertAlmostEqual(score, self.model(**molecule), places=12)
+        self.assertTrue(np.allclose(batch_scores, [self.model(**molecule) for molecule in self.molecules[:50]],
+                                    rtol=1e-12))
+        self.assertEqual(metrics['requests'], {'CNS pMPO': 17})
+        self.assertEqual(metrics['molecules'], 66)
+        self.assertLess(metrics['batches'], 17)
+        self.assertEqual(metrics['batch_size']['count'], metrics['batches'])
+        self.assertEqual(metrics['latency']['count'], 17)
+
+    def test003_errors_and_routes(self):
+        """
+        Unknown models and paths are 404s, bad payloads are 400s, and the server keeps the connection open
+        """
+        async def client_requests(server, port):
+            client = await ScoringClient.connect(port=port)
+            responses = [await client.request('GET', '/models'),
+                         await client.request('POST', '/score/unknown', {'TPSA': 1.0}),
+                         await client.request('POST', '/score/CNS%20pMPO', [{'TPSA': 'high'}]),
+                         await client.request('POST', '/score/CNS%20pMPO', 5),
+                         await client.request('GET', '/score/CNS%20pMPO'),
+                         await client.request('GET', '/nowhere'),
+                         await client.request('GET', '/health'),
+                         await client.request('POST', '/score/CNS%20pMPO', {'unknown': 1.0})]
+            await client.close()
+            return responses
+
+        responses = self.run_server(client_requests)
+        self.assertEqual(responses[0], (200, {'models': ['CNS pMPO']}))
+        self.assertEqual([status for status, _ in responses[1:]], [404, 400, 400, 405, 404, 200, 200])
+        self.assertEqual(responses[-1][1], {'model': 'CNS pMPO', 'score': 0.0})
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'Unix sockets are not available')
+    def test004_unix_socket_load_test(self):
+        """
+        The load test client drives a server on a unix socket and reports throughput and latency
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'pmpo.sock')
+        try:
+            report = self.run_server(lambda server, port: load_test('CNS pMPO', self.molecules, path=path,
+                                                                    concurrency=8, requests=200, batch=4),
+                                     path=path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(report['molecules'], 800)
+        self.assertEqual(report['latency']['count'], 200)
+        self.assertEqual(report['server']['molecules'], 800)
+        self.assertGreater(report['requests_per_second'], 0.0)
+        self.assertLessEqual(report['server']['batch_size']['max'], 256)
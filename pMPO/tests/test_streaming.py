@@ -0,0 +1,176 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import unittest
+import numpy as np
+import pandas as pd
+from io import StringIO
+from pMPO import pMPOBuilder
+from pMPO.pMPO import welch_ttest
+from pMPO.streaming import PairwiseComoments, pMPOStreamingBuilder, pMPOIncrementalBuilder
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME, assert_progress_events
+
+########################################################################################################################
+########################################################################################################################
+
+
+def _chunks(df: pd.DataFrame, chunksize: int):
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+class test_suite001_streaming_builder(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO')
+
+    def test001_pairwise_correlation(self):
+        """
+        Chunked pairwise-complete correlation matches DataFrame.corr()
+        """
+        columns = ['TPSA', 'mapKa', 'mbpKa', 'cLogD_ACD_v15', 'MW']
+        comoments = PairwiseComoments(columns)
+        for chunk in _chunks(self.df, 97):
+            comoments.update(chunk[columns].values.astype(np.float64))
+        self.assertTrue(np.allclose(comoments.correlation().values, self.df[columns].corr().values,
+                                    rtol=1e-10, atol=1e-12))
+
+    def test002_streaming_matches_in_memory(self):
+        """
+        The streaming builder reproduces the statistics, correlation and model of the in-memory builder
+        """
+        for streaming in (pMPOStreamingBuilder(lambda: _chunks(self.df, 100), good_column='CNS',
+                                               model_name='CNS pMPO'),
+                          pMPOStreamingBuilder(_chunks(self.df, 100), good_column='CNS', model_name='CNS pMPO',
+                                               full_correlation=True)):
+            self.assertEqual(streaming.nrows, len(self.df))
+            self.assertEqual(list(self.builder.statistics.name), list(streaming.statistics.name))
+            for col in self.builder.statistics.columns.drop('name'):
+                self.assertTrue(np.allclose(self.builder.statistics[col].values.astype(float),
+                                            streaming.statistics[col].values.astype(float),
+                                            rtol=1e-9, equal_nan=True), col)
+            self.assertTrue(self.builder.correlation.index.equals(streaming.correlation.index))
+            self.assertTrue(np.allclose(self.builder.correlation.values, streaming.correlation.values, atol=1e-12))
+            self.assertEqual(str(self.builder.model), str(streaming.model))
+        # Without full_correlation only the significant descriptors have co-moments
+        self.assertEqual(streaming.comoments.names, list(streaming.columns))
+        two_pass = pMPOStreamingBuilder([self.df.iloc[:300], self.df.iloc[300:]], good_column='CNS',
+                                        model_name='CNS pMPO')
+        self.assertEqual(two_pass.comoments.names, list(self.builder.correlation.index))
+
+    def test003_streaming_from_csv(self):
+        """
+        The streaming builder accepts the chunks of pd.read_csv
+        """
+        csv_text = self.df.drop(columns=['SMILES']).to_csv(index=False)
+        events = []
+        streaming = pMPOStreamingBuilder(lambda: pd.read_csv(StringIO(csv_text), chunksize=128), good_column='CNS',
+                                         model_name='CNS pMPO', progress=events.append)
+        self.assertEqual(self.builder.model.descriptors, streaming.model.descriptors)
+        # The builder state and the stage hooks are shared with pMPOBuilder
+        self.assertEqual(list(streaming.profile), ['statistics', 'correlation', 'selection', 'model'])
+        assert_progress_events(self, events)
+        self.assertIn({'stage': 'statistics', 'done': 640, 'total': None, 'unit': 'rows'}, events)
+        self.assertIn({'stage': 'statistics', 'done': len(self.df), 'total': None, 'unit': 'rows'}, events)
+        self.assertIn({'stage': 'correlation', 'done': len(self.df), 'total': len(self.df), 'unit': 'rows'}, events)
+        self.assertEqual((streaming.lean, streaming.inplace, streaming.labels, streaming.cache),
+                         (False, False, None, None))
+
+    def test004_no_chunks(self):
+        with self.assertRaises(AssertionError):
+            pMPOStreamingBuilder(lambda: iter([]), good_column='CNS', model_name='CNS pMPO')
+        # Chunks that can only be read once need full_correlation
+        with self.assertRaises(AssertionError):
+            pMPOStreamingBuilder(_chunks(self.df, 100), good_column='CNS', model_name='CNS pMPO')
+
+
+class test_suite002_incremental_builder(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+        self.first = self.df.iloc[:400]
+        self.second = self.df.iloc[400:]
+
+    def _assert_same_build(self, expected: pMPOBuilder, actual: pMPOBuilder):
+        self.assertEqual(list(expected.statistics.name), list(actual.statistics.name))
+        for col in ('p_value', 'good_mean', 'good_std', 'bad_mean', 'bad_std', 'cutoff', 'b', 'c', 'z', 'w'):
+            self.assertTrue(np.allclose(expected.statistics[col].values.astype(float),
+                                        actual.statistics[col].values.astype(float), rtol=1e-8, equal_nan=True), col)
+        self.assertTrue(np.allclose(expected.correlation.values, actual.correlation.values, atol=1e-10))
+        self.assertEqual(str(expected.model), str(actual.model))
+
+    def test005_update(self):
+        """
+        Adding compounds gives the same model as building on all of them
+        """
+        incremental = pMPOIncrementalBuilder(self.first, good_column='CNS', model_name='CNS pMPO')
+        incremental.update(self.second)
+        self._assert_same_build(pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO'), incremental)
+
+    def test006_remove(self):
+        """
+        Removing compounds gives the same model as building without them
+        """
+        incremental = pMPOIncrementalBuilder(self.df, good_column='CNS', model_name='CNS pMPO')
+        incremental.remove(self.second)
+        self.assertEqual(incremental.nrows, len(self.first))
+        self._assert_same_build(pMPOBuilder(self.first.copy(), good_column='CNS', model_name='CNS pMPO'),
+                                incremental)
+
+    def test007_decay(self):
+        """
+        With decay the earlier compounds are down-weighted and can still be removed
+        """
+        incremental = pMPOIncrementalBuilder(self.first, good_column='CNS', model_name='CNS pMPO', decay=0.5)
+        incremental.update(self.second)
+        stats = incremental.statistics.set_index('name')
+        expected = 0.5 * self.first.TPSA[self.first.CNS].count() + self.second.TPSA[self.second.CNS].count()
+        self.assertAlmostEqual(stats.loc['TPSA', 'good_nsamples'], expected)
+        with self.assertRaises(AssertionError):
+            incremental.remove(self.first)
+        incremental.remove(self.first, added_at=0)
+        self._assert_same_build(pMPOBuilder(self.second.copy(), good_column='CNS', model_name='CNS pMPO'),
+                                incremental)
+
+    def test008_decay_effective_counts(self):
+        """
+        With decay the fractional effective counts are kept, filtered by min_samples and used in the Welch t-test
+        """
+        rng = np.random.RandomState(5)
+        first = pd.DataFrame({'good': np.repeat([True, False], 15), 'x': rng.normal(size=30),
+                              'y': rng.normal(size=30)})
+        first.loc[first.good, ['x', 'y']] += 2.0
+        second = first.copy()
+        second['x'] = np.nan
+        incremental = pMPOIncrementalBuilder(first, good_column='good', model_name='pMPO', decay=0.5)
+        self.assertEqual(sorted(incremental.statistics.name), ['x', 'y'])
+        incremental.update(second)
+        stats = incremental.statistics.set_index('name')
+        # x only has its 15 rows per group from the first update at half weight: 7.5 samples < min_samples
+        self.assertEqual(list(stats.index), ['y'])
+        y = stats.loc['y']
+        self.assertEqual((y.good_nsamples, y.bad_nsamples), (22.5, 22.5))
+        n = y.good_nsamples
+        expected = welch_ttest(y.good_mean, y.good_std ** 2 * n / (n - 1.0), n,
+                               y.bad_mean, y.bad_std ** 2 * n / (n - 1.0), n)
+        self.assertAlmostEqual(y.p_value, float(expected), places=14)
@@ -0,0 +1,81 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import unittest
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from pMPO import pMPOBuilder
+from pMPO.resampling import roc_auc
+from pMPO.sweep import sweep_cutoffs
+from pMPO.tests.test_pMPO import REFERENCE_DATAFRAME
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_sweep(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(REFERENCE_DATAFRAME)
+
+    def test001_sweep_matches_builders(self):
+        """
+        Every configuration of a sweep selects, weights and scores like a builder run with the same cutoffs
+        """
+        sweep = sweep_cutoffs(self.df, 'CNS', p_cutoffs=(1e-6, 0.01, 0.05), q_cutoffs=(0.01, 0.05),
+                              r2_cutoffs=(0.2, 0.53))
+        self.assertEqual(len(sweep), 12)
+        for _, row in sweep.iterrows():
+            builder = pMPOBuilder(self.df.copy(), good_column='CNS', model_name='CNS pMPO', p_cutoff=row.p_cutoff,
+                                  q_cutoff=row.q_cutoff, r2_cutoff=row.r2_cutoff)
+            selected = builder.statistics[(builder.statistics.selected == True)]
+            self.assertEqual(row.selected, selected.name.tolist())
+            self.assertEqual(row.n_significant, builder.statistics.significant.sum())
+            for name, w in zip(selected.name, selected.w):
+                self.assertAlmostEqual(row.weights[name], w, places=12)
+            self.assertAlmostEqual(row.metric, roc_auc(builder.model.score_frame(self.df).values,
+                                                       self.df.CNS.values), places=12)
+
+    def test002_tied_p_values(self):
+        """
+        Descriptors with tied p-values keep their own r^2 values in the greedy selection
+        """
+        rng = np.random.RandomState(11)
+        good = np.repeat([True, False], 400)
+        data = OrderedDict()
+        for idx in range(60):
+            base = np.where(good, 10.0, 0.0) + rng.normal(size=len(good)) * (1.0 + 0.01 * idx)
+            data['d{:02d}a'.format(idx)] = base
+            data['d{:02d}b'.format(idx)] = base + rng.normal(scale=0.05, size=len(good))
+        df = pd.DataFrame(data)
+        df['good'] = good
+        sweep = sweep_cutoffs(df, 'good', r2_cutoffs=(0.53,))
+        builder = pMPOBuilder(df.copy(), good_column='good', model_name='pMPO')
+        self.assertEqual((builder.statistics.p_value == 0.0).sum(), 120)
+        selected = builder.statistics[(builder.statistics.selected == True)].name.tolist()
+        self.assertEqual(sweep.selected[0], selected)
+        self.assertEqual(len(set(name[:3] for name in selected)), len(selected))
+
+
+if __name__ == '__main__':
+    unittest.main()
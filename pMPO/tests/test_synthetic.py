@@ -0,0 +1,86 @@
+# Apache License 2.0
+#
+# Copyright (c) 2017 Merck Sharp & Dohme Corp. a subsidiary of Merck & Co., Inc., Kenilworth, NJ, USA.
+# Written by Scott Arne Johnson <scott.johnson6@merck.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the LICENSE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+from pMPO import pMPOBuilder
+from pMPO.synthetic import make_descriptor_table
+from pMPO.tests.test_runtime import PACKAGE_ROOT
+
+########################################################################################################################
+########################################################################################################################
+
+
+class test_suite001_synthetic_tables(unittest.TestCase):
+
+    def test001_table_properties(self):
+        """
+        Synthetic tables have the requested size, missing values, class balance and block correlation
+        """
+        df, informative = make_descriptor_table(nrows=20000, ncolumns=12, missing_rate=0.1, correlation=0.6,
+                                                block_size=4, good_fraction=0.3, informative_fraction=0.25,
+                                                random_state=0, return_informative=True)
+        self.assertEqual(df.shape, (20000, 13))
+        self.assertEqual(len(informative), 3)
+        descriptors = df.drop(columns=['good'])
+        self.assertAlmostEqual(descriptors.isnull().values.mean(), 0.1, delta=0.01)
+        self.assertAlmostEqual(df.good.mean(), 0.3, delta=0.02)
+        # Only look at the bad molecules so the informative shifts do not disturb the correlation
+        r = descriptors[~df.good].corr().values
+        same_block = np.equal.outer(np.arange(12) // 4, np.arange(12) // 4) & ~np.eye(12, dtype=bool)
+        self.assertTrue(np.allclose(r[same_block], 0.6, atol=0.05))
+        self.assertTrue(np.allclose(r[~same_block & ~np.eye(12, dtype=bool)], 0.0, atol=0.05))
+        builder = pMPOBuilder(df, 'good', 'synthetic', inplace=False)
+        self.assertTrue(set(builder.model.descriptors) <= {name.upper() for name in informative})
+
+    def test002_benchmark_smoke(self):
+        """
+        The benchmark runner writes a report that compares cleanly against itself
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = PACKAGE_ROOT
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            subprocess.check_call([sys.executable, '-W', 'ignore', '-m', 'benchmarks.run', '--preset', 'tiny',
+                                   '--rows', '300', '--repeat', '1', '--scalar-rows', '10', '--output', path],
+                                  env=env, cwd=PACKAGE_ROOT, stderr=subprocess.DEVNULL)
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual(report['config']['nrows'], 300)
+            self.assertEqual(list(report['results']), ['calculate_descriptor_statistics', 'pick_uncorrelated_columns',
+                                                       'pMPOBuilder', 'pMPOBuilder.model', 'score_scalar',
+                                                       'score_frame', 'score_frame_compiled'])
+            self.assertTrue(all(result['peak_bytes'] > 0 for result in report['results'].values()))
+            subprocess.check_call([sys.executable, '-m', 'benchmarks.compare', path, path, '--threshold', '1.0'],
+                                  env=env, cwd=PACKAGE_ROOT, stdout=subprocess.DEVNULL)
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
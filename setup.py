@@ -17,8 +17,12 @@ setup(
     author='Scott Arne Johnson',
     author_email='scott.johnson6@merck.com',
     description='Probabilistic MPO models',
+    python_requires='>=3.8',
     install_requires=['numpy>=1.11.3', 'scipy>=0.18.1', 'pandas>=0.19.2', 'statsmodels>=0.6.1'],
     test_suite='pMPO.tests',
+    entry_points={
+        'console_scripts': ['pmpo = pMPO.cli:main']
+    },
     classifiers=[
         'License :: OSI Approved :: Apache Software License'
     ]